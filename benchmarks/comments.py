@@ -0,0 +1,95 @@
+"""
+Regression corpus of documentation comments, each with the text the parser must extract for it.
+The expected texts are those of the original regex parser, without its leading blank paragraphs.
+Run from anywhere with: python benchmarks/comments.py
+Exits non-zero if a comment is lost or its text changes
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.parsers import FileParser
+
+# name, source, {"module:", "type:" or "procedure:" and the name: the expected comment}
+CASES = [
+    (
+        "procedure_comment_after_header",
+        "module m\ncontains\nsubroutine GetNonLinRatios(this, State, CAMB_Pk)\n"
+        "! Fill the CAMB_Pk%nonlin_scaling array with sqrt(non-linear power/linear power)\n"
+        "! for each redshift and wavenumber\ninteger :: i\nend subroutine\nend module m\n",
+        {
+            "procedure:GetNonLinRatios": "Fill the CAMB_Pk%nonlin_scaling array with "
+            "sqrt(non-linear power/linear power)\nfor each redshift and wavenumber"
+        },
+    ),
+    (
+        "procedure_comment_after_blank_line",
+        "module m\ncontains\nfunction wk_tophat(x)\n\n! The normalised Fourier Transform of a top-hat\n"
+        "real :: wk_tophat, x\nend function\nend module m\n",
+        {"procedure:wk_tophat": "The normalised Fourier Transform of a top-hat"},
+    ),
+    (
+        "procedure_trailing_comment",
+        "module m\ncontains\nsubroutine s(a) ! first line\n! second line\ninteger :: a\nend subroutine\nend module m\n",
+        {"procedure:s": "first line\nsecond line"},
+    ),
+    (
+        "procedure_without_comment",
+        "module m\ncontains\nsubroutine s(a)\ninteger :: a\nend subroutine\nend module m\n",
+        {"procedure:s": ""},
+    ),
+    (
+        "module_comment_after_blank_line",
+        "module m\n\n!     This code evolves the linearized perturbation equations,\n"
+        "!     the Boltzmann equations\nimplicit none\nend module m\n",
+        {"module:m": "This code evolves the linearized perturbation equations,\nthe Boltzmann equations"},
+    ),
+    (
+        "type_comment_paragraphs",
+        "module m\ntype, extends(TBase) :: THalo\n!! Per-redshift quantities\n!!\n!! Held locally\n"
+        "integer :: a\nend type THalo\nend module m\n",
+        {"type:THalo": "Per-redshift quantities\n\nHeld locally"},
+    ),
+    (
+        "type_trailing_comment",
+        "module m\ntype T ! only trailing\ninteger :: a\nend type T\nend module m\n",
+        {"type:T": "only trailing"},
+    ),
+]
+
+
+def comments(parsedFile):
+    # the comment of each module, type and procedure of the file, by kind and name
+    found = {}
+    for module in parsedFile.modules:
+        found[f"module:{module.name}"] = module.comment
+        for dbclass in module.classes:
+            found[f"type:{dbclass.name}"] = dbclass.comment
+        for subroutine in module.subroutines:
+            found[f"procedure:{subroutine.name}"] = subroutine.comment
+    return found
+
+
+def run():
+    failures = []
+    for name, source, expected in CASES:
+        found = comments(FileParser.parse(source, []))
+        problems = [
+            f"{key} is {found.get(key)!r}, expected {text!r}"
+            for key, text in expected.items()
+            if found.get(key) != text
+        ]
+        print(f"{name:36s} {'FAILED: ' + '; '.join(problems) if problems else 'ok'}")
+        if problems:
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    failed = run()
+    if failed:
+        print(f"{len(failed):d} cases failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("All cases passed")
@@ -0,0 +1,93 @@
+"""
+Checks that incremental builds give the same pages as full builds. Each case builds a small source tree,
+changes it, and compares an incremental build over the first output with a full build of the changed tree.
+Run from anywhere with: python benchmarks/incremental.py
+Exits non-zero if a page differs
+"""
+
+import contextlib
+import filecmp
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fordocs
+
+# written by every build, with what the pages were rendered from
+MANIFEST = ".fordocs_manifest.json"
+
+SOURCES = {
+    "constants.f90": "module Constants\n! Physical constants\nreal, parameter :: c = 2.99792458e8\n"
+    "end module Constants\n",
+    "recombination.f90": "module Recombination\n! Ionization history\nuse Constants\nimplicit none\n"
+    "type :: TRecombination\n  real :: z\nend type TRecombination\nend module Recombination\n",
+    "main.f90": "module Main\n! Uses both\nuse iso_c_binding\nuse Constants\nuse Recombination\nimplicit none\n"
+    "type, extends(TRecombination) :: TMain\n  integer :: n\nend type TMain\nend module Main\n",
+}
+
+# name, the files to write over SOURCES, or None to delete
+CASES = [
+    ("comment_change", {"constants.f90": SOURCES["constants.f90"].replace("Physical", "Fundamental")}),
+    (
+        # its dependencies come first in a full build, which must not reorder those of the other files
+        "new_file_parsed_earlier",
+        {"aaa.f90": "module Early\nuse Recombination\nuse Extra\nend module Early\n"},
+    ),
+    (
+        "new_derived_type",
+        {"main.f90": SOURCES["main.f90"].replace("end module", "type, extends(TMain) :: TLast\nend type\nend module")},
+    ),
+    ("removed_file", {"main.f90": None}),
+]
+
+
+def _write(directory, sources):
+    for name, text in sources.items():
+        path = os.path.join(directory, name)
+        if text is None:
+            os.remove(path)
+        else:
+            with open(path, "w") as f:
+                f.write(text)
+
+
+def _build(sourceDirectory, outputDirectory, incremental):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fordocs.generate_docs([sourceDirectory], outputDirectory, "*.f90", incremental=incremental)
+
+
+def _differences(comparison, prefix=""):
+    # the pages only in one output or different in both
+    found = [prefix + name for name in comparison.left_only + comparison.right_only + comparison.diff_files]
+    for name, subdirectory in comparison.subdirs.items():
+        found.extend(_differences(subdirectory, prefix + name + "/"))
+    return found
+
+
+def run():
+    failures = []
+    for name, changes in CASES:
+        with tempfile.TemporaryDirectory() as directory:
+            source, incremental, full = (os.path.join(directory, part) for part in ("src", "incremental", "full"))
+            os.mkdir(source)
+            _write(source, SOURCES)
+            _build(source, incremental, False)
+            _write(source, changes)
+            _build(source, incremental, True)
+            _build(source, full, False)
+            differences = _differences(filecmp.dircmp(incremental, full, ignore=[MANIFEST]))
+        print(f"{name:28s} {'FAILED: ' + ', '.join(sorted(differences)) + ' differ' if differences else 'ok'}")
+        if differences:
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    failed = run()
+    if failed:
+        print(f"{len(failed):d} cases failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("All cases passed")
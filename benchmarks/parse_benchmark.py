@@ -0,0 +1,124 @@
+"""
+Parser throughput benchmark over synthetic Fortran from benchmarks/synthetic.py.
+Times each stage of parsing and FileParser.parse end to end at growing source sizes, and reports
+lines/second and the scaling exponent k of time ~ lines^k (1 is linear).
+Run from anywhere with: python benchmarks/parse_benchmark.py [options], see --help
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import DEFINES, syntheticSource
+
+from lib.parsers import BlockParser, FileParser, LineParser
+from lib.preprocessor import Preprocessor
+from lib.scanner import StatementScanner
+
+# each stage is given the preprocessed source, except those that preprocess it themselves
+PARSERS = {
+    "FileParser.parse": lambda source, preprocessed: FileParser.parse(source, DEFINES),
+    "Preprocessor": lambda source, preprocessed: Preprocessor(DEFINES).process(source),
+    "StatementScanner": lambda source, preprocessed: list(StatementScanner.scan(preprocessed.split("\n"))),
+    "BlockParser": lambda source, preprocessed: BlockParser.parse(preprocessed),
+    "LineParser": lambda source, preprocessed: LineParser.parse(preprocessed),
+}
+
+# the options --scale can grow, and their syntheticSource parameter
+SCALABLE = {
+    "modules": "modules",
+    "types": "types",
+    "bound_procedures": "boundProcedures",
+    "arguments": "arguments",
+    "continuations": "continuations",
+    "ifdefs": "ifdefs",
+    "body_lines": "bodyLines",
+}
+
+
+def timeParser(parse, source, preprocessed, repeat):
+    # the best of repeat runs, in seconds, after a run to warm up the regex and allocator caches
+    parse(source, preprocessed)
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(source, preprocessed)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scalingExponent(lineCounts, seconds):
+    # least squares slope of log(seconds) against log(lines)
+    points = [(math.log(lines), math.log(max(value, 1e-9))) for lines, value in zip(lineCounts, seconds)]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return math.nan
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def run(settings, scale, sizes, parserNames, repeat):
+    """
+    Returns {parser name: (lines/second at the largest size, scaling exponent)}
+    settings:
+        syntheticSource keyword arguments for size 1. The scale one is multiplied by each of sizes
+    """
+    sources = []
+    for size in sizes:
+        source = syntheticSource(**dict(settings, **{scale: settings[scale] * size}))
+        sources.append((source, FileParser.parse_conditionals(source, DEFINES), source.count("\n")))
+    line_counts = [lines for _, _, lines in sources]
+    print(f"Scaling {scale} by {', '.join(str(size) for size in sizes)}: {', '.join(map(str, line_counts))} lines")
+    print(f"{'parser':24s}" + "".join(f"{lines:>10d}" for lines in line_counts) + f"{'lines/s':>12s}{'exponent':>10s}")
+    results = {}
+    for name in parserNames:
+        seconds = [timeParser(PARSERS[name], source, preprocessed, repeat) for source, preprocessed, _ in sources]
+        rate = line_counts[-1] / max(seconds[-1], 1e-9)
+        exponent = scalingExponent(line_counts, seconds)
+        results[name] = (rate, exponent)
+        print(f"{name:24s}" + "".join(f"{value:9.3f}s" for value in seconds) + f"{rate:12.0f}{exponent:10.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parser throughput and scaling benchmark")
+    parser.add_argument("--modules", type=int, default=2)
+    parser.add_argument("--types", type=int, default=4, help="derived types per module")
+    parser.add_argument("--extends_depth", type=int, default=3, help="length of the inheritance chains")
+    parser.add_argument("--bound_procedures", type=int, default=3, help="type-bound procedures per type")
+    parser.add_argument("--arguments", type=int, default=6, help="dummy arguments per procedure")
+    parser.add_argument("--continuations", type=int, default=2, help="continuation lines per procedure header")
+    parser.add_argument("--ifdefs", type=int, default=2, help="#ifdef blocks per procedure")
+    parser.add_argument("--body_lines", type=int, default=20, help="executable statements per procedure")
+    parser.add_argument("--scale", default="types", choices=list(SCALABLE), help="the parameter grown between runs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="factors applied to --scale")
+    parser.add_argument("--parsers", nargs="+", choices=list(PARSERS), default=list(PARSERS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is kept")
+    parser.add_argument(
+        "--max_exponent",
+        type=float,
+        help="exit with an error if a parser scales worse than lines^MAX_EXPONENT, to catch superlinear regressions",
+    )
+    args = parser.parse_args()
+    settings = {
+        "modules": args.modules,
+        "types": args.types,
+        "extendsDepth": args.extends_depth,
+        "boundProcedures": args.bound_procedures,
+        "arguments": args.arguments,
+        "continuations": args.continuations,
+        "ifdefs": args.ifdefs,
+        "bodyLines": args.body_lines,
+    }
+    results = run(settings, SCALABLE[args.scale], sorted(args.sizes), args.parsers, args.repeat)
+    if args.max_exponent is not None:
+        too_slow = [name for name, (_, exponent) in results.items() if exponent > args.max_exponent]
+        if too_slow:
+            print(f"Scaling worse than lines^{args.max_exponent:g}: {', '.join(too_slow)}")
+            sys.exit(1)
@@ -0,0 +1,172 @@
+"""
+Regression corpus of pathological Fortran inputs, each with a time limit for parsing it.
+Run from anywhere with: python benchmarks/pathological.py [--slack FACTOR]
+Exits non-zero if a case is too slow, loses the names it should find, or doesn't fall back when it should.
+Limits are for a typical desktop machine, use --slack to scale them on slower ones
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.parsers import FileParser
+
+# a time budget well below the default, so the fallback cases don't make the run slow
+TIME_BUDGET = 2.0
+# for the cases that must fall back to the LineParser, a budget no parse can meet
+FALLBACK_BUDGET = 0.001
+
+
+def _procedures(count):
+    return "".join(
+        f"subroutine s{i}(a, b)\n! comment {i}\ninteger, intent(in) :: a\nreal, intent(out) :: b\n"
+        f"b = a\nend subroutine s{i}\n"
+        for i in range(count)
+    )
+
+
+# name, source, seconds allowed, whether the time budget must run out, and the names the result must contain, as
+# "module:", "type:" or "procedure:" and the name
+CASES = [
+    (
+        "unterminated_types",
+        "module m\n"
+        + "".join(f"type :: t{i}\n  integer :: a\n" for i in range(2000))
+        + "contains\n"
+        + _procedures(1000),
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "long_continuation",
+        "module m\ncontains\nsubroutine s(a)\nreal :: a(20000) = [ &\n"
+        + "  1.0, 2.0, 3.0, 4.0, 5.0, &\n" * 4000
+        + " 6.0]\nend subroutine\nend module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "nested_parentheses",
+        "module m\ncontains\nsubroutine s(a)\nreal :: a = "
+        + "f(" * 3000
+        + "1"
+        + ")" * 3000
+        + "\nend subroutine\nend module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "many_variables",
+        "module m\ntype t\ninteger :: " + ", ".join(f"a{i}(n)" for i in range(30000)) + "\nend type\nend module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "unbalanced_quote",
+        "module m\ncontains\nsubroutine s(a)\ncharacter(*) :: a = 'abc &\n"
+        + "  more text! not a comment & \n" * 3000
+        + "\nend subroutine\nend module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    ("many_procedures", "module m\ncontains\n" + _procedures(5000) + "end module m\n", 5.0, False, ("module:m",)),
+    (
+        "long_comment_header",
+        "module m\n" + "! comment line with type and subroutine words\n" * 50000 + "end module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "unterminated_subroutines",
+        "module m\ncontains\n" + "".join(f"subroutine s{i}(a)\ninteger a\n" for i in range(3000)) + "end module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "unclosed_argument_list",
+        "module m\ncontains\n subroutine s(" + "a, " * 20000 + "b\nend module\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        "nested_conditionals",
+        "module m\n" + "#ifdef A\n" * 300 + "integer :: x\n" + "#endif\n" * 300 + "end module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        # backtracked catastrophically in the declaration regex, which only the budget stopped, outside
+        # the main thread or on Windows not even that
+        "backtracking_declaration",
+        "module m\ncontains\nsubroutine s(a)\nreal" + " " * 20000 + ")\nend subroutine\nend module m\n",
+        1.0,
+        False,
+        ("module:m",),
+    ),
+    (
+        # the names must survive the fallback, with a warning saying only they were extracted
+        "budget_exceeded",
+        "module m\nuse base\ntype, extends(TBase) :: t\n  integer :: a\ncontains\n  procedure :: s0\nend type t\n"
+        + "contains\n"
+        + _procedures(2000)
+        + "end module m\n",
+        1.0,
+        True,
+        ("module:m", "type:t", "procedure:s0", "procedure:s1999"),
+    ),
+]
+
+
+def names(parsedFile):
+    # the modules, types and procedures of the file, as in CASES
+    found = {f"procedure:{subroutine.name}" for subroutine in parsedFile.subroutines}
+    for module in parsedFile.modules:
+        found.add(f"module:{module.name}")
+        found.update(f"procedure:{subroutine.name}" for subroutine in module.subroutines)
+        for dbclass in module.classes:
+            found.add(f"type:{dbclass.name}")
+            found.update(f"procedure:{subroutine.name}" for subroutine in dbclass.subroutines)
+    return found
+
+
+def run(slack):
+    failures = []
+    for name, source, limit, times_out, expected in CASES:
+        start = time.perf_counter()
+        parsed_file = FileParser.parse(source, [], FALLBACK_BUDGET if times_out else TIME_BUDGET)
+        seconds = time.perf_counter() - start
+        problems = []
+        if seconds > limit * slack:
+            problems.append(f"took {seconds:.2f}s, limit {limit * slack:.2f}s")
+        if bool(parsed_file.warnings) != times_out:
+            problems.append("expected the time budget to run out" if times_out else str(parsed_file.warnings))
+        missing = set(expected) - names(parsed_file)
+        if missing:
+            problems.append(f"{', '.join(sorted(missing))} not found")
+        print(f"{name:28s} {seconds:7.3f}s  {'FAILED: ' + '; '.join(problems) if problems else 'ok'}")
+        if problems:
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks pathological inputs parse within their time limits")
+    parser.add_argument("--slack", type=float, default=1.0, help="factor applied to all the time limits")
+    args = parser.parse_args()
+    failed = run(args.slack)
+    if failed:
+        print(f"{len(failed):d} cases failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("All cases passed")
@@ -0,0 +1,119 @@
+"""
+Generator of synthetic Fortran sources for the benchmarks, with control over how many of each
+construct the parsers have to deal with
+"""
+
+# defined when preprocessing, so both branches of the #ifdef blocks are exercised
+DEFINES = ["SYNTHETIC_ON"]
+
+
+def syntheticSource(
+    modules=4,
+    types=6,
+    extendsDepth=3,
+    boundProcedures=4,
+    arguments=6,
+    continuations=2,
+    ifdefs=2,
+    bodyLines=20,
+):
+    """
+    Returns the text of one Fortran file
+    modules:
+        Number of modules, each using the previous one
+    types:
+        Derived types per module. Every run of extendsDepth types forms an inheritance chain
+    boundProcedures:
+        Type-bound procedures per type, each implemented by a module procedure
+    arguments:
+        Dummy arguments per procedure, besides the passed object
+    continuations:
+        Continuation lines the argument list of each procedure header is split over
+    ifdefs:
+        #ifdef/#else/#endif blocks in each procedure body
+    bodyLines:
+        Executable statements in each procedure body
+    """
+    lines = ["! Synthetic benchmark source", "! generated by benchmarks/synthetic.py", ""]
+    for module_index in range(modules):
+        lines.extend(
+            _module(module_index, types, extendsDepth, boundProcedures, arguments, continuations, ifdefs, bodyLines)
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _module(index, types, extendsDepth, boundProcedures, arguments, continuations, ifdefs, bodyLines):
+    name = f"SynthMod{index}"
+    lines = [f"module {name}", f"! Module {index} comment", "use iso_c_binding"]
+    if index:
+        lines.append(f"use SynthMod{index - 1}, only: Synth{index - 1}_0")
+    lines.extend(["implicit none", "private", ""])
+    procedures = []  # (type name, procedure name)
+    for type_index in range(types):
+        type_name = f"Synth{index}_{type_index}"
+        if type_index % max(extendsDepth, 1):
+            lines.append(f"type, extends(Synth{index}_{type_index - 1}) :: {type_name}")
+        else:
+            lines.append(f"type :: {type_name}")
+        lines.append(f"! Type {type_name} comment")
+        lines.append(f"    real(dl) :: value{type_index} = 0 ! a component")
+        lines.append(f"    integer, allocatable :: counts{type_index}(:)")
+        if boundProcedures:
+            lines.append("contains")
+        for procedure_index in range(boundProcedures):
+            procedure = f"{type_name}_Proc{procedure_index}"
+            lines.append(f"    procedure :: Proc{procedure_index} => {procedure}")
+            procedures.append((type_name, procedure))
+        lines.append(f"end type {type_name}")
+        lines.append(f"public {type_name}")
+        lines.append("")
+    if procedures:
+        lines.append(f"interface Synth{index}_Generic")
+        lines.append("    module procedure " + ", ".join(procedure for _, procedure in procedures[:4]))
+        lines.append("end interface")
+        lines.append("")
+    lines.append("contains")
+    lines.append("")
+    for type_name, procedure in procedures:
+        lines.extend(_procedure(type_name, procedure, arguments, continuations, ifdefs, bodyLines))
+    lines.append(f"end module {name}")
+    lines.append("")
+    return lines
+
+
+def _procedure(typeName, name, arguments, continuations, ifdefs, bodyLines):
+    argument_names = ["this"] + [f"arg{i}" for i in range(arguments)]
+    # the argument list split over the continuation lines
+    pieces = max(continuations, 0) + 1
+    per_line = -(-len(argument_names) // pieces)
+    chunks = [", ".join(argument_names[i : i + per_line]) for i in range(0, len(argument_names), per_line)]
+    header = f"subroutine {name}(" + ", &\n        ".join(chunks) + ")"
+    lines = [header, f"    ! Comment of {name}", "    ! over two lines"]
+    lines.append(f"    class({typeName}), intent(inout) :: this")
+    for i in range(arguments):
+        if i % 3 == 0:
+            lines.append(f"    real(dl), intent(in) :: arg{i} ! argument {i}")
+        elif i % 3 == 1:
+            lines.append(f"    integer, intent(out) :: arg{i}(:)")
+        else:
+            lines.append(f"    character(len=*), optional, intent(in) :: arg{i}")
+    lines.append("    real(dl) :: work, total(16)")
+    lines.append("    integer :: i")
+    for i in range(ifdefs):
+        lines.extend(
+            ["#ifdef SYNTHETIC_ON", f"    real(dl) :: extra{i}", "#else", f"    integer :: extra{i}", "#endif"]
+        )
+    for i in range(bodyLines):
+        if i % 4 == 0:
+            lines.append(f"    work = this%value0 * {i} + sum(total) ! step {i}")
+        elif i % 4 == 1:
+            lines.append(f"    call helper(work, total, {i}, 'label {i}')")
+        elif i % 4 == 2:
+            lines.append(f"    if (work > {i}) total({i % 16 + 1}) = work")
+        else:
+            lines.append("    do i = 1, 16")
+            lines.append("        total(i) = total(i) + i")
+            lines.append("    end do")
+    lines.append(f"end subroutine {name}")
+    lines.append("")
+    return lines
@@ -6,10 +6,7 @@ Fortran source code documentation generator; https://github.com/cmbant/fordocs
 
 """
 
-import time
-
-from lib.dbmaker import ModelFiller
-from lib.docmaker import HTMLDocMaker
+from lib.context import DocsContext
 
 NOISY = True
 
@@ -19,57 +16,151 @@ def generate_docs(
     destinationDirectory,
     match_pattern="*.*90",
     title="Fortran Documentation",
-    defines=[],
-    excludes=[],
+    defines=None,
+    excludes=None,
     excludes_file=None,
-    class_tree_splits=[],
+    class_tree_splits=None,
     github_root=None,
     github_subdir=None,
+    jobs=1,
+    cache_dir=None,
+    incremental=False,
+    encoding="utf-8",
+    parse_time_budget=30,
+    database=None,
+    backend="sqlite",
+    render_jobs=1,
+    template_cache_dir=None,
 ):
-    mf = ModelFiller(defines)
-    if NOISY:
-        print("Phase #1: Parsing source files into database")
-        t = time.time()
-    if excludes_file:
-        excludes.append(open(excludes_file).readlines())
-    mf.fillModel(sourceFolders=sourceDirectories, match=match_pattern, excludes=excludes)
-    if NOISY:
-        print(f"Phase #1: Finished <parsed {mf.fileCount():d} files in {(time.time() - t) / 60:.2f} minutes>")
-        print()
-        print("Phase #2: Generating documentation")
-
-    dm = HTMLDocMaker(destinationDirectory, title, class_tree_splits, github_root, sourceDirectories, github_subdir)
-    dm.makeDocs()
+    """
+    database:
+        Path of the SQLite file the parsed model is written to, so it can be rendered again with render_docs.
+        A temporary memory database if None
+    backend:
+        "sqlite" to keep the model in SQLite through the ORM, or "memory" for plain Python records,
+        which is faster but can't be written to a database
+    render_jobs:
+        Number of processes the pages are rendered in, 0 for one per CPU. The output is the same for any number
+    template_cache_dir:
+        Directory the compiled templates are kept in between runs, so they are not compiled again
+    Each call has its own lib.context.DocsContext, so calls in the same process, or in threads, are independent
+    """
+    with DocsContext(
+        database,
+        backend,
+        match_pattern=match_pattern,
+        title=title,
+        defines=defines,
+        excludes=excludes,
+        excludes_file=excludes_file,
+        class_tree_splits=class_tree_splits,
+        github_root=github_root,
+        github_subdir=github_subdir,
+        jobs=jobs,
+        cache_dir=cache_dir,
+        incremental=incremental,
+        encoding=encoding,
+        parse_time_budget=parse_time_budget,
+        render_jobs=render_jobs,
+        template_cache_dir=template_cache_dir,
+    ) as context:
+        context.generate(sourceDirectories, destinationDirectory)
     if NOISY:
-        print("Phase #2: Finished")
         print("Done")
 
 
-if __name__ == "__main__":
-    import argparse
+def parse_sources(
+    sourceDirectories,
+    database,
+    match_pattern="*.*90",
+    defines=None,
+    excludes=None,
+    excludes_file=None,
+    jobs=1,
+    cache_dir=None,
+    encoding="utf-8",
+    parse_time_budget=30,
+):
+    # phase #1 of generate_docs, replacing any model already in the database
+    with DocsContext(
+        database,
+        match_pattern=match_pattern,
+        defines=defines,
+        excludes=excludes,
+        excludes_file=excludes_file,
+        jobs=jobs,
+        cache_dir=cache_dir,
+        encoding=encoding,
+        parse_time_budget=parse_time_budget,
+    ) as context:
+        context.parse(sourceDirectories)
+
 
-    parser = argparse.ArgumentParser(description="Fortran Documentation generator")
+def render_docs(
+    destinationDirectory,
+    database,
+    title="Fortran Documentation",
+    class_tree_splits=None,
+    github_root=None,
+    github_subdir=None,
+    incremental=False,
+    render_jobs=1,
+    template_cache_dir=None,
+):
+    # phase #2 of generate_docs, from the model parse_sources put in the database
+    with DocsContext(
+        database,
+        mustExist=True,
+        title=title,
+        class_tree_splits=class_tree_splits,
+        github_root=github_root,
+        github_subdir=github_subdir,
+        incremental=incremental,
+        render_jobs=render_jobs,
+        template_cache_dir=template_cache_dir,
+    ) as context:
+        context.render(destinationDirectory)
+
+
+def _addParseArguments(parser):
+    parser.add_argument("--file_pattern", default="*.*90", help="File pattern to match (default: *.*90)")
+    parser.add_argument("--define", nargs="+", help="list of preprocessor definitions, as NAME or NAME=VALUE")
+    parser.add_argument("--excludes", nargs="+", help="list of file name patterns to exclude")
+    parser.add_argument("--excludes_file", help="file containing list of file names to exclude")
     parser.add_argument(
-        "source_folders",
-        nargs="+",
-        help="The directory in which to search for Fortran files, recursively",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes used to parse the source files, 0 for one per CPU",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="directory in which parse results are cached, so unchanged files are not parsed again on the next run",
     )
-    parser.add_argument("output_folder", help="The directory in which documentation will be generated")
-    parser.add_argument("--file_pattern", default="*.*90")
+    parser.add_argument(
+        "--encoding",
+        default="utf-8",
+        help="encoding of the source files. Bytes that are not valid in it are replaced",
+    )
+    parser.add_argument(
+        "--parse_time_budget",
+        type=float,
+        default=30,
+        help="seconds parsing one file may take before only the names in it are extracted, 0 for no limit",
+    )
+
+
+def _addRenderArguments(parser):
     parser.add_argument(
         "--title",
         default="Fortran Documentation",
         help="The title used in the documentation tab and index link",
     )
-    parser.add_argument("--define", nargs="+", help="list of preprocessor definitions")
     parser.add_argument(
         "--class_tree_splits",
         nargs="+",
         help="list of class names to show separately in class tree index (rather than as part of larger big tree)",
     )
-
-    parser.add_argument("--excludes", nargs="+", help="list of file name patterns to exclude")
-    parser.add_argument("--excludes_file", help="file containing list of file names to exclude")
     parser.add_argument(
         "--github_root",
         help="GitHub repository root URL for hyperlinking to source files (e.g., https://github.com/cmbant/camb)",
@@ -78,17 +169,122 @@ if __name__ == "__main__":
         "--github_subdir",
         help="Subdirectory within GitHub repository where source files are located (e.g., 'fortran' for CAMB)",
     )
-
-    args = parser.parse_args()
-    generate_docs(
-        args.source_folders,
-        args.output_folder,
-        match_pattern=args.file_pattern,
-        title=args.title,
-        defines=args.define,
-        excludes=args.excludes,
-        excludes_file=args.excludes_file,
-        class_tree_splits=args.class_tree_splits,
-        github_root=args.github_root,
-        github_subdir=args.github_subdir,
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only rewrite the pages that changed since the last build in output_folder",
     )
+    parser.add_argument(
+        "--render_jobs",
+        type=int,
+        default=1,
+        help="number of processes used to render the pages, 0 for one per CPU",
+    )
+    parser.add_argument(
+        "--template_cache_dir",
+        help="directory in which the compiled templates are cached, so they are not compiled again on the next run",
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    # "parse" and "render" run one phase against a --database, otherwise both run
+    command = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ("parse", "render") else None
+    if command == "parse":
+        parser = argparse.ArgumentParser(
+            prog="fordocs.py parse", description="Parse Fortran sources into a model database, for later rendering"
+        )
+        parser.add_argument(
+            "source_folders",
+            nargs="+",
+            help="The directory in which to search for Fortran files, recursively",
+        )
+        parser.add_argument("--database", required=True, help="SQLite file the parsed model is written to")
+        _addParseArguments(parser)
+    elif command == "render":
+        parser = argparse.ArgumentParser(
+            prog="fordocs.py render", description="Generate documentation from a parsed model database"
+        )
+        parser.add_argument("output_folder", help="The directory in which documentation will be generated")
+        parser.add_argument("--database", required=True, help="SQLite file written by fordocs.py parse")
+        _addRenderArguments(parser)
+    else:
+        parser = argparse.ArgumentParser(
+            description="Fortran Documentation generator",
+            epilog="Use 'fordocs.py parse -h' and 'fordocs.py render -h' to run only the parse or render phase",
+        )
+        parser.add_argument(
+            "source_folders",
+            nargs="+",
+            help="The directory in which to search for Fortran files, recursively",
+        )
+        parser.add_argument("output_folder", help="The directory in which documentation will be generated")
+        _addParseArguments(parser)
+        _addRenderArguments(parser)
+        parser.add_argument(
+            "--database",
+            help="SQLite file to keep the parsed model in, so it can be rendered again with 'fordocs.py render'",
+        )
+        parser.add_argument(
+            "--backend",
+            default="sqlite",
+            choices=["sqlite", "memory"],
+            help="where the model is kept while generating: SQLite through an ORM, or plain Python objects, "
+            "which is faster but can't be used with --database",
+        )
+
+    args = parser.parse_args(sys.argv[2:] if command else None)
+    if command == "parse":
+        parse_sources(
+            args.source_folders,
+            args.database,
+            match_pattern=args.file_pattern,
+            defines=args.define,
+            excludes=args.excludes,
+            excludes_file=args.excludes_file,
+            jobs=args.jobs,
+            cache_dir=args.cache_dir,
+            encoding=args.encoding,
+            parse_time_budget=args.parse_time_budget,
+        )
+    elif command == "render":
+        from lib.source_model import DatabaseError
+
+        try:
+            render_docs(
+                args.output_folder,
+                args.database,
+                title=args.title,
+                class_tree_splits=args.class_tree_splits,
+                github_root=args.github_root,
+                github_subdir=args.github_subdir,
+                incremental=args.incremental,
+                render_jobs=args.render_jobs,
+                template_cache_dir=args.template_cache_dir,
+            )
+        except DatabaseError as error:  # a missing or incompatible --database
+            sys.exit(f"fordocs.py render: {error}")
+    else:
+        generate_docs(
+            args.source_folders,
+            args.output_folder,
+            match_pattern=args.file_pattern,
+            title=args.title,
+            defines=args.define,
+            excludes=args.excludes,
+            excludes_file=args.excludes_file,
+            class_tree_splits=args.class_tree_splits,
+            github_root=args.github_root,
+            github_subdir=args.github_subdir,
+            jobs=args.jobs,
+            cache_dir=args.cache_dir,
+            incremental=args.incremental,
+            encoding=args.encoding,
+            parse_time_budget=args.parse_time_budget,
+            database=args.database,
+            backend=args.backend,
+            render_jobs=args.render_jobs,
+            template_cache_dir=args.template_cache_dir,
+        )
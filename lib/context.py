@@ -0,0 +1,143 @@
+import time
+
+from .dbmaker import ModelFiller
+from .docmaker import HTMLDocMaker, templateEnvironment
+from .memory_model import MemoryRepository
+
+NOISY = True
+
+
+class DocsContext:
+    """
+    One documentation generation: its options, the model with its database engine and session, and the
+    template environment. Contexts share no state, so several can run one after another, or at the same time
+    in different threads, in one process. Close it when done, or use it in a with statement
+    """
+
+    # the options and their defaults, see fordocs.generate_docs
+    PARSE_OPTIONS = {
+        "match_pattern": "*.*90",
+        "defines": [],
+        "excludes": [],
+        "excludes_file": None,
+        "jobs": 1,
+        "cache_dir": None,
+        "encoding": "utf-8",
+        "parse_time_budget": 30,
+    }
+    RENDER_OPTIONS = {
+        "title": "Fortran Documentation",
+        "class_tree_splits": [],
+        "github_root": None,
+        "github_subdir": None,
+        "incremental": False,
+        "render_jobs": 1,
+        "template_cache_dir": None,
+    }
+
+    def __init__(self, database=None, backend="sqlite", mustExist=False, **options):
+        """
+        database:
+            Path of the SQLite file holding the model, a temporary memory database if None
+        backend:
+            "sqlite" to keep the model in the database, or "memory" for plain Python records
+        mustExist:
+            Raise DatabaseError if there is no file at database, when only rendering
+        options:
+            Any of PARSE_OPTIONS and RENDER_OPTIONS
+        """
+        unknown = options.keys() - self.PARSE_OPTIONS.keys() - self.RENDER_OPTIONS.keys()
+        if unknown:
+            raise TypeError(f"Unknown options : {', '.join(sorted(unknown))}")
+        self.options = dict(self.PARSE_OPTIONS, **self.RENDER_OPTIONS)
+        for name, value in options.items():
+            if value is not None or not isinstance(self.options[name], list):  # None for a list is an empty one
+                self.options[name] = value
+        for name, value in self.options.items():  # lists of its own, never shared with the caller or the defaults
+            if isinstance(value, (list, tuple)):
+                self.options[name] = list(value)
+        if backend == "memory":
+            if database:
+                raise ValueError("The memory backend can't write a database")
+            self.database = None
+            self.repository = MemoryRepository()
+        elif backend == "sqlite":
+            from .source_model import Database  # only this backend needs SQLAlchemy
+            from .sql_model import SQLRepository
+
+            self.database = Database(database, mustExist)
+            self.repository = SQLRepository(self.database)
+        else:
+            raise ValueError(f"Unknown backend : {backend}")
+        self.environment = templateEnvironment(self.options["template_cache_dir"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.database:
+            self.database.close()
+
+    def generate(self, sourceDirectories, destinationDirectory):
+        self.parse(sourceDirectories)
+        if NOISY:
+            print()
+        self.render(destinationDirectory)
+
+    def parse(self, sourceDirectories):
+        # phase #1, replacing any model already there
+        options = self.options
+        mf = ModelFiller(
+            options["defines"],
+            options["jobs"],
+            options["cache_dir"],
+            options["encoding"],
+            options["parse_time_budget"],
+            self.repository,
+        )
+        if NOISY:
+            print("Phase #1: Parsing source files into database")
+            t = time.time()
+        excludes = list(options["excludes"])
+        if options["excludes_file"]:
+            with open(options["excludes_file"]) as fhandle:
+                excludes.extend(line.strip() for line in fhandle if line.strip())
+        mf.fillModel(sourceFolders=sourceDirectories, match=options["match_pattern"], excludes=excludes)
+        if NOISY:
+            print(f"Phase #1: Finished <parsed {mf.fileCount():d} files in {(time.time() - t) / 60:.2f} minutes>")
+            if mf.cachedFileCount():
+                print(f"Phase #1: {mf.cachedFileCount():d} files were unchanged and loaded from the parse cache")
+            if mf.failedFiles():
+                print(f"Phase #1: {len(mf.failedFiles()):d} files could not be parsed:")
+                for failed_file in mf.failedFiles():
+                    print(f"    {failed_file}")
+            if mf.fileWarnings():
+                print(f"Phase #1: {len(mf.fileWarnings()):d} files were only partly documented:")
+                for warned_file, warning in mf.fileWarnings():
+                    print(f"    {warned_file}: {warning}")
+
+    def render(self, destinationDirectory):
+        # phase #2, from the model of the last parse, in this process or into the database
+        options = self.options
+        if self.database:
+            self.database.check()
+        if NOISY:
+            print("Phase #2: Generating documentation")
+        dm = HTMLDocMaker(
+            destinationDirectory,
+            options["title"],
+            options["class_tree_splits"],
+            options["github_root"],
+            self.repository.modelInfo("source_directories"),
+            options["github_subdir"],
+            options["incremental"],
+            self.repository.snapshot(),
+            self.environment,
+            options["render_jobs"],
+        )
+        dm.makeDocs()
+        if NOISY:
+            print("Phase #2: Finished")
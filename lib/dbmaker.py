@@ -2,11 +2,11 @@ import copy
 import fnmatch
 import os
 import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
-from sqlalchemy.exc import NoResultFound
-
-from .parsers import FileParser, ProgramParser
-from .source_model import (
+from .layout import (
+    TABLES,
     Class,
     ClassSubroutine,
     ClassVariable,
@@ -18,26 +18,94 @@ from .source_model import (
     Module,
     ModuleSubroutine,
     ProgramFile,
+    Subroutine,
     SubroutineArgument,
-    createNewDatabase,
-    session,
+    Variable,
+    file_dep_assoc,
+    module_dep_assoc,
 )
+from .parsecache import ParseCache, sourceDigest
+from .parsers import FileParser, ProgramParser
+from .util import readSource
 
 NOISY = True
 
 
+def parseSourceFile(fullFilename, defines, cache=None, encoding="utf-8", timeBudget=None):
+    """
+    Parses one source file, or loads its result from the ParseCache. Runs in the worker processes when
+    parsing in parallel, so everything returned is picklable: the parser class used, the parse result or None,
+    the sourceDigest of the file, the error text if parsing failed, and whether the result came from the cache
+    """
+    try:
+        source = readSource(fullFilename, encoding)  # the same text is used to detect programs and to parse
+        digest = sourceDigest(source, defines)
+        if cache:
+            cached = cache.load(digest)
+            if cached:
+                return *cached, digest, None, True
+        # both Files and ProgramFiles can contain subroutines
+        ParserClass = ProgramParser if ProgramParser.isProgram(source) else FileParser
+        parsed_file = ParserClass.parse(source, defines, timeBudget)
+        if cache and not parsed_file.warnings:  # a file that timed out gets another chance next run
+            cache.store(digest, ParserClass, parsed_file)
+        return ParserClass, parsed_file, digest, None, False
+    except Exception:
+        return None, None, None, traceback.format_exc(), False
+
+
 class ModelFiller:
     """
     Walks over all the Fortran source files and, using parsers, fills a database model with parsed
     stuff
     """
 
-    def __init__(self, defines):
+    # rows queued before they are inserted, so a batch holds many small files or one large one
+    BATCH_ROWS = 20000
+    # the column of each subroutine table pointing at the owner
+    SUBROUTINE_OWNER_COLUMNS = {FileSubroutine: "file_id", ModuleSubroutine: "module_id", ClassSubroutine: "class_id"}
+
+    def __init__(self, defines, jobs=1, cacheDir=None, encoding="utf-8", parseTimeBudget=30, repository=None):
+        """
+        jobs:
+            Number of processes used to parse the files, 0 for one per CPU
+        cacheDir:
+            Directory of the parse cache. Files whose content, defines and parsers are unchanged since
+            they were cached there are not parsed again
+        encoding:
+            Encoding of the source files. Undecodable bytes are replaced
+        parseTimeBudget:
+            Seconds parsing one file may take before falling back to extracting just the names
+            in it, None or 0 for no limit
+        repository:
+            The ModelRepository the model is written to, by default a new memory Database
+        """
         self._defines = defines
+        self._jobs = jobs or os.cpu_count() or 1
+        self._cache = ParseCache(cacheDir) if cacheDir else None
+        self._encoding = encoding
+        self._parse_time_budget = parseTimeBudget
         self._processed_files_count = 0
+        self._cached_files_count = 0
+        self._failed_files = []
+        self._file_warnings = []  # (file path, warning)
+        if repository is None:  # imported here, so a MemoryRepository works without SQLAlchemy
+            from .source_model import Database
+            from .sql_model import SQLRepository
 
-    def fillModel(self, sourceFolders=[], match="*.f90", file_list=[], excludes=[]):
-        createNewDatabase()
+            repository = SQLRepository(Database())
+        self._repository = repository
+        self._rows = ModelFiller.Rows(self._repository)
+        # the ids of the rows of each name, lowercase as Fortran names are case-insensitive. Kept for the whole
+        # fill, so repeated dependencies and classes referred to as parents before they are declared are found
+        # without querying the database
+        self._module_ids = {}
+        self._class_ids = {}
+        self._dependency_ids = {}
+
+    def fillModel(self, sourceFolders=[], match="*.f90", file_list=None, excludes=[]):
+        file_list = list(file_list or [])  # a copy, as the files found are added to it
+        self._repository.createNew()
 
         if match:
             compiled_regex = re.compile(fnmatch.translate(match), re.IGNORECASE)
@@ -63,185 +131,287 @@ class ModelFiller:
                         if compiled_regex.match(f) and not excluded(f):
                             file_list.append(os.path.join(root, f))
 
-        for full_source_path in file_list:
+        # files are parsed in parallel, but always added to the database in file_list order
+        parse_results = zip(file_list, self._parseFiles(file_list))
+        for full_source_path, (ParserClass, parsed_file, digest, error, cached) in parse_results:
             if NOISY:
                 print(f"Parsing {full_source_path}")
-            with open(full_source_path) as fhandle:
-                source = fhandle.read()
-                # both Files and ProgramFiles can contain subroutines
-                if ProgramParser.isProgram(source):
-                    self._fileFromParser(ProgramParser, full_source_path)
-                else:
-                    self._fileFromParser(FileParser, full_source_path)
-                self._processed_files_count += 1
+            if error:
+                print(f"Failed to parse {full_source_path}:\n{error}")
+                self._failed_files.append(full_source_path)
+                continue
+            for warning in parsed_file.warnings:
+                print(f"Warning: {full_source_path}: {warning}")
+                self._file_warnings.append((full_source_path, warning))
+            self._fileFromParser(ParserClass, full_source_path, parsed_file, digest)
+            if self._rows.count() >= self.BATCH_ROWS:
+                self._rows.insert()
+            self._processed_files_count += 1
+            self._cached_files_count += cached
+        self._rows.insert()
+        # for rendering the model later, from the database
+        self._repository.setModelInfo(source_directories=list(sourceFolders), defines=self._defines or [])
+        self._repository.commit()  # everything is added in a single transaction
+
+    def _parseFiles(self, fileList):
+        # yields parseSourceFile results in fileList order
+        if self._jobs == 1 or len(fileList) < 2:
+            for full_source_path in fileList:
+                yield parseSourceFile(
+                    full_source_path, self._defines, self._cache, self._encoding, self._parse_time_budget
+                )
+            return
+        jobs = min(self._jobs, len(fileList))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(fileList) // (jobs * 4))
+            yield from executor.map(
+                parseSourceFile,
+                fileList,
+                [self._defines] * len(fileList),
+                [self._cache] * len(fileList),
+                [self._encoding] * len(fileList),
+                [self._parse_time_budget] * len(fileList),
+                chunksize=chunksize,
+            )
 
     def fileCount(self):
         return self._processed_files_count
 
+    def cachedFileCount(self):
+        return self._cached_files_count
+
+    def failedFiles(self):
+        return self._failed_files
+
+    def fileWarnings(self):
+        return self._file_warnings
+
     def _isFortranSource(self, fname):
         return fname.lower().endswith(".f90")
 
-    def _fileFromParser(self, ParserClass, fullFilename):
-        source = open(fullFilename).read()
-        parsed_file = ParserClass.parse(source, self._defines)
-        if ParserClass == FileParser:
-            dbfile = File()
-        elif ParserClass == ProgramParser:
-            dbfile = ProgramFile()
-        dbfile.name = fullFilename
-        dbfile.comment = parsed_file.comment
-        session.add(dbfile)
-        session.commit()
-        dbmodules = self._extractModules(parsed_file.modules)
-        for module in dbmodules:  # associate the module with it's file
-            module.file_id = dbfile.id
-        dbdependencies = self._extractDependencies(parsed_file.dependencies)
-        dbfile.modules = dbmodules
-        dbfile.dependencies = dbdependencies
-        dbsubroutines = self._extractSubroutines(parsed_file.subroutines, dbfile)
-        for subroutine in dbsubroutines:  # associate subroutines with their dbfile
-            subroutine.program_id = dbfile.id
-        dbfile.subroutines = dbsubroutines
-        session.commit()
-        return dbfile, parsed_file
-
-    # All _extract* methods does is convert a parse object to database object.
-
-    def _extractArguments(self, argList, ArgumentClass, extra):
-        # extra is either a database Class or Subroutine
-        res = []
+    def _fileFromParser(self, ParserClass, fullFilename, parsedFile, digest=None):
+        # queues the rows of a parsed file and everything in it, returns the file id
+        rows = self._rows
+        file_id = rows.newId(File)
+        is_program = ParserClass == ProgramParser
+        rows.add(
+            File,
+            id=file_id,
+            name=fullFilename,
+            comment=parsedFile.comment,
+            digest=digest,
+            type=(ProgramFile if is_program else File).identity,
+        )
+        if is_program:
+            rows.add(ProgramFile, id=file_id)
+        self._extractModules(parsedFile.modules, file_id)
+        for dependency_id in self._extractDependencies(parsedFile.dependencies):
+            rows.addAssociation(file_dep_assoc, file_id=file_id, dependency_id=dependency_id)
+        self._extractSubroutines(parsedFile.subroutines, FileSubroutine, file_id)
+        return file_id
+
+    # All _extract* methods do is convert parse objects to database rows, given the id of their owner row
+
+    def _extractArguments(self, argList, ArgumentClass, ownerId):
+        # ArgumentClass is ClassVariable for the variables of a class, or SubroutineArgument
+        rows = self._rows
+        owner_column = "class_id" if ArgumentClass == ClassVariable else "subroutine_id"
         for arg in argList:
-            argument = ArgumentClass(
+            argument_id = rows.newId(Variable)
+            rows.add(
+                Variable,
+                id=argument_id,
                 name=arg.name,
                 full_name=arg.full_name,
                 type=arg.type,
-                comment=arg.comment,
                 extras=arg.extras,
+                comment=arg.comment,
+                type_=ArgumentClass.identity,
             )
-            # should associate these with a subroutine (in case of a subroutine argument) or a class otherwise
-            if ArgumentClass == ClassVariable:
-                argument.class_id = extra.id
-            elif ArgumentClass == SubroutineArgument:
-                argument.subroutine_id = extra.id
-            res.append(argument)
-        return res
-
-    def _extractSubroutines(self, subroutineList, dbOwner):
-        # dbOwner should be a valid database Module, Class or Program, to which the subroutines belong
-        if isinstance(dbOwner, (ProgramFile, File)):
-            SubroutineSubclass = FileSubroutine
-        elif isinstance(dbOwner, Module):
-            SubroutineSubclass = ModuleSubroutine
-        elif isinstance(dbOwner, Class):
-            SubroutineSubclass = ClassSubroutine
-        res = []
+            rows.add(ArgumentClass, id=argument_id, **{owner_column: ownerId})
+
+    def _extractSubroutines(self, subroutineList, SubroutineSubclass, ownerId):
+        # SubroutineSubclass is the FileSubroutine, ModuleSubroutine or ClassSubroutine owned by the ownerId row
+        rows = self._rows
+        owner_column = self.SUBROUTINE_OWNER_COLUMNS[SubroutineSubclass]
         for subroutine in subroutineList:
-            dbsubroutine = SubroutineSubclass(
+            subroutine_id = rows.newId(Subroutine)
+            rows.add(
+                Subroutine,
+                id=subroutine_id,
                 name=subroutine.name,
                 alias=subroutine.alias,
                 comment=subroutine.comment,
                 category=subroutine.category,
                 result_name=subroutine.result_name,
                 typeString=subroutine.typeString,
+                type=SubroutineSubclass.identity,
             )
-            session.add(dbsubroutine)
-            session.commit()
-            arguments = self._extractArguments(subroutine.arguments, SubroutineArgument, dbsubroutine)
-            dbsubroutine.arguments = arguments
-            res.append(dbsubroutine)
-        return res
-
-    def _extractClass(self, cls, dbModule):
+            rows.add(SubroutineSubclass, id=subroutine_id, **{owner_column: ownerId})
+            self._extractArguments(subroutine.arguments, SubroutineArgument, subroutine_id)
+
+    def _extractClass(self, cls, moduleId):
         # find the class in the database first. Maybe it was found as a parent before it's declaration was found
-        dbcls = session.query(Class).filter(Class.name == cls.name).first()
-        if not dbcls:
-            dbcls = Class(name=cls.name)
-        dbcls.access_modifier = cls.access_modifier
-        dbcls.module_id = dbModule.id
-        dbcls.comment = cls.comment
-        dbcls.subroutines = self._extractSubroutines(cls.subroutines, dbcls)
-        dbcls.generics = self._extractGenerics(cls.generics)
-        session.add(dbcls)
-        session.commit()
-        dbcls.variables = self._extractArguments(cls.variables, ClassVariable, dbModule)
-        return dbcls
-
-    def _extractClasses(self, classList, dbModule):
-        # ensures that the parent class at the top of the tree is created first
-        # passes it's id to children
-        res = []
+        rows = self._rows
+        class_id = self._class_ids.get(cls.name.lower())
+        if class_id is None:
+            class_id = self._class_ids[cls.name.lower()] = rows.newId(Class)
+            rows.add(
+                Class,
+                id=class_id,
+                name=cls.name,
+                comment=cls.comment,
+                parent_id=None,
+                access_modifier=cls.access_modifier,
+                module_id=moduleId,
+            )
+        else:
+            rows.update(  # the name as declared, rather than as first referred to as a parent
+                Class,
+                class_id,
+                name=cls.name,
+                access_modifier=cls.access_modifier,
+                module_id=moduleId,
+                comment=cls.comment,
+            )
+            for Model in (ClassSubroutine, Generic, ClassVariable):
+                rows.detach(Model, "class_id", class_id)
+        self._extractSubroutines(cls.subroutines, ClassSubroutine, class_id)
+        self._extractGenerics(cls.generics, class_id)
+        self._extractArguments(cls.variables, ClassVariable, class_id)
+        return class_id
+
+    def _extractClasses(self, classList, moduleId):
+        # parents not declared yet are created with just their name, and filled in when found
+        rows = self._rows
         for cls in classList:
-            dbcls = self._extractClass(cls, dbModule)
+            class_id = self._extractClass(cls, moduleId)
             if cls.parent:
-                # check that the parent is not in the database first
-                parent = session.query(Class).filter(Class.name == cls.parent).first()
-                if parent:
-                    dbcls.parent_id = parent.id
-                else:
-                    # a new parent will be created
-                    parent = Class(name=cls.parent)  # other attributes are currently unknown
-                    session.add(parent)
-                    session.commit()
-                    dbcls.parent_id = parent.id
-            else:
-                pass  # leave the class with no parent from database
-            res.append(dbcls)
-        return res
+                parent_id = self._class_ids.get(cls.parent.lower())
+                if parent_id is None:
+                    parent_id = self._class_ids[cls.parent.lower()] = rows.newId(Class)
+                    rows.add(
+                        Class,
+                        id=parent_id,
+                        name=cls.parent,
+                        comment=None,
+                        parent_id=None,
+                        access_modifier=None,
+                        module_id=None,
+                    )
+                rows.update(Class, class_id, parent_id=parent_id)
 
-    def _extractModules(self, moduleList):
-        # the owner file should be associated to the results from this method
-        res = []
+    def _extractModules(self, moduleList, fileId):
+        rows = self._rows
         for module in moduleList:
-            # check if any modules in this file are already in the database and not fully initialized.
-            # if so, now you know about them from the file and populate them
-            try:
-                dbmodule = session.query(Module).filter(Module.name == module.name).one()
-            except NoResultFound as _:
-                # create a new module and populate it
-                dbmodule = Module(name=module.name)
-                session.add(dbmodule)
-                session.commit()
-            dbmodule.comment = module.comment
-            dbmodule.dependencies = self._extractDependencies(module.dependencies)
-            dbmodule.classes = self._extractClasses(module.classes, dbmodule)
-            dbmodule.subroutines = self._extractSubroutines(module.subroutines, dbmodule)
-            dbmodule.interfaces = self._extractInterfaces(module.interfaces, dbmodule)
-            for subroutine in dbmodule.subroutines:
-                subroutine.module_id = dbmodule.id
-            res.append(dbmodule)
-        return res
+            # a module of the same name seen in an earlier file is replaced by this one
+            module_id = self._module_ids.get(module.name.lower())
+            if module_id is None:
+                module_id = self._module_ids[module.name.lower()] = rows.newId(Module)
+                rows.add(Module, id=module_id, name=module.name, comment=module.comment, file_id=fileId)
+            else:
+                rows.update(Module, module_id, comment=module.comment, file_id=fileId)
+                rows.removeAssociations(module_dep_assoc, "module_id", module_id)
+                for Model in (Class, ModuleSubroutine, Interface):
+                    rows.detach(Model, "module_id", module_id)
+            for dependency_id in self._extractDependencies(module.dependencies):
+                rows.addAssociation(module_dep_assoc, module_id=module_id, dependency_id=dependency_id)
+            self._extractClasses(module.classes, module_id)
+            self._extractSubroutines(module.subroutines, ModuleSubroutine, module_id)
+            self._extractInterfaces(module.interfaces, module_id)
 
     def _extractDependencies(self, parsedDependencies):
-        # ensures that old dependencies are retained and new ones created as necessary
+        # ids of the dependencies. Old dependencies are reused and new ones created as necessary
         # (unique constraint is not enforced by sqlalchemy)
-        dependencies = []
+        dependency_ids = []
         for dep in parsedDependencies:
-            existing_dependency = session.query(Dependency).filter(Dependency.name == dep).first()
-            if existing_dependency:
-                dependencies.append(existing_dependency)
-            else:
-                dependencies.append(Dependency(name=dep))
-        return dependencies
+            dependency_id = self._dependency_ids.get(dep.lower())
+            if dependency_id is None:
+                dependency_id = self._dependency_ids[dep.lower()] = self._rows.newId(Dependency)
+                self._rows.add(Dependency, id=dependency_id, name=dep, type=Dependency.identity)
+            dependency_ids.append(dependency_id)
+        return dependency_ids
 
-    def _extractInterfaces(self, interfaceList, dbModule):
-        dbinterfaces = []
+    def _extractInterfaces(self, interfaceList, moduleId):
         for interface in interfaceList:
-            dbinterface = Interface(name=interface.name, procedure_names=",".join(interface.procedure_list))
-            dbinterface.module_id = dbModule.id
-            dbinterfaces.append(dbinterface)
-        return dbinterfaces
+            self._rows.add(
+                Interface,
+                id=self._rows.newId(Interface),
+                name=interface.name,
+                procedure_names=",".join(interface.procedure_list),
+                module_id=moduleId,
+            )
 
-    def _extractGenerics(self, genericList):
-        dbgenerics = []
+    def _extractGenerics(self, genericList, classId):
         for generic in genericList:
-            dbgenerics.append(
-                Generic(
-                    name=generic.name,
-                    associated_procedures=generic.associated_procedures,
-                )
+            self._rows.add(
+                Generic,
+                id=self._rows.newId(Generic),
+                name=generic.name,
+                associated_procedures=generic.associated_procedures,
+                class_id=classId,
             )
 
-        return dbgenerics
+    class Rows:
+        """
+        Rows waiting to be inserted, by table. Ids are assigned here rather than by the database,
+        so the rows of a batch of files go in with one bulk insert per table instead of an ORM flush per object
+        """
+
+        def __init__(self, repository):
+            self._repository = repository
+            self._tables = {}  # layout.Table -> row dicts, in insertion order
+            self._queued = {}  # (layout.Table, id) -> row dict, of the rows not inserted yet
+            self._associations = {}  # association layout.Table -> key tuple -> row dict, duplicates would break the key
+            self._last_ids = {}  # layout.Table of a base model -> last id used
+
+        def newId(self, table):
+            if table not in self._last_ids:  # continue after any rows already in the database
+                self._last_ids[table] = self._repository.maxId(table)
+            self._last_ids[table] += 1
+            return self._last_ids[table]
+
+        def add(self, table, **values):
+            # a row of table only, for joined inheritance the row of the base table is added separately
+            self._tables.setdefault(table, []).append(values)
+            self._queued[table, values["id"]] = values
+
+        def count(self):
+            return len(self._queued)
+
+        def update(self, table, rowId, **values):
+            row = self._queued.get((table, rowId))
+            if row is not None:
+                row.update(values)
+            else:
+                self._repository.update(table, rowId, values)
+
+        def detach(self, table, ownerColumn, ownerId):
+            # clears the owner of the rows of table owned by ownerId, like replacing an ORM relationship does
+            for row in self._tables.get(table, ()):
+                if row[ownerColumn] == ownerId:
+                    row[ownerColumn] = None
+            self._repository.detach(table, ownerColumn, ownerId)
+
+        def removeAssociations(self, table, column, value):
+            rows = self._associations.get(table, {})
+            for key in [key for key, row in rows.items() if row[column] == value]:
+                del rows[key]
+            self._repository.removeAssociations(table, column, value)
+
+        def addAssociation(self, table, **keys):
+            rows = self._associations.setdefault(table, {})
+            rows.setdefault(tuple(keys.values()), keys)
+
+        def insert(self):
+            # parents first, so foreign keys always point at existing rows
+            if not self._tables and not self._associations:
+                return
+            self._queued.clear()
+            for table in TABLES:
+                rows = self._tables.pop(table, None) or list(self._associations.pop(table, {}).values())
+                if rows:
+                    self._repository.insert(table, rows)
 
 
 def startParse(source):
@@ -1,16 +1,53 @@
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
-import treelib
-from jinja2 import Environment, FileSystemLoader
-from sqlalchemy import func
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from .fshandler import FileSystemHandler
-from .source_model import Class, File, FileSubroutine, Module, ProgramFile, session
+from .layout import ProgramFile
+from .manifest import BuildManifest, settingsDigest
+from .symbols import SymbolTable
 
-env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")))
 NOISY = True
 
+# bytes of a page held before they are written out
+PAGE_BUFFER_SIZE = 1 << 16
+
+
+# the HTMLDocMaker of a render worker process, see HTMLDocMaker.makeDocs
+_worker_doc_maker = None
+
+
+def startRenderWorker(docMaker):
+    global _worker_doc_maker
+    _worker_doc_maker = docMaker
+
+
+def renderPage(kind, recordId, outFileName):
+    # runs in a render worker process, see HTMLDocMaker._renderPage
+    return _worker_doc_maker._renderPage(kind, recordId, outFileName)
+
+
+def templateEnvironment(cacheDirectory=None):
+    """
+    A Jinja environment of the templates. HTMLDocMaker sets its globals, so each generation needs its own
+    cacheDirectory:
+        Directory the compiled templates are kept in, so later runs and render workers load them instead
+        of compiling them again. Entries are keyed by the template source, so they are never stale
+    """
+    bytecode_cache = None
+    if cacheDirectory:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cacheDirectory)
+    # the templates don't change during a run, so they are compiled once and never checked for changes
+    return Environment(
+        loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
+        bytecode_cache=bytecode_cache,
+        auto_reload=False,
+        cache_size=-1,
+    )
+
 
 class HTMLDocMaker:
     """
@@ -29,249 +66,443 @@ class HTMLDocMaker:
         github_root=None,
         source_directories=None,
         github_subdir=None,
+        incremental=False,
+        model=None,
+        environment=None,
+        renderJobs=1,
     ):
+        """
+        incremental:
+            Only render the pages that may differ from the previous build in destinationDirectory
+        model:
+            The snapshot.ModelSnapshot of the model to render, from ModelRepository.snapshot
+        environment:
+            The Jinja environment from templateEnvironment to render with, a new one if None
+        renderJobs:
+            Number of processes the file, program, module and class pages are rendered in, 0 for one per CPU.
+            Each gets a pickled copy of this HTMLDocMaker, the output is the same as rendering them here
+        """
+        if model is None:
+            raise ValueError("HTMLDocMaker needs the snapshot of a filled model")
+        self._model = model
+        self._hierarchy = model.hierarchy()
+        self._env = environment or templateEnvironment()
+        # for the environments of the render workers
+        self._template_cache_dir = getattr(self._env.bytecode_cache, "directory", None)
         self._fshandler = FileSystemHandler(destinationDirectory)
         self._separate_top_classes = separate_top_classes
         self._github_root = github_root
         self._source_directories = source_directories or []
         self._github_subdir = github_subdir
-        env.globals["documentation_title"] = documentationTitle
-        env.globals["github_root"] = github_root
-
-    def _generateGitHubURL(self, file_path):
-        """Generate GitHub URL for a source file if github_root is provided"""
-        if not self._github_root:
-            return None
-
-        import os
-
-        # Normalize the file path
-        normalized_file_path = os.path.normpath(file_path)
-
-        # Find the relative path from one of the source directories
-        relative_path = None
-        for source_dir in self._source_directories:
-            normalized_source_dir = os.path.normpath(source_dir)
-            try:
-                # Check if the file is under this source directory
-                relative_path = os.path.relpath(normalized_file_path, normalized_source_dir)
-                # If the relative path doesn't start with "..", it's under this source directory
-                if not relative_path.startswith(".."):
-                    break
-            except ValueError:
-                # This can happen on Windows when paths are on different drives
-                continue
-
-        if relative_path is None or relative_path.startswith(".."):
-            # Fallback: use just the filename if we can't determine relative path
-            relative_path = os.path.basename(file_path)
+        self._documentation_title = documentationTitle
+        self._symbols = SymbolTable(model, self._fshandler, self._source_directories, github_root, github_subdir)
+        self._type_classes = {}  # type string -> the class name in it, or None
+        self._incremental = incremental
+        self._manifest = None
+        self._changes = None  # BuildManifest.Changes since the previous build, when incremental
+        self._references = None  # names looked up while rendering the current page
+        self._skipped_pages_count = 0
+        self._render_jobs = renderJobs or os.cpu_count() or 1
+        self._executor = None  # the pool of render worker processes, while making the docs
+        self._tree_fragments = {}  # ClassTree.key -> the tree rendered with _tree.html
+        self._env.globals["documentation_title"] = documentationTitle
+        self._env.globals["github_root"] = github_root
 
-        # Convert to forward slashes for URL
-        url_path = relative_path.replace("\\", "/")
+    def __getstate__(self):
+        # for the render workers, which make their own environment and have no previous build to compare with
+        return dict(self.__dict__, _env=None, _executor=None, _changes=None, _tree_fragments={})
 
-        # Add github_subdir if specified
-        if self._github_subdir:
-            url_path = f"{self._github_subdir.strip('/')}/{url_path}"
-
-        # Construct the GitHub URL
-        github_url = f"{self._github_root.rstrip('/')}/blob/master/{url_path}"
-        return github_url
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._env = templateEnvironment(self._template_cache_dir)
+        self._env.globals["documentation_title"] = self._documentation_title
+        self._env.globals["github_root"] = self._github_root
 
     def makeDocs(self):
         self._fshandler.copyAssets()
-        # generate file docs
-        self._generateFileDocs()
-        # generate program docs
-        self._generateProgramDocs()
-        # now for modules
-        self._generateModuleDocs()
-        # classes ...
-        self._generateClassDocs()
+        self._startBuild()
+        if self._render_jobs > 1:
+            # started after _startBuild, the workers need the manifest for the class trees
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._render_jobs, initializer=startRenderWorker, initargs=(self,)
+            )
+        try:
+            # generate file docs
+            self._generateFileDocs()
+            # generate program docs
+            self._generateProgramDocs()
+            # now for modules
+            self._generateModuleDocs()
+            # classes ...
+            self._generateClassDocs()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
         # class index
         self._generateClassIndex()
         # main index
         self._generateMainIndex()
+        self._finishBuild()
+
+    def _startBuild(self):
+        # record what this build renders from, and compare it with the previous build if incremental
+        dbfiles = self._model.files()
+        files = {dbfile.name: dbfile.digest for dbfile in dbfiles}
+        file_names = {dbfile.id: dbfile.name for dbfile in dbfiles}
+        modules = {}
+        module_names = {}
+        for dbmodule in self._model.modules():
+            modules[dbmodule.name.lower()] = file_names.get(dbmodule.file_id)
+            module_names[dbmodule.id] = dbmodule.name.lower()
+        dbclasses = self._model.classes()
+        class_names = {dbclass.id: dbclass.name.lower() for dbclass in dbclasses}
+        classes = {
+            dbclass.name.lower(): [module_names.get(dbclass.module_id), class_names.get(dbclass.parent_id)]
+            for dbclass in dbclasses
+        }
+        module_users = self._model.moduleUsers()
+        users = {}
+        for dbmodule in self._model.modules():
+            using_modules, using_files = module_users.users(dbmodule)
+            if using_modules or using_files:
+                users[dbmodule.name.lower()] = [
+                    sorted(user.name.lower() for user in using_modules),
+                    sorted(user.name for user in using_files),
+                    *module_users.fanIn(dbmodule),
+                ]
+        structure = {
+            "files": {dbfile.name: dbfile.type for dbfile in dbfiles},
+            "modules": modules,
+            "classes": classes,
+            "users": users,
+        }
+        options = {
+            "title": self._documentation_title,
+            "github_root": self._github_root,
+            "github_subdir": self._github_subdir,
+            "source_directories": [os.path.normpath(directory) for directory in self._source_directories],
+            "separate_top_classes": list(self._separate_top_classes or []),
+        }
+        lib_directory = os.path.dirname(__file__)
+        code = [
+            os.path.join(lib_directory, name)
+            for name in ("docmaker.py", "fshandler.py", "manifest.py", "snapshot.py", "symbols.py")
+        ]
+        settings = settingsDigest(options, [os.path.join(lib_directory, "templates")] + code)
+        self._manifest = BuildManifest(settings, files, structure)
+        self._skipped_pages_count = 0
+        self._changes = None
+        if self._incremental:
+            previous = BuildManifest.load(self._fshandler.getSaveManifestName())
+            if previous is not None:
+                self._changes = self._manifest.changesSince(previous)
+
+    def _finishBuild(self):
+        if self._changes:
+            # remove the pages of files, modules and classes that no longer exist
+            for page in self._changes.previous.pages.keys() - self._manifest.pages.keys():
+                out_file_name = self._fshandler.outputPathForPage(page)
+                if os.path.exists(out_file_name):
+                    os.remove(out_file_name)
+        self._manifest.save(self._fshandler.getSaveManifestName())
+        if NOISY and self._skipped_pages_count:
+            print(f"Skipped {self._skipped_pages_count:d} pages unchanged since the previous build")
+
+    def _needsRender(self, outFileName):
+        # whether the page has to be rendered, if not it keeps its record from the previous build
+        page = self._fshandler.pageForOutputPath(outFileName)
+        if self._changes and not self._changes.affects(page) and os.path.exists(outFileName):
+            self._manifest.pages[page] = self._changes.previous.pages[page]
+            self._skipped_pages_count += 1
+            return False
+        return True
+
+    def _indexNeedsRender(self, outFileName, classesOnly=False):
+        # the indexes only show names and the class hierarchy
+        changes = self._changes
+        if not changes or changes.full or not os.path.exists(outFileName):
+            return True
+        return bool(changes.classes) if classesOnly else changes.structure
+
+    def _reference(self, kind, name):
+        # records a name looked up while rendering the current page, see BuildManifest.addPage
+        if self._references is not None and name:
+            self._references[kind].add(name.lower())
+
+    def _referenceTrees(self, dbClasses):
+        # records the class hierarchies the trees on the current page are drawn from
+        if self._references is not None:
+            for dbclass in dbClasses:
+                self._references["trees"].add(self._manifest.rootClass(dbclass.name))
 
     def _generateFileDocs(self):
-        assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_FILE_FOLDER)
-        home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_FILE_FOLDER)
-        class_index = self._fshandler.classIndex(FileSystemHandler.FROM_FILE_FOLDER)
-        file_template = env.get_template("file.html")
-        dbfiles = session.query(File).all()
+        dbfiles = self._model.files()
         # sort here because it won't help t use order_by on directories
         dbfiles.sort(key=lambda f: self._fshandler.pureFileName(f.name).lower())
-        for dbf in dbfiles:
-            template_args = self._templateArgsForFile(dbf)
-            trees = self._treesForFile(dbf)
-            if NOISY:
-                print("Rendering template files/{}".format(self._fshandler.htmlNameForPath(dbf.name)))
-            out_file_name = self._fshandler.getSaveFileName(dbf.name)
-            open(out_file_name, "w").write(
-                file_template.render(
-                    assets_directory=assets_directory,
-                    home_index=home_index,
-                    class_index=class_index,
-                    file_caption=template_args["file_caption"],
-                    file_comment=template_args["file_comment"],
-                    file_github_url=template_args["file_github_url"],
-                    modules=template_args["template_modules"],
-                    dependencies=template_args["template_dependencies"],
-                    subroutines=template_args["template_subroutines"],
-                    functions=template_args["template_functions"],
-                    trees=trees,
+        self._renderPages(
+            "file",
+            [
+                (
+                    dbf.id,
+                    self._fshandler.getSaveFileName(dbf.name),
+                    "files/{}".format(self._fshandler.htmlNameForPath(dbf.name)),
                 )
-            )
-        print()
+                for dbf in dbfiles
+            ],
+        )
 
     def _generateProgramDocs(self):
-        assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_PROGRAM_FOLDER)
-        home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_PROGRAM_FOLDER)
-        class_index = self._fshandler.classIndex(FileSystemHandler.FROM_PROGRAM_FOLDER)
-        program_template = env.get_template("program.html")
-        dbprograms = session.query(ProgramFile).all()
+        dbprograms = self._model.programs()
         dbprograms = sorted(
             dbprograms,
             key=lambda program: self._fshandler.pureFileName(program.name).lower(),
         )
-        for dbprogram in dbprograms:
-            template_args = self._templateArgsForFile(
-                dbprogram
-            )  # a ProgramFile is the same as File. Difference in template
-            if NOISY:
-                print("Rendering template programs/{}".format(self._fshandler.htmlNameForPath(dbprogram.name)))
-            out_program_name = self._fshandler.getSaveProgramName(dbprogram.name)
-            open(out_program_name, "w").write(
-                program_template.render(
-                    assets_directory=assets_directory,
-                    home_index=home_index,
-                    class_index=class_index,
-                    program_caption=template_args["file_caption"],
-                    program_comment=template_args["file_comment"],
-                    program_github_url=template_args["file_github_url"],
-                    modules=template_args["template_modules"],
-                    dependencies=template_args["template_dependencies"],
-                    subroutines=template_args["template_subroutines"],
-                    functions=template_args["template_functions"],
+        self._renderPages(
+            "program",
+            [
+                (
+                    dbprogram.id,
+                    self._fshandler.getSaveProgramName(dbprogram.name),
+                    "programs/{}".format(self._fshandler.htmlNameForPath(dbprogram.name)),
+                )
+                for dbprogram in dbprograms
+            ],
+        )
+
+    def _generateModuleDocs(self):
+        dbmodules = sorted(self._model.modules(), key=lambda dbmodule: dbmodule.name)
+        self._renderPages(
+            "module",
+            [
+                (
+                    dbmodule.id,
+                    self._fshandler.getSaveModuleName(dbmodule.name),
+                    "modules/{}".format(self._fshandler.makeHtml(dbmodule.name)),
+                )
+                for dbmodule in dbmodules
+            ],
+        )
+
+    def _generateClassDocs(self):
+        dbclasses = sorted(self._model.classes(), key=lambda dbclass: dbclass.name)
+        self._renderPages(
+            "class",
+            [
+                (
+                    dbclass.id,
+                    self._fshandler.getSaveClassName(dbclass.name),
+                    "classes/{}".format(self._fshandler.makeHtml(dbclass.name)),
                 )
+                for dbclass in dbclasses
+            ],
+        )
+
+    def _renderPages(self, kind, pages):
+        """
+        pages:
+            (record id, output file name, progress name) of each page of kind, in the order they are listed.
+            The pages that need it are rendered in the render worker processes if there are any, the progress
+            and the manifest are still done here in that order
+        """
+        pages = [page for page in pages if self._needsRender(page[1])]
+        record_ids = [page[0] for page in pages]
+        out_file_names = [page[1] for page in pages]
+        if self._executor is not None and len(pages) > 1:
+            chunksize = max(1, len(pages) // (self._render_jobs * 4))
+            results = self._executor.map(
+                renderPage, [kind] * len(pages), record_ids, out_file_names, chunksize=chunksize
             )
+        else:
+            results = map(self._renderPage, [kind] * len(pages), record_ids, out_file_names)
+        for (_, out_file_name, progress_name), (sources, references) in zip(pages, results):
+            if NOISY:
+                print(f"Rendering template {progress_name}")
+            page = self._fshandler.pageForOutputPath(out_file_name)
+            self._manifest.addPage(page, [source for source in sources if source], references)
         print()
 
-    def _generateModuleDocs(self):
+    def _renderPage(self, kind, recordId, outFileName):
+        # writes one page, returns the files whose content is shown on it and the names looked up for it
+        self._references = {"modules": set(), "classes": set(), "trees": set(), "users": set()}
+        if kind == "module":
+            sources = self._renderModulePage(self._model.moduleById(recordId), outFileName)
+        elif kind == "class":
+            sources = self._renderClassPage(self._model.classById(recordId), outFileName)
+        elif kind == "program":
+            sources = self._renderProgramPage(self._model.fileById(recordId), outFileName)
+        else:
+            sources = self._renderFilePage(self._model.fileById(recordId), outFileName)
+        references, self._references = self._references, None
+        return sources, references
+
+    def _writePage(self, template, outFileName, **context):
+        # streamed into a temporary file that then replaces the page, so a page is never half written
+        temp_path = outFileName + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8", buffering=PAGE_BUFFER_SIZE) as fhandle:
+                fhandle.writelines(template.generate(**context))
+            os.replace(temp_path, outFileName)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _renderFilePage(self, dbf, outFileName):
+        assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_FILE_FOLDER)
+        home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_FILE_FOLDER)
+        class_index = self._fshandler.classIndex(FileSystemHandler.FROM_FILE_FOLDER)
+        file_template = self._env.get_template("file.html")
+        template_args = self._templateArgsForFile(dbf)
+        trees = self._treesForFile(dbf)
+        self._writePage(
+            file_template,
+            outFileName,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            file_caption=template_args["file_caption"],
+            file_comment=template_args["file_comment"],
+            file_github_url=template_args["file_github_url"],
+            modules=template_args["template_modules"],
+            dependencies=template_args["template_dependencies"],
+            subroutines=template_args["template_subroutines"],
+            functions=template_args["template_functions"],
+            trees=self._renderTrees(trees),
+        )
+        return [dbf.name]
+
+    def _renderProgramPage(self, dbprogram, outFileName):
+        assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_PROGRAM_FOLDER)
+        home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_PROGRAM_FOLDER)
+        class_index = self._fshandler.classIndex(FileSystemHandler.FROM_PROGRAM_FOLDER)
+        program_template = self._env.get_template("program.html")
+        template_args = self._templateArgsForFile(
+            dbprogram
+        )  # a ProgramFile is the same as File. Difference in template
+        self._writePage(
+            program_template,
+            outFileName,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            program_caption=template_args["file_caption"],
+            program_comment=template_args["file_comment"],
+            program_github_url=template_args["file_github_url"],
+            modules=template_args["template_modules"],
+            dependencies=template_args["template_dependencies"],
+            subroutines=template_args["template_subroutines"],
+            functions=template_args["template_functions"],
+        )
+        return [dbprogram.name]
+
+    def _renderModulePage(self, dbmodule, outFileName):
         assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_MODULE_FOLDER)
         home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_MODULE_FOLDER)
         class_index = self._fshandler.classIndex(FileSystemHandler.FROM_MODULE_FOLDER)
-        module_template = env.get_template("module.html")
-        dbmodules = session.query(Module).order_by(Module.name).all()
-        for dbmodule in dbmodules:
-            module_caption = dbmodule.name
-            module_file = session.query(File).filter(File.id == dbmodule.file_id).first()
-            module_file_doc = self._fshandler.fileDocForPath(
-                module_file.name, perspective=FileSystemHandler.FROM_MODULE_FOLDER
-            )
-            module_file_caption = self._fshandler.pureFileName(module_file.name)
-            module_file_github_url = self._generateGitHubURL(module_file.name) if module_file else None
-            module_comment = dbmodule.comment
-            module_dbclasses = dbmodule.classes
-            template_classes = self._parseClasses(module_dbclasses, perspective=FileSystemHandler.FROM_MODULE_FOLDER)
-            module_dependencies = dbmodule.dependencies
-            template_dependencies = self._parseDependencies(
-                module_dependencies, perspective=FileSystemHandler.FROM_MODULE_FOLDER
-            )
-            module_dbsubroutines = dbmodule.subroutines
-            template_subroutines, template_functions = self._parseSubroutines(
-                module_dbsubroutines, perspective=FileSystemHandler.FROM_MODULE_FOLDER
-            )
-            module_interfaces = dbmodule.interfaces
-            template_interfaces = self._parseInterfaces(module_interfaces)
-            trees = self._treesFromClasses(dbmodule.classes, perspective=FileSystemHandler.FROM_MODULE_FOLDER)
-            if NOISY:
-                print("Rendering template modules/{}".format(self._fshandler.makeHtml(dbmodule.name)))
-            output_module_file = self._fshandler.getSaveModuleName(dbmodule.name)
-            open(output_module_file, "w").write(
-                module_template.render(
-                    assets_directory=assets_directory,
-                    home_index=home_index,
-                    class_index=class_index,
-                    module_caption=module_caption,
-                    module_file_doc=module_file_doc,
-                    module_file_caption=module_file_caption,
-                    module_file_github_url=module_file_github_url,
-                    module_comment=module_comment,
-                    interfaces=template_interfaces,
-                    classes=template_classes,
-                    dependencies=template_dependencies,
-                    subroutines=template_subroutines,
-                    functions=template_functions,
-                    trees=trees,
-                )
-            )
-        print()
+        module_template = self._env.get_template("module.html")
+        self._reference("modules", dbmodule.name)
+        module_caption = dbmodule.name
+        module_file = self._model.fileById(dbmodule.file_id)  # ModelFiller fills every module from its file
+        module_file_doc = self._fshandler.fileDocForPath(
+            module_file.name, perspective=FileSystemHandler.FROM_MODULE_FOLDER
+        )
+        module_file_caption = self._fshandler.pureFileName(module_file.name)
+        module_file_github_url = self._symbols.file(module_file.id).url
+        module_comment = dbmodule.comment
+        module_dbclasses = dbmodule.classes
+        template_classes = self._parseClasses(module_dbclasses, perspective=FileSystemHandler.FROM_MODULE_FOLDER)
+        module_dependencies = dbmodule.dependencies
+        template_dependencies = self._parseDependencies(
+            module_dependencies, perspective=FileSystemHandler.FROM_MODULE_FOLDER
+        )
+        module_dbsubroutines = dbmodule.subroutines
+        template_subroutines, template_functions = self._parseSubroutines(
+            module_dbsubroutines, perspective=FileSystemHandler.FROM_MODULE_FOLDER
+        )
+        template_users = self._parseUsers(dbmodule, perspective=FileSystemHandler.FROM_MODULE_FOLDER)
+        module_interfaces = dbmodule.interfaces
+        template_interfaces = self._parseInterfaces(module_interfaces)
+        trees = self._treesFromClasses(dbmodule.classes, perspective=FileSystemHandler.FROM_MODULE_FOLDER)
+        self._writePage(
+            module_template,
+            outFileName,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            module_caption=module_caption,
+            module_file_doc=module_file_doc,
+            module_file_caption=module_file_caption,
+            module_file_github_url=module_file_github_url,
+            module_comment=module_comment,
+            interfaces=template_interfaces,
+            classes=template_classes,
+            dependencies=template_dependencies,
+            users=template_users,
+            subroutines=template_subroutines,
+            functions=template_functions,
+            trees=self._renderTrees(trees),
+        )
+        return [module_file.name]
 
-    def _generateClassDocs(self):
+    def _renderClassPage(self, dbclass, outFileName):
         assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_CLASS_FOLDER)
         home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_CLASS_FOLDER)
         class_index = self._fshandler.classIndex(FileSystemHandler.FROM_CLASS_FOLDER)
-        class_template = env.get_template("class.html")
-        dbclasses = session.query(Class).order_by(Class.name).all()
-        for dbclass in dbclasses:
-            class_name = dbclass.name
-            class_module = dbclass.module
-            if class_module:
-                class_module_caption = class_module.name
-                class_module_doc = self._fshandler.moduleDocForName(
-                    class_module.name, perspective=FileSystemHandler.FROM_CLASS_FOLDER
-                )
-            else:
-                class_module_caption = None
-                class_module_doc = None
-            class_module = dbclass.module
-            if class_module:
-                class_file_id = class_module.file_id
-                class_file = session.query(File).filter(File.id == class_file_id).first()
-                if class_file is not None:
-                    class_file_caption = self._fshandler.pureFileName(class_file.name)
-                    class_file_doc = self._fshandler.fileDocForPath(
-                        class_file.name,
-                        perspective=FileSystemHandler.FROM_MODULE_FOLDER,
-                    )
-                else:
-                    class_file_caption = None
-                    class_file_doc = None
-            else:  # no module, won't find the file
-                class_file_caption = None
-                class_file_doc = None
-            class_comment = dbclass.comment
-            class_dbroutines = dbclass.subroutines
-            template_subroutines, template_functions = self._parseSubroutines(
-                class_dbroutines, perspective=FileSystemHandler.FROM_CLASS_FOLDER
+        class_template = self._env.get_template("class.html")
+        class_name = dbclass.name
+        self._reference("classes", class_name)
+        class_module = dbclass.module
+        if class_module:
+            self._reference("modules", class_module.name)
+            class_module_caption = class_module.name
+            class_module_doc = self._fshandler.moduleDocForName(
+                class_module.name, perspective=FileSystemHandler.FROM_CLASS_FOLDER
             )
-            template_generics = self._parseGenerics(dbclass.generics)
-            trees = self._parseTrees(
-                [dbclass], perspective=FileSystemHandler.FROM_CLASS_FOLDER
-            )  # remember, template requires arrays
-            template_properties = self._parseProperties(dbclass.variables)
-            class_output_file = self._fshandler.getSaveClassName(dbclass.name)
-            if NOISY:
-                print("Rendering template classes/{}".format(self._fshandler.makeHtml(dbclass.name)))
-            open(class_output_file, "w").write(
-                class_template.render(
-                    assets_directory=assets_directory,
-                    home_index=home_index,
-                    class_index=class_index,
-                    class_name=class_name,
-                    class_module_caption=class_module_caption,
-                    class_module_doc=class_module_doc,
-                    class_file_caption=class_file_caption,
-                    class_file_doc=class_file_doc,
-                    class_comment=class_comment,
-                    subroutines=template_subroutines,
-                    functions=template_functions,
-                    properties=template_properties,
-                    generics=template_generics,
-                    trees=trees,
-                )
+        else:
+            class_module_caption = None
+            class_module_doc = None
+        class_module = dbclass.module
+        if class_module:
+            class_file = self._model.fileById(class_module.file_id)  # every module has its file
+            class_file_caption = self._fshandler.pureFileName(class_file.name)
+            class_file_doc = self._fshandler.fileDocForPath(
+                class_file.name,
+                perspective=FileSystemHandler.FROM_MODULE_FOLDER,
             )
-        print()
+        else:  # no module, won't find the file
+            class_file = None
+            class_file_caption = None
+            class_file_doc = None
+        class_comment = dbclass.comment
+        class_dbroutines = dbclass.subroutines
+        template_subroutines, template_functions = self._parseSubroutines(
+            class_dbroutines, perspective=FileSystemHandler.FROM_CLASS_FOLDER
+        )
+        template_generics = self._parseGenerics(dbclass.generics)
+        trees = self._parseTrees(
+            [dbclass], perspective=FileSystemHandler.FROM_CLASS_FOLDER
+        )  # remember, template requires arrays
+        template_properties = self._parseProperties(dbclass.variables)
+        self._writePage(
+            class_template,
+            outFileName,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            class_name=class_name,
+            class_module_caption=class_module_caption,
+            class_module_doc=class_module_doc,
+            class_file_caption=class_file_caption,
+            class_file_doc=class_file_doc,
+            class_comment=class_comment,
+            subroutines=template_subroutines,
+            functions=template_functions,
+            properties=template_properties,
+            generics=template_generics,
+            trees=self._renderTrees(trees),
+        )
+        return [class_file.name if class_file else None]
 
     def _generateClassIndex(self):
         # put the class index in the classes directory
@@ -280,60 +511,62 @@ class HTMLDocMaker:
         class_index = self._fshandler.classIndex(FileSystemHandler.FROM_CLASS_FOLDER)
         index_doc = self._fshandler.homeIndex(FileSystemHandler.FROM_CLASS_FOLDER)
         output_file_name = self._fshandler.getSaveClassIndexName()
-        dbclasses = session.query(Class).order_by(Class.name).all()
+        if not self._indexNeedsRender(output_file_name, classesOnly=True):
+            return
+        dbclasses = sorted(self._model.classes(), key=lambda dbclass: dbclass.name)
         trees = self._parseFullTrees(dbclasses, FileSystemHandler.FROM_CLASS_FOLDER, self._separate_top_classes)
         if NOISY:
             print("Rendering template classes/_index.html")
-        class_template = env.get_template("class_index.html")
-        open(output_file_name, "w").write(
-            class_template.render(
-                assets_directory=assets_directory,
-                home_index=home_index,
-                class_index=class_index,
-                index_doc=index_doc,
-                trees=trees,
-            )
+        class_template = self._env.get_template("class_index.html")
+        self._writePage(
+            class_template,
+            output_file_name,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            index_doc=index_doc,
+            trees=self._renderTrees(trees),
         )
         print()
 
     def _generateMainIndex(self):
         output_file_name = self._fshandler.getSaveIndexName()
+        if not self._indexNeedsRender(output_file_name):
+            return
         assets_directory = self._fshandler.assetsDirectory(FileSystemHandler.FROM_INDEX_FOLDER)
         home_index = self._fshandler.homeIndex(FileSystemHandler.FROM_INDEX_FOLDER)
         class_index = self._fshandler.classIndex(FileSystemHandler.FROM_INDEX_FOLDER)
-        dbprograms = session.query(ProgramFile).all()
+        dbprograms = self._model.programs()
         dbprograms.sort(key=lambda program: self._fshandler.pureFileName(program.name).lower())
         template_programs = self._parsePrograms(dbprograms, perspective=FileSystemHandler.FROM_INDEX_FOLDER)
-        dbfiles = session.query(File).all()
+        dbfiles = self._model.files()
         dbfiles.sort(key=lambda dbfile: self._fshandler.pureFileName(dbfile.name).lower())
         template_files = self._parseFiles(dbfiles, perspective=FileSystemHandler.FROM_INDEX_FOLDER)
-        dbmodules = session.query(Module).all()
+        dbmodules = self._model.modules()
         dbmodules.sort(key=lambda dbmodule: dbmodule.name.lower())
         template_modules = self._parseModules(dbmodules, perspective=FileSystemHandler.FROM_INDEX_FOLDER)
-        dbclasses = session.query(Class).all()
+        dbclasses = self._model.classes()
         dbclasses.sort(key=lambda dbclass: dbclass.name.lower())
         template_classes = self._parseClasses(dbclasses, perspective=FileSystemHandler.FROM_INDEX_FOLDER)
         if NOISY:
             print("Rendering main index")
-        index_template = env.get_template("index.html")
-        open(output_file_name, "w").write(
-            index_template.render(
-                assets_directory=assets_directory,
-                home_index=home_index,
-                class_index=class_index,
-                programs=template_programs,
-                files=template_files,
-                modules=template_modules,
-                classes=template_classes,
-            )
+        index_template = self._env.get_template("index.html")
+        self._writePage(
+            index_template,
+            output_file_name,
+            assets_directory=assets_directory,
+            home_index=home_index,
+            class_index=class_index,
+            programs=template_programs,
+            files=template_files,
+            modules=template_modules,
+            classes=template_classes,
         )
         print()
 
     def _getSubroutinesForFile(self, dbFile):
         perspective = self._perspectiveForFile(dbFile)
-        file_id = dbFile.id
-        dbsubroutines = session.query(FileSubroutine).filter(FileSubroutine.file_id == file_id).all()
-        template_subroutines, template_functions = self._parseSubroutines(dbsubroutines, perspective=perspective)
+        template_subroutines, template_functions = self._parseSubroutines(dbFile.subroutines, perspective=perspective)
         return template_subroutines, template_functions
 
     def _parsePrograms(self, dbPrograms, perspective):
@@ -456,17 +689,10 @@ class HTMLDocMaker:
     def _treeBranchForClass(self, dbClass, perspective):
         # create an inheritance branch by traveling up from dbClass
         originalId = dbClass.id
-        currentTree = treelib.Tree()
-        currentTree.create_node("Root", "root")
-        # climb up to the top-most parent
-        parent_id = dbClass.parent_id
-        branch = [dbClass]
-        parent_ids = ["root"]
-        while parent_id is not None:
-            dbclass = session.query(Class).filter(Class.id == parent_id).first()
-            branch.insert(0, dbclass)  # the branch should start from the top-most parent
-            parent_ids.insert(1, dbclass.name)  # the ids start at root
-            parent_id = dbclass.parent_id
+        currentTree = ClassTree()
+        # the branch starts from the top-most parent, the ids start at root
+        branch = list(self._hierarchy.ancestors(dbClass))
+        parent_ids = ["root"] + [dbclass.name for dbclass in branch[:-1]]
         for cls, parent_id in zip(branch, parent_ids):
             self._createTreeNode(currentTree, cls, perspective, parent_id, originalId)
 
@@ -488,16 +714,12 @@ class HTMLDocMaker:
         included_classes = set()
         if currentTree is None:
             # climb up to the top parent first, then create a tree from there
-            parent_id = dbClass.parent_id
-            while parent_id is not None:
-                nextdbClass = session.query(Class).filter(Class.id == parent_id).first()
+            for nextdbClass in reversed(self._hierarchy.ancestors(dbClass)[:-1]):
                 if nextdbClass.name in split_class_names:
                     break
                 dbClass = nextdbClass
-                parent_id = dbClass.parent_id
             # now we are on top
-            currentTree = treelib.Tree()
-            currentTree.create_node("Root", "root")
+            currentTree = ClassTree()
             self._createTreeNode(
                 currentTree,
                 dbClass,
@@ -515,7 +737,7 @@ class HTMLDocMaker:
                 original=dbClass.name in split_class_names,
             )
         if dbClass.name not in split_class_names:
-            dbchildren = session.query(Class).filter(Class.parent_id == dbClass.id).all()
+            dbchildren = self._hierarchy.children(dbClass)
             if dbchildren:
                 for dbchild in dbchildren:  # when there are no more children, it's over#
                     included_classes.add(dbchild)
@@ -534,12 +756,11 @@ class HTMLDocMaker:
     def _downTreeForClass(self, dbClass, perspective, split_class_names=[]):
         # create a the full inheritance tree for dbClass
         included_classes = set()
-        currentTree = treelib.Tree()
-        currentTree.create_node("Root", "root")
+        currentTree = ClassTree()
         self._createTreeNode(currentTree, dbClass, perspective, "root", original=True)
         included_classes.add(dbClass)  # only the first class adds itself
 
-        dbchildren = session.query(Class).filter(Class.parent_id == dbClass.id).all()
+        dbchildren = self._hierarchy.children(dbClass)
         if dbchildren:
             for dbchild in dbchildren:  # when there are no more children, it's over#
                 included_classes.add(dbchild)
@@ -554,60 +775,59 @@ class HTMLDocMaker:
         return currentTree, included_classes
 
     def _treesFromClasses(self, dbClasses, perspective):
-        # create trees that contain only dbClasses, showing relationships between them
+        # create trees that contain only dbClasses, showing relationships between them. classes with the same
+        # root class share one tree, and the trees are in the order of their first class in dbClasses
         trees = []
-        classes_per_tree = []
-        dbClasses = set(dbClasses)
+        tree_roots = set()
+        class_set = set(dbClasses)
+        self._referenceTrees(class_set)
         for dbcls in dbClasses:
-            class_tree, included_classes = self._treeForClasses(dbcls, dbClasses, perspective)
-            if (
-                len(included_classes) > 1
-                and len(included_classes.intersection(dbClasses)) > 1
-                and included_classes not in classes_per_tree
-            ):
+            root = self._hierarchy.root(dbcls)
+            if root.id in tree_roots:
+                continue
+            tree_roots.add(root.id)
+            class_tree, included_classes = self._treeForClasses(root, class_set, perspective)
+            if len(included_classes) > 1:
                 trees.append(class_tree)
-                classes_per_tree.append(included_classes)
         return trees
 
-    def _treeForClasses(self, aClass, dbClasses, perspective, currentTree=None, parentIdentifier="root"):
-        # create a full tree with the exception that only dbClasses are allowed to be in it
+    def _treeForClasses(self, rootClass, dbClasses, perspective):
+        # create the full tree of rootClass with the exception that only dbClasses are allowed to be in it
         included_classes = set()
-        if currentTree is None:
-            # climb up to the top
-            parent_id = aClass.parent_id
-            while parent_id is not None:
-                aClass = session.query(Class).filter(Class.id == parent_id).first()
-                parent_id = aClass.parent_id
-            # now i'm on top
-            currentTree = treelib.Tree()
-            currentTree.create_node("Root", "root")
-        if aClass in dbClasses:
-            self._createTreeNode(currentTree, aClass, perspective, parentIdentifier)  # don't care about originals here
-            parentIdentifier = aClass.name
-            included_classes.add(aClass)
-        children = session.query(Class).filter(Class.parent_id == aClass.id).all()
-        for child in children:
-            _, included = self._treeForClasses(
-                child,
-                dbClasses,
-                perspective,
-                currentTree,
-                parentIdentifier=parentIdentifier,
-            )
-            included_classes.update(included)
+        currentTree = ClassTree()
+        for aClass in self._hierarchy.subtree(rootClass):
+            if aClass in dbClasses:
+                # under the closest of its parents in the tree
+                parentIdentifier = "root"
+                for parent in reversed(self._hierarchy.ancestors(aClass)[:-1]):
+                    if parent in dbClasses:
+                        parentIdentifier = parent.name
+                        break
+                self._createTreeNode(currentTree, aClass, perspective, parentIdentifier)  # don't care about originals
+                included_classes.add(aClass)
         return currentTree, included_classes
 
+    def _renderTrees(self, trees):
+        # the tree diagrams of a page. a tree drawn on several pages, from the same perspective, is rendered once
+        fragments = []
+        for tree in trees:
+            key = tree.key()
+            fragment = self._tree_fragments.get(key)
+            if fragment is None:
+                fragment = self._tree_fragments[key] = self._env.get_template("_tree.html").render(tree=tree)
+            fragments.append(fragment)
+        return fragments
+
     def _createTreeNode(self, currentTree, dbClass, perspective, parentIdentifier, original=False):
         if not isinstance(original, bool):
             if original == dbClass.id:
                 original = True
             else:
                 original = False
-        currentTree.create_node(
-            dbClass.name,
+        currentTree.addNode(
             dbClass.name,
-            parent=parentIdentifier,
-            data=NodeData(
+            parentIdentifier,
+            NodeData(
                 self._fshandler.classDocForName(dbClass.name, perspective),
                 dbClass.name,
                 original,
@@ -634,25 +854,16 @@ class HTMLDocMaker:
 
     def _parseDependencies(self, dbDependencies, perspective):
         template_dependencies = []
-        # I need to know which dependencies are also modules so I know their definer file
-        user_defined_dependencies = session.query(Module)
         for dbdep in dbDependencies:
             dependency_caption = dbdep.name
+            self._reference("modules", dbdep.name)
             # does a dependency have a matching module name and thus a file?. should yield at max one
-            user_defined_dependency = user_defined_dependencies.filter(
-                func.lower(Module.name) == func.lower(dbdep.name)
-            ).first()
-            if user_defined_dependency:
-                dep_fileid = user_defined_dependency.file_id
-                definer = session.query(File).filter(File.id == dep_fileid).first()
-                if definer is not None:
-                    definer_caption = self._fshandler.pureFileName(definer.name)
-                    definer_doc = self._fshandler.fileDocForPath(definer.name, perspective)
-                    dependency_doc = self._fshandler.moduleDocForName(user_defined_dependency.name, perspective)
-                else:  # weird
-                    definer_caption = None
-                    definer_doc = None
-                    dependency_doc = None
+            user_defined_dependency = self._symbols.module(dbdep.name)
+            definer = user_defined_dependency.file if user_defined_dependency else None
+            if definer is not None:
+                definer_caption = definer.caption
+                definer_doc = definer.links[perspective]
+                dependency_doc = user_defined_dependency.links[perspective]
             else:  # maybe a built-in dependency or other
                 definer_caption = None
                 definer_doc = None
@@ -666,6 +877,27 @@ class HTMLDocMaker:
             )
         return template_dependencies
 
+    def _parseUsers(self, dbModule, perspective):
+        # the modules and files using dbModule, and how many depend on it at all
+        self._reference("users", dbModule.name)
+        module_users = self._model.moduleUsers()
+        using_modules, using_files = module_users.users(dbModule)
+        template_modules = []
+        for dbmodule in sorted(using_modules, key=lambda dbmodule: dbmodule.name.lower()):
+            module_symbol = self._symbols.module(dbmodule.name)
+            template_modules.append({"caption": module_symbol.caption, "doc": module_symbol.links[perspective]})
+        template_files = []
+        for dbfile in sorted(using_files, key=lambda dbfile: self._fshandler.pureFileName(dbfile.name).lower()):
+            file_symbol = self._symbols.file(dbfile.id)
+            template_files.append({"caption": file_symbol.caption, "doc": file_symbol.links[perspective]})
+        module_count, file_count = module_users.fanIn(dbModule)
+        return {
+            "modules": template_modules,
+            "files": template_files,
+            "module_count": module_count,
+            "file_count": file_count,
+        }
+
     def _parseClasses(self, dbClasses, perspective):
         template_classes = []
         for dbclass in dbClasses:
@@ -677,7 +909,7 @@ class HTMLDocMaker:
     def _templateArgsForFile(self, dbFile):
         file_caption = self._fshandler.pureFileName(dbFile.name)
         file_comment = dbFile.comment
-        file_github_url = self._generateGitHubURL(dbFile.name)
+        file_github_url = self._symbols.file(dbFile.id).url
         template_modules = self._templateModulesForFile(dbFile)
         template_dependencies = self._templateDependenciesForFile(dbFile)
         template_subroutines, template_functions = self._getSubroutinesForFile(dbFile)
@@ -693,12 +925,13 @@ class HTMLDocMaker:
 
     def _treesForFile(self, dbFile):
         # make a tree for each class in the file
-        file_dbclasses = session.query(Class).join(Module).filter(Module.file_id == dbFile.id).all()
+        file_dbclasses = self._model.classesInFile(dbFile)
         trees = self._treesFromClasses(file_dbclasses, perspective=FileSystemHandler.FROM_FILE_FOLDER)
         return trees
 
     def _parseTrees(self, dbClasses, perspective):
         # creates a single branch for every class
+        self._referenceTrees(dbClasses)
         already_included_classes = set()
         branches_trees = []
         for cls in dbClasses:
@@ -746,16 +979,18 @@ class HTMLDocMaker:
         return trees
 
     def _classDocAndCaptionFromType(self, typeString, perspective):
-        return_class_extractor_regex = self.ARGUMENT_CLASS_EXTRACTOR_REGEX
         if typeString:
-            class_match = return_class_extractor_regex.match(typeString)
-            if class_match:
-                return_class = class_match.group("class")
-                # check it's database entry
-                db_return_class = session.query(Class).filter(Class.name == return_class).first()
-                if db_return_class:
-                    class_doc = self._fshandler.classDocForName(db_return_class.name, perspective=perspective)
-                    class_caption = db_return_class.name
+            if typeString not in self._type_classes:
+                class_match = self.ARGUMENT_CLASS_EXTRACTOR_REGEX.match(typeString)
+                self._type_classes[typeString] = class_match.group("class") if class_match else None
+            return_class = self._type_classes[typeString]
+            if return_class:
+                self._reference("classes", return_class)
+                # the class of that name in any case
+                return_class_symbol = self._symbols.dbclass(return_class)
+                if return_class_symbol:
+                    class_doc = return_class_symbol.links[perspective]
+                    class_caption = return_class_symbol.caption
                 else:
                     class_doc = None
                     class_caption = return_class
@@ -769,13 +1004,46 @@ class HTMLDocMaker:
 
     def _perspectiveForFile(self, dbFile):
         # dbFile is a File or ProgramFile. this method fixes the perspective for both
-        if isinstance(dbFile, ProgramFile):  # ProgramFile must be tested first, since it's a subclass of File
+        if dbFile.type == ProgramFile.identity:
             perspective = FileSystemHandler.FROM_PROGRAM_FOLDER
-        elif isinstance(dbFile, File):
+        else:
             perspective = FileSystemHandler.FROM_FILE_FOLDER
         return perspective
 
 
+class ClassTree:
+    """
+    The classes of one tree diagram, by name, under a "root" node. Children are in the order they are added
+    """
+
+    def __init__(self):
+        self._nodes = []
+        self._children = {"root": []}  # identifier -> the nodes under it
+
+    def addNode(self, identifier, parentIdentifier, data):
+        if identifier in self._children:
+            raise ValueError(f"{identifier} is already in the tree")
+        node = ClassTree.Node(identifier, parentIdentifier, data)
+        self._children[parentIdentifier].append(node)
+        self._children[identifier] = []
+        self._nodes.append(node)
+
+    def children(self, identifier):
+        return self._children[identifier]
+
+    def key(self):
+        # all that the rendered tree depends on: its shape, and the link and highlighting of each class
+        return tuple((node.identifier, node.parent, node.data.link, node.data.original) for node in self._nodes)
+
+    class Node:
+        __slots__ = ("identifier", "parent", "data")
+
+        def __init__(self, identifier, parent, data):
+            self.identifier = identifier
+            self.parent = parent
+            self.data = data
+
+
 class NodeData:
     def __init__(self, link, caption, originalNode=False):
         # the originality flag is used to denote the class that we meant in the tree
@@ -149,6 +149,16 @@ class FileSystemHandler:
     def getSaveClassIndexName(self):
         return self._join(self.classes_directory, "_index.html")
 
+    def getSaveManifestName(self):
+        return self._join(self._destination, ".fordocs_manifest.json")
+
+    def pageForOutputPath(self, outputPath):
+        # the path of an output file relative to the destination, as recorded in the build manifest
+        return pth.relpath(outputPath, self._destination).replace(os.sep, "/")
+
+    def outputPathForPage(self, page):
+        return self._join(self._destination, page)
+
     def _makeFilesDirectory(self):
         files_directory = self._join(self._destination, "files")
         self.files_directory = files_directory
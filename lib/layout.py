@@ -0,0 +1,58 @@
+"""
+The tables of the model by name, as ModelFiller writes them and a ModelRepository stores them. source_model
+maps these tables with SQLAlchemy; nothing here needs it, so the memory backend runs without it
+"""
+
+
+class Table:
+    """
+    A table of rows of the model. identity is the value of the type column that rows of this table
+    have, for the tables of a joined inheritance hierarchy
+    """
+
+    def __init__(self, name, identity=None):
+        self.name = name
+        self.identity = identity
+
+    def __repr__(self):
+        return f"<Table {self.name}>"
+
+
+File = Table("file", "file")
+ProgramFile = Table("program", "program")
+Dependency = Table("dependency", "dependency")
+Interface = Table("inteface")
+Generic = Table("generic")
+Module = Table("module", "module")
+Class = Table("class")
+Subroutine = Table("subroutine", "subroutine")
+FileSubroutine = Table("filesub", "filesub")
+ClassSubroutine = Table("classroutine", "classroutine")
+ModuleSubroutine = Table("moduleroutine", "moduleroutine")
+Variable = Table("variable", "variable")
+ClassVariable = Table("classvariable", "classvariable")
+SubroutineArgument = Table("argument", "subroutineargument")
+# the dependencies of files and modules, rows of keys only
+file_dep_assoc = Table("file_dep_assoc")
+module_dep_assoc = Table("module_dep_assoc")
+
+ASSOCIATIONS = (file_dep_assoc, module_dep_assoc)
+# parents first, so foreign keys always point at existing rows
+TABLES = (
+    Dependency,
+    File,
+    Subroutine,
+    Variable,
+    SubroutineArgument,
+    file_dep_assoc,
+    FileSubroutine,
+    Module,
+    ProgramFile,
+    Class,
+    Interface,
+    module_dep_assoc,
+    ModuleSubroutine,
+    ClassSubroutine,
+    ClassVariable,
+    Generic,
+)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+
+class BuildManifest:
+    """
+    Records what a documentation build wrote, so the next incremental build can work out which pages
+    may differ and render only those. Saved as JSON in the output directory
+    """
+
+    VERSION = 2
+
+    def __init__(self, settings, files, structure):
+        """
+        settings:
+            Digest of the options and templates the pages were rendered with
+        files:
+            Maps each source file path to the digest of its content, defines and parser version
+        structure:
+            The cross-page links: "files" maps paths to file/program, "modules" maps lowercase module
+            names to their file, "classes" maps lowercase class names to [module, parent], also lowercase,
+            and "users" maps lowercase module names to [using modules, using files, and the numbers of
+            modules and files depending on it]
+        """
+        self.settings = settings
+        self.files = files
+        self.structure = structure
+        self.pages = {}  # output page path -> the sources and names the page was rendered from
+
+    @classmethod
+    def load(cls, manifestPath):
+        # returns the saved BuildManifest, or None if there is none usable
+        try:
+            with open(manifestPath) as fhandle:
+                data = json.load(fhandle)
+            if data["version"] != cls.VERSION:
+                return None
+            manifest = cls(data["settings"], data["files"], data["structure"])
+            manifest.pages = data["pages"]
+            return manifest
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, manifestPath):
+        data = {
+            "version": self.VERSION,
+            "settings": self.settings,
+            "files": self.files,
+            "structure": self.structure,
+            "pages": self.pages,
+        }
+        temp_path = manifestPath + ".tmp"
+        with open(temp_path, "w") as fhandle:
+            json.dump(data, fhandle, indent=1, sort_keys=True)
+        os.replace(temp_path, manifestPath)
+
+    def addPage(self, page, sources, references):
+        """
+        references:
+            dict of the lowercase "modules" and "classes" names looked up on the page, the "trees"
+            (root class names) of the class hierarchies drawn on it, and the modules whose "users" it lists
+        """
+        record = {kind: sorted(names) for kind, names in references.items()}
+        record["sources"] = sorted(sources)
+        self.pages[page] = record
+
+    def rootClass(self, className):
+        # the top-most parent of the class, lowercase
+        return self._root(self.structure["classes"], className.lower())
+
+    @staticmethod
+    def _root(classes, name):
+        seen = set()
+        while name in classes and name not in seen:
+            seen.add(name)
+            parent = classes[name][1]
+            if parent is None:
+                break
+            name = parent
+        return name
+
+    def changesSince(self, previous):
+        return BuildManifest.Changes(previous, self)
+
+    class Changes:
+        """What differs between the previous build and this one"""
+
+        def __init__(self, previous, current):
+            self.previous = previous
+            self.full = previous.settings != current.settings
+            self.files = self._changedKeys(previous.files, current.files)
+            old, new = previous.structure, current.structure
+            self.file_kinds = self._changedKeys(old["files"], new["files"])
+            self.modules = self._changedKeys(old["modules"], new["modules"])
+            classes = self._changedKeys(old["classes"], new["classes"])
+            # a new or removed child changes the tree of its parent too
+            for structure in (old, new):
+                for name in list(classes):
+                    entry = structure["classes"].get(name)
+                    if entry and entry[1]:
+                        classes.add(entry[1])
+            self.classes = classes
+            self.trees = {
+                BuildManifest._root(structure["classes"], name) for structure in (old, new) for name in classes
+            }
+            self.structure = bool(self.file_kinds or self.modules or self.classes)
+            # not shown on the indexes
+            self.users = self._changedKeys(old["users"], new["users"])
+
+        @staticmethod
+        def _changedKeys(old, new):
+            return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
+        def affects(self, page):
+            # whether the page may differ from what the previous build wrote
+            if self.full:
+                return True
+            record = self.previous.pages.get(page)
+            if record is None:
+                return True
+            return bool(
+                self.files.intersection(record["sources"])
+                or self.modules.intersection(record["modules"])
+                or self.classes.intersection(record["classes"])
+                or self.trees.intersection(record["trees"])
+                or self.users.intersection(record["users"])
+            )
+
+
+def settingsDigest(options, paths):
+    """
+    Digest of the build options and of the content of the given files and directories
+    (templates, the doc maker code), so changing any of them causes a full rebuild
+    """
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode())
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    digest.update(_fileDigest(os.path.join(root, name)))
+        else:
+            digest.update(_fileDigest(path))
+    return digest.hexdigest()
+
+
+def _fileDigest(path):
+    with open(path, "rb") as fhandle:
+        return hashlib.sha256(fhandle.read()).digest()
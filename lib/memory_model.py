@@ -0,0 +1,59 @@
+"""
+The model kept in memory without the ORM, as rows in dicts while it is filled and as a ModelSnapshot once
+committed
+"""
+
+from . import layout
+from .repository import ModelRepository
+from .snapshot import ModelSnapshot
+
+
+class MemoryRepository(ModelRepository):
+    """
+    The model as rows in dicts while it is filled, and as a snapshot with prebuilt indexes once committed.
+    Lasts as long as the process, for one-shot builds
+    """
+
+    def __init__(self):
+        self.createNew()
+
+    def createNew(self):
+        self._tables = {}  # table name -> id -> row dict
+        self._associations = {}  # table name -> row dicts
+        self._info = {}
+        self._snapshot = None  # built on commit
+
+    def maxId(self, table):
+        return max(self._tables.get(table.name, {0: None}))
+
+    def insert(self, table, rows):
+        if table in layout.ASSOCIATIONS:
+            self._associations.setdefault(table.name, []).extend(rows)
+        else:
+            table_rows = self._tables.setdefault(table.name, {})
+            for row in rows:
+                table_rows[row["id"]] = row
+
+    def update(self, table, rowId, values):
+        self._tables[table.name][rowId].update(values)
+
+    def detach(self, table, ownerColumn, ownerId):
+        for row in self._tables.get(table.name, {}).values():
+            if row[ownerColumn] == ownerId:
+                row[ownerColumn] = None
+
+    def removeAssociations(self, table, column, value):
+        rows = self._associations.get(table.name, [])
+        rows[:] = [row for row in rows if row[column] != value]
+
+    def setModelInfo(self, **values):
+        self._info.update(values)
+
+    def commit(self):
+        self._snapshot = ModelSnapshot(self._tables, self._associations)
+
+    def modelInfo(self, key, default=None):
+        return self._info.get(key, default)
+
+    def snapshot(self):
+        return self._snapshot
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from . import parsers, preprocessor, scanner, util
+
+# bump when the parse results change shape, so old cache entries are never loaded
+CACHE_FORMAT = 1
+
+
+_parser_version = None
+
+
+def _parserVersion():
+    # changes whenever the code of the parsers changes, so a cached result is never stale
+    global _parser_version
+    if _parser_version is None:
+        digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+        for module in (parsers, preprocessor, scanner, util):
+            with open(module.__file__, "rb") as fhandle:
+                digest.update(fhandle.read())
+        _parser_version = digest.hexdigest()
+    return _parser_version
+
+
+def sourceDigest(source, defines):
+    """
+    Digest of a file content, the preprocessor defines and the parser version.
+    Files with the same digest always give the same parse result
+    """
+    digest = hashlib.sha256(_parserVersion().encode())
+    # the defines as the preprocessor resolves them, where a later value of a name overrides an earlier one
+    resolved = preprocessor.Preprocessor(defines).defines
+    digest.update("\0".join(f"{name}={value}" for name, value in sorted(resolved.items())).encode())
+    digest.update(b"\0")
+    digest.update(source.encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache of FileParser/ProgramParser results. Entries are keyed by the sourceDigest of
+    the file, so unchanged files are never parsed twice
+    """
+
+    def __init__(self, cacheDir):
+        self.cache_dir = cacheDir
+        os.makedirs(cacheDir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pickle")
+
+    def load(self, key):
+        # returns (ParserClass, parsed file) or None if there is no usable entry
+        try:
+            with open(self._path(key), "rb") as fhandle:
+                return pickle.load(fhandle)
+        except Exception:  # missing, truncated or outdated entries are just parsed again
+            return None
+
+    def store(self, key, ParserClass, parsedFile):
+        # written to a temporary file first, so parallel workers never see a partial entry
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fhandle:
+                pickle.dump((ParserClass, parsedFile), fhandle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
@@ -1,6 +1,10 @@
+import itertools
 import re
+import time
 
-from .util import ContinuationIterator
+from .preprocessor import Preprocessor
+from .scanner import StatementScanner
+from .util import timeLimit
 
 
 class Parser:
@@ -12,12 +16,12 @@ class Parser:
         pass
 
     @classmethod
-    def parseComments(cls, string):
-        # parse comments from the start of string
-        # return the comments and the rest of the string
-        lines = string.split("\n")
+    def commentFromLines(cls, lines):
+        # parse the comment block at the start of an iterable of lines
+        # return the comment and the index of the first line of code
         comment_regex = cls.COMMENT_LINE_REGEX
         comment_lines = []
+        i = 0
         for i, line in enumerate(lines):
             stripped = line.strip()  # check for empty lines. They belong to the comments
             if not stripped:
@@ -28,47 +32,12 @@ class Parser:
                     break
                 result_dict = match.groupdict()
                 comment_lines.append(result_dict["comment"])
-        comment = "\n".join(comment_lines)
-        rest = "\n".join(lines[i:])
-        return comment, rest
-
-    @classmethod
-    def isCommentLine(cls, line):
-        return line.strip().startswith("!")
-
-    @classmethod
-    def removeStrayComments(cls, string):
-        is_comment_line = cls.isCommentLine
-        for line in string.split("\n"):
-            if is_comment_line(line):
-                string = string.replace(line, "")
-        return string
-
-    @classmethod
-    def removeExtras(cls, string):
-        # remove stray comments and IMPLICIT NONE
-        string = cls.removeStrayComments(string)
-        lines = string.split("\n")
-        lines = filter(lambda line: "implicit none" not in line.lower(), lines)
-        return "\n".join(lines)
+        return "\n".join(comment_lines), i
 
     @classmethod
     def parse_conditionals(cls, text, defines):
-        def eval_conditional(matchobj):
-            statement = matchobj.groups()[1].split("#else")
-            statement.append("")  # in case there was no else statement
-            if matchobj.groups()[0] in defines:
-                return statement[0]
-            else:
-                return statement[1]
-
-        pattern = r"#ifdef\s*(\S*)\s*((?:.(?!#if|#endif))*.)#endif"
-        regex = re.compile(pattern, re.DOTALL)
-        while True:
-            if not regex.search(text):
-                break
-            text = regex.sub(eval_conditional, text)
-        return text
+        # applies the preprocessor conditionals. defines are NAME or NAME=VALUE strings
+        return Preprocessor(defines).process(text)
 
     @classmethod
     def findnpc(cls, s):
@@ -84,36 +53,40 @@ class Parser:
                 comma_pos.append(i)
         return comma_pos
 
-    @classmethod
-    def uniqueStrings(cls, stringList):
-        """Removes duplicate strings case-insensitively"""
-        lowered = []
-        uniqs = []
-        for s in stringList:
-            lower_s = s.lower()
-            if lower_s not in lowered:
-                lowered.append(lower_s)
-                uniqs.append(s)
-        return uniqs
+
+class ParseTimeout(Exception):
+    """Raised when parsing a file takes longer than its time budget"""
 
 
 class FileParser(Parser):
     class File:
-        def __init__(self, comment, modules, dependencies, subroutines):
+        def __init__(self, comment, modules, dependencies, subroutines, warnings=None):
             self.comment = comment
             self.modules = modules
             self.dependencies = dependencies
             self.subroutines = subroutines
+            self.warnings = warnings or []  # problems worth reporting in the run summary
 
     @classmethod
-    def parse(cls, fileString, defines):
+    def parse(cls, fileString, defines, timeBudget=None):
+        """
+        timeBudget:
+            Seconds the parse may take. Past it, the names the LineParser finds are returned instead,
+            with a warning, so a pathological file can't hang the whole build
+        """
         fileString = cls.parse_conditionals(fileString, defines)
-        comments, rest = cls.parseComments(fileString)
-        modules = ModuleParser.parse(rest)
-        deps = DependencyParser.parse(rest)
-        subrotutines = IndependentSubroutineParser.parse(rest)
-        result = cls.File(comments, modules, deps, subrotutines)
-        return result
+        if not timeBudget:
+            return BlockParser.parse(fileString)
+        try:
+            with timeLimit(timeBudget, ParseTimeout):
+                return BlockParser.parse(fileString, time.perf_counter() + timeBudget)
+        except ParseTimeout:
+            parsed_file = LineParser.parse(fileString)
+            parsed_file.warnings.append(
+                f"parsing took longer than {timeBudget:g}s, only the modules, types, procedures and "
+                "dependencies were extracted"
+            )
+            return parsed_file
 
 
 class ProgramParser(FileParser):
@@ -127,12 +100,13 @@ class ProgramParser(FileParser):
                 parentObject.modules,
                 parentObject.dependencies,
                 parentObject.subroutines,
+                parentObject.warnings,
             )
 
     @classmethod
-    def parse(cls, programString, defines):
+    def parse(cls, programString, defines, timeBudget=None):
         # parse a program file and return a Program object
-        comment_modules_deps_subs = FileParser.parse(programString, defines)
+        comment_modules_deps_subs = FileParser.parse(programString, defines, timeBudget)
         return cls.Program(comment_modules_deps_subs)
 
     @classmethod
@@ -146,11 +120,6 @@ class ProgramParser(FileParser):
 
 
 class ModuleParser(Parser):
-    MODULE_EXTRACTOR_REGEX = re.compile(
-        r"^\s*(?!!)module\s*(?P<module_name>\w+)\s*$(?P<module_content>.*?)end\s*module",
-        re.MULTILINE | re.DOTALL | re.IGNORECASE,
-    )
-
     class Module:
         def __init__(self, name, comment, classes, dependencies, subroutines, interfaces):
             self.name = name
@@ -160,35 +129,6 @@ class ModuleParser(Parser):
             self.subroutines = subroutines
             self.interfaces = interfaces
 
-    @classmethod
-    def parse(cls, fileString):
-        # returns a list of Module object parsed from the file
-        module_regex = cls.MODULE_EXTRACTOR_REGEX
-        module_matches = module_regex.finditer(fileString)
-        # I want to know how to parse the module comment
-        modules = []
-        for match in module_matches:
-            result_dict = match.groupdict()
-            module_name = result_dict["module_name"].strip()
-            module_content = result_dict["module_content"]
-            # assuming the comment is after the first line of module
-            module_comment, rest = cls.parseComments(module_content)
-            classes = ClassParser.parse(rest)
-            dependecies = DependencyParser.parse(rest)
-            subroutines = ModuleSubroutineParser.parse(rest)
-            interfaces = InterfaceParser.parse(rest)
-            modules.append(
-                cls.Module(
-                    module_name,
-                    module_comment,
-                    classes,
-                    dependecies,
-                    subroutines,
-                    interfaces,
-                )
-            )
-        return modules
-
 
 class DependencyParser(Parser):
     DEPENDENCY_REGEX = re.compile(
@@ -196,50 +136,8 @@ class DependencyParser(Parser):
         re.IGNORECASE,
     )
 
-    @classmethod
-    def parse(cls, string):
-        """
-        Parse string and return a list of used module names as strings
-        string:
-            Expected to be a module string or file string
-        """
-        lines = string.split("\n")
-        dependencies = []
-        dependency_regex = cls.DEPENDENCY_REGEX
-        for line in lines:
-            line = line.strip()
-            match = dependency_regex.match(line)
-            if match:
-                result_dict = match.groupdict()
-                dependency = result_dict["dependency"]
-                if dependency not in dependencies:
-                    dependencies.append(result_dict["dependency"])
-        dependencies = cls.uniqueStrings(dependencies)  # remove duplicates
-        return dependencies
-
-    @classmethod
-    def isDependencyLine(cls, line):
-        line = line.strip()
-        match = cls.DEPENDENCY_REGEX.match(line)
-        return bool(match)
-
-    @classmethod
-    def removeDependencies(cls, string):
-        # usually called by SubroutineParser to remove dependencies being parsed as arguments, variables
-        deprex = cls.DEPENDENCY_REGEX
-        for line in string.split("\n"):
-            string = string.replace(line, deprex.sub("", line))
-        return string
-
 
 class ClassParser(Parser):
-    CLASS_REGEX = re.compile(
-        r"^\s*(?!!)\btype\b\s*(,\s*(?P<access_mod>abstract|private|public))?"
-        + r"(\s*,\s*extends\s*\(\s*(?P<parent>\w+)\s*\))?\s*(::)?\s*(?P<class_name>\w+)\b"
-        + r"(?P<class_body>.*?)end\s*type",
-        re.MULTILINE | re.DOTALL | re.IGNORECASE,
-    )
-
     class Class:
         def __init__(
             self,
@@ -259,36 +157,6 @@ class ClassParser(Parser):
             self.subroutines = subroutines
             self.generics = generics
 
-    @classmethod
-    def parse(cls, moduleString):
-        # returns a list of Class objects found in the [module]
-        class_regex = cls.CLASS_REGEX
-        class_matches = class_regex.finditer(moduleString)
-        classes = []
-        for match in class_matches:
-            result_dict = match.groupdict()
-            class_name = result_dict["class_name"]
-            access_modifier = result_dict["access_mod"]
-            class_content = result_dict["class_body"]
-            parent_class = result_dict["parent"]
-            # again, assuming the comment is inside the class
-            class_comment, rest = cls.parseComments(class_content)
-            variables = ClassArgumentParser.parse(rest)
-            subroutines = ClassSubroutineParser.parse(moduleString, class_content)
-            generics = ClassGenericParser.parse(rest)
-            classes.append(
-                cls.Class(
-                    class_name,
-                    access_modifier,
-                    parent_class,
-                    class_comment,
-                    variables,
-                    subroutines,
-                    generics,
-                )
-            )
-        return classes
-
 
 class ArgumentParser(Parser):
     """
@@ -301,16 +169,18 @@ class ArgumentParser(Parser):
     I consider "allocatable, dimension(:)" as [extras] when parsing.
     """
 
-    # this matches much more than variables, like language constructs, but no easy way out
+    # this matches much more than variables, like language constructs, but no easy way out.
+    # The type and attributes are matched in a lookahead, which is never backtracked into, so a line with no
+    # names after them fails at once instead of trying every split of its words and spaces (an atomic group).
+    # Their parentheses can nest two deep, like character(len=max(len(s), 8))
+    PARENTHESES = r"\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)"
     VARIABLE_REGEX = re.compile(
-        r"(?P<type_name_args>\w+\s*(\([\w\.=,:\s\*]+\)?|precision)?)\s*"
-        + r"(?P<extra>(,\s*\w+(\(.*?\))?)*)"
-        + r"\s*(::)?\s*"
+        rf"(?=(?P<declaration>(?P<type_name_args>\w+\s*({PARENTHESES}|precision)?)\s*"
+        + rf"(?P<extra>(\s*,\s*\w+(\s*{PARENTHESES})?)*)"
+        + r"\s*(::)?\s*))(?P=declaration)"
         + r"(?P<var_names>(\w+(\(.*?\))?(\s*,\s*)?)+)"
         + r"\s*(!+(?P<variable_comment>.*))?"
     )
-    # subroutine arguments can be defined in body with their name appended with (:) or like
-    ARGUMENT_NAME_TEMPLATE_REGEX = r"{}(\(.*\))?$"  # substitute the argument name here
     ARGUMENT_NAME_ONLY_REGEX = re.compile(
         r"(?P<name>\w+)(\(.*\))?"
     )  # better for display than the full name detected from body
@@ -324,41 +194,118 @@ class ArgumentParser(Parser):
             self.extras = extras
             self.comment = comment
 
+    # first words of the statements declaring variables: type-specs, and procedures which can be arguments
+    DECLARATION_KEYWORDS = frozenset(
+        (
+            "integer",
+            "real",
+            "double",
+            "doubleprecision",
+            "complex",
+            "logical",
+            "character",
+            "byte",
+            "type",
+            "class",
+            "procedure",
+            "external",
+        )
+    )
+    # the other statements of a specification part. They declare nothing VARIABLE_REGEX can use,
+    # and any statement not in either set is executable
+    SPECIFICATION_KEYWORDS = frozenset(
+        (
+            "",  # a statement that doesn't start with a word, like a left over cpp directive
+            "use",
+            "import",
+            "implicit",
+            "parameter",
+            "dimension",
+            "intent",
+            "optional",
+            "allocatable",
+            "pointer",
+            "target",
+            "save",
+            "intrinsic",
+            "public",
+            "private",
+            "protected",
+            "value",
+            "volatile",
+            "asynchronous",
+            "contiguous",
+            "bind",
+            "common",
+            "equivalence",
+            "namelist",
+            "data",
+            "format",
+            "entry",
+            "include",
+            "sequence",
+            "enum",
+            "enumerator",
+        )
+    )
+
     @classmethod
-    def parse(cls, string):
-        # string is expected to be a class string or subroutine string
-        variable_matcher = cls.VARIABLE_REGEX
-        pure_argument_name_matcher = cls.ARGUMENT_NAME_ONLY_REGEX
+    def parseStatements(cls, statements):
+        """
+        Parse the variables declared in a list of Statements from the StatementScanner, up to the first
+        executable statement
+        """
         arguments = []  # could also be variables
-        # perform a line search. should be faster
-        for line in ContinuationIterator(string.split("\n")):
-            line = line.strip()
-            match = variable_matcher.match(line)
-            if match:
-                result_dict = match.groupdict()
-                arg_comment = result_dict["variable_comment"]
-                arg_type = result_dict["type_name_args"]
-                arg_type = arg_type.strip()
-                arg_extras = result_dict["extra"]
-                arg_extras = arg_extras.strip(", ")
-                if arg_extras:
-                    arg_extras = ",".join(cls.splitVariables(arg_extras))
-                arg_names = result_dict["var_names"]
-                arg_names = cls.splitVariables(arg_names)
-                arg_names = [arg.strip() for arg in arg_names]  # since splitVariables splits on commas, not spaces
-                for full_arg_name in arg_names:
-                    detailed_argument = pure_argument_name_matcher.match(full_arg_name)
-                    if detailed_argument:
-                        pure_argument_name = detailed_argument.group("name")
-                        arguments.append(
-                            cls.Argument(
-                                pure_argument_name,
-                                full_arg_name,
-                                arg_type,
-                                arg_extras,
-                                arg_comment,
-                            )
-                        )
+        specification_keywords = cls.SPECIFICATION_KEYWORDS
+        for statement in statements:
+            if cls.isDeclaration(statement):
+                arguments.extend(cls.parseLine(statement.code, statement.comment))
+            elif statement.keyword not in specification_keywords:
+                break
+        return arguments
+
+    @classmethod
+    def isDeclaration(cls, statement):
+        # whether the statement declares variables, rather than say assigning to a variable named real
+        keyword = statement.keyword
+        return keyword in cls.DECLARATION_KEYWORDS and statement.code[len(keyword) :].lstrip()[:1] not in ("=", "%")
+
+    @classmethod
+    def parseLine(cls, line, comment=None):
+        """
+        Parse the variables declared in a single logical line
+        comment:
+            The comment of the line when it was already split off, as done by the StatementScanner
+        """
+        match = cls.VARIABLE_REGEX.match(line)
+        if not match:
+            return []
+        pure_argument_name_matcher = cls.ARGUMENT_NAME_ONLY_REGEX
+        arguments = []
+        result_dict = match.groupdict()
+        arg_comment = result_dict["variable_comment"] if comment is None else comment
+        arg_type = result_dict["type_name_args"]
+        arg_type = arg_type.strip()
+        arg_extras = result_dict["extra"]
+        arg_extras = arg_extras.strip(", ")
+        if arg_extras:
+            arg_extras = ",".join(cls.splitVariables(arg_extras))
+        arg_names = result_dict["var_names"]
+        arg_names = cls.splitVariables(arg_names)
+        arg_names = [arg.strip() for arg in arg_names]  # since splitVariables splits on commas, not spaces
+        for full_arg_name in arg_names:
+            detailed_argument = pure_argument_name_matcher.match(full_arg_name)
+            if detailed_argument:
+                pure_argument_name = detailed_argument.group("name")
+                arguments.append(
+                    cls.Argument(
+                        pure_argument_name,
+                        full_arg_name,
+                        arg_type,
+                        arg_extras,
+                        arg_comment,
+                    )
+                )
         return arguments
 
     @classmethod
@@ -376,25 +323,6 @@ class ArgumentParser(Parser):
         return variables
 
 
-class ClassArgumentParser(ArgumentParser):
-    """
-    Strips the variable portion of the class definition before delegating
-    to ArgumentParser
-    """
-
-    VARIABLE_PORTION_EXTRACTOR = re.compile("(?P<variable_area>.*)contains", re.DOTALL)
-
-    @classmethod
-    def parse(cls, classString):
-        portion_extractor = cls.VARIABLE_PORTION_EXTRACTOR
-        match = portion_extractor.search(classString)
-        if match:
-            variable_area = match.group("variable_area")
-            return ArgumentParser.parse(variable_area)
-        else:  # maybe the class doesn't have subroutine section. the definition should be short and safe for ArgumentParser
-            return ArgumentParser.parse(classString)
-
-
 class ClassGenericParser(Parser):
     GENERIC_REGEX = re.compile(
         r"^generic\s*::\s*(?P<name>\w+)\s*=>\s*(?P<associated_procedures>(\w+(\s*,\s*)?)+)$",
@@ -407,34 +335,20 @@ class ClassGenericParser(Parser):
             self.associated_procedures = associatedProcedures
 
     @classmethod
-    def parse(cls, classBody):
-        body_lines = classBody.split("\n")
-        body_lines_iterator = ContinuationIterator(body_lines)
-        generic_matcher = cls.GENERIC_REGEX
-        splitter_regex = cls.SPLITTER_REGEX
-        generics = []
-        for line in body_lines_iterator:
-            match = generic_matcher.match(line)
-            if match:
-                generic_name = match.group("name")
-                associated_procedures = match.group("associated_procedures")
-                procedure_names = splitter_regex.split(associated_procedures)
-                associated_procedures = ",".join(procedure_names)
-                generics.append(cls.Generic(generic_name, associated_procedures))
-        return generics
+    def parseLine(cls, line):
+        # returns the Generic bound by a single logical line, or None
+        match = cls.GENERIC_REGEX.match(line)
+        if not match:
+            return None
+        generic_name = match.group("name")
+        associated_procedures = match.group("associated_procedures")
+        procedure_names = cls.SPLITTER_REGEX.split(associated_procedures)
+        associated_procedures = ",".join(procedure_names)
+        return cls.Generic(generic_name, associated_procedures)
 
 
 class SubroutineParser(Parser):
-    """Parses subroutines"""
-
-    SUBROUTINE_REGEX = re.compile(
-        r"^[ \t]*(?!!)"
-        + r"(?P<return_type>[\w():\*]+)?"
-        + r"[ \t]*(?P<category>subroutine|function)[ \t]*(?P<subname>\w+)\s*"
-        + r"\((?P<argnames>.*?)\)\s*(result\s*\((?P<result_name>(\w+))\))?"
-        + r"(?P<subbody>.*?end\s*(?P=category))",
-        re.IGNORECASE | re.DOTALL | re.MULTILINE,
-    )
+    """Builds subroutines from their parsed header and declarations, and their type-bound names"""
 
     SUBROUTINE_ALIAS_REGEX = re.compile(
         r"(procedure.*?::\s*(?P<procedure_name>\w+)\s*(=>\s*(?P<procedure_alias>\w+))?)"
@@ -467,179 +381,520 @@ class SubroutineParser(Parser):
             return name_sum
 
     @classmethod
-    def parse(cls, string):
+    def makeSubroutine(cls, category, subname, argnames, resultName, returnType, comment, parsedArguments, aliases):
         """
-        string:
-            Could be a module string or program string
+        Build a Subroutine from its parsed header and the arguments parsed from its body
+        aliases:
+            Maps procedure names bound under another name (procedure :: name => alias) to that binding name
         """
-        # separate subroutines from each other, so the VariableParser can work correctly
-        subroutine_matcher = cls.SUBROUTINE_REGEX
-        alias_matcher = cls.SUBROUTINE_ALIAS_REGEX
-        argument_template = ArgumentParser.ARGUMENT_NAME_TEMPLATE_REGEX
         function_type_regex = cls.HEADER_KEYWORDS_REGEX
-        alias_matches = list(alias_matcher.finditer(string))
-        found_aliases = [match.group("procedure_alias") for match in alias_matches]
-        splitter = cls.SPLITTER_REGEX
-        subroutine_matches = subroutine_matcher.finditer(string)
-        subroutines = []
-        for sub_match in subroutine_matches:
-            actual_args = []
-            result_dict = sub_match.groupdict()
-            subname = result_dict["subname"]
-            subbody = result_dict["subbody"]
-            subcomment, rest = cls.parseComments(subbody)
-            rest = cls.removeExtras(rest)
-            rest = DependencyParser.removeDependencies(rest)
-            parsed_arguments = ArgumentParser.parse(
-                rest
-            )  # this could also parse other things like subroutine variables
-            subalias = ""
-            if subname in found_aliases:  # procedure/subroutine/function has an alias, fix the name and alias
-                for match in alias_matches:
-                    if match.group("procedure_alias") == subname:
-                        subname, subalias = (
-                            match.group("procedure_name"),
-                            match.group("procedure_alias"),
-                        )
-                        break
-            category = result_dict["category"].lower()
-            argnames = result_dict["argnames"]
-            argnames = argnames.replace("&", "")  # remove line continuations
-            argnames = splitter.split(argnames)
-            compiled_argument_templates = [re.compile(argument_template.format(argname)) for argname in argnames]
-            result_name = result_dict["result_name"]
-            return_type = result_dict["return_type"]
-            return_type = return_type if return_type else ""  # stringify for the next match
-            if function_type_regex.match(
-                return_type
-            ):  # the function has a keyword defined. Return type must be specified in result()
-                return_type = None
-            if category == "function" and not return_type:  # didn't find type in header
-                for argument in parsed_arguments:
-                    if result_name:
-                        argument_match_template = re.compile(argument_template.format(result_name), re.IGNORECASE)
-                        argument_is_return = argument_match_template.match(argument.name)
+        actual_args = []
+        subalias = ""
+        if subname in aliases:  # procedure/subroutine/function has an alias, fix the name and alias
+            subname, subalias = aliases[subname], subname
+        category = category.lower()
+        # Fortran names are case-insensitive, and the first declaration of each argument counts
+        undeclared_arguments = {argname.strip().lower() for argname in argnames}
+        result_name = resultName
+        return_type = returnType
+        return_type = return_type if return_type else ""  # stringify for the next match
+        if function_type_regex.match(
+            return_type
+        ):  # the function has a keyword defined. Return type must be specified in result()
+            return_type = None
+        if category == "function" and not return_type:  # didn't find type in header
+            # the result variable, or the function name since it can be used as one
+            result_names = {name.lower() for name in (result_name, subname, subalias) if name}
+            for argument in parsedArguments:
+                if argument.name.lower() in result_names:
+                    if argument.extras:
+                        return_type = " ".join([argument.type, argument.extras])
                     else:
-                        argument_is_return = False
-                    if (
-                        argument_is_return or argument.name == subname or argument.name == subalias
-                    ):  # because the subname can be a variable
-                        if argument.extras:
-                            return_type = " ".join([argument.type, argument.extras])
-                        else:
-                            return_type = argument.type
-                        break
-                else:  # can't help
-                    pass
-            for argument in parsed_arguments:
-                for cat in compiled_argument_templates:
-                    if cat.match(argument.name):  # this filters subroutine variables in
-                        actual_args.append(argument)
-                        compiled_argument_templates.remove(cat)  # only the first match of argument name counts
-                        break
-            subroutines.append(
-                cls.Subroutine(
-                    category,
-                    subname,
-                    subalias,
-                    actual_args,
-                    subcomment,
-                    result_name,
-                    return_type,
-                )
-            )
-        return subroutines
+                        return_type = argument.type
+                    break
+            else:  # can't help
+                pass
+        for argument in parsedArguments:
+            name = argument.name.lower()
+            if name in undeclared_arguments:  # this filters subroutine variables in
+                actual_args.append(argument)
+                undeclared_arguments.remove(name)
+        return cls.Subroutine(
+            category,
+            subname,
+            subalias,
+            actual_args,
+            comment,
+            result_name,
+            return_type,
+        )
+
+    @classmethod
+    def binding(cls, match):
+        # the procedure name and alias of a SUBROUTINE_ALIAS_REGEX match. final name is exclusive with procedure name
+        return match.group("procedure_name") or match.group("final_procedure_name"), match.group("procedure_alias")
 
 
-class IndependentSubroutineParser(SubroutineParser):
+class ProcedureTable:
     """
-    Eliminates modules and classes before passing the job to SubroutineParser
+    The procedures of a module, indexed once so type-bound procedures are found with a dictionary lookup.
+    Subroutines renamed by a binding (procedure :: name => alias) are found by their alias only
     """
 
-    @classmethod
-    def parse(cls, string):
-        module_matcher = ModuleParser.MODULE_EXTRACTOR_REGEX
-        class_matcher = ClassParser.CLASS_REGEX
-        no_mod_string = module_matcher.sub("", string)
-        no_class_string = class_matcher.sub("", no_mod_string)
-        return SubroutineParser.parse(no_class_string)
+    def __init__(self, subroutines):
+        self.subroutines = subroutines
+        self.aliases = {}
+        self.names = {}
+        for subroutine in subroutines:  # the first of duplicated names wins
+            if subroutine.alias:
+                self.aliases.setdefault(subroutine.alias.lower(), subroutine)
+            else:
+                self.names.setdefault(subroutine.name.lower(), subroutine)
+
+    def byAlias(self, alias):
+        return self.aliases.get(alias.lower())
+
+    def byName(self, name):
+        return self.names.get(name.lower())
 
+    def bound(self, name, alias):
+        # the subroutine of a type-bound procedure. With an alias, never match on name, to avoid duplicate subroutines
+        return self.byAlias(alias) if alias else self.byName(name)
 
-class ModuleSubroutineParser(SubroutineParser):
+
+class InterfaceParser(Parser):
+    class Interface:
+        def __init__(self, name, procedureList):
+            self.name = name
+            self.procedure_list = procedureList
+
+
+class BlockParser(Parser):
     """
-    Finds module subroutines and class subroutines. Then returns the difference
+    Fills the FileParser.File results for a whole file in one pass over its logical statements.
+    The module/type/interface/procedure nesting is tracked on a stack of scopes, so no block
+    of text is scanned more than once
     """
 
+    MODULE_REGEX = re.compile(r"module\s+(?P<module_name>\w+)$", re.IGNORECASE)
+    SUBMODULE_REGEX = re.compile(r"submodule\s*\(", re.IGNORECASE)
+    PROGRAM_REGEX = re.compile(r"program\s+\w+", re.IGNORECASE)
+    INTERFACE_REGEX = re.compile(r"(abstract\s+)?interface\b\s*(?P<interface_name>.*)$", re.IGNORECASE)
+    INTERFACE_PROCEDURE_REGEX = re.compile(
+        r"(module\s+)?procedure\s*(::)?\s*(?P<procedure_names>\w+(\s*,\s*\w+)*)$", re.IGNORECASE
+    )
+    CLASS_REGEX = re.compile(
+        r"type\b\s*(,\s*(?P<attributes>[^:]*?))?\s*(?P<colons>::)?\s*(?P<class_name>\w+)\s*(\(.*\))?$",
+        re.IGNORECASE,
+    )
+    CLASS_PARENT_REGEX = re.compile(r"extends\s*\(\s*(?P<parent>\w+)\s*\)", re.IGNORECASE)
+    CLASS_ACCESS_MODIFIERS = ("abstract", "private", "public")
+    # a type-spec or prefix keyword, like real(dl), character*8 or recursive
+    PREFIX_TOKEN_REGEX = re.compile(r"\w+(\s*\*\s*\d+)?(\s*\(([^()]|\([^()]*\))*\))?")
+    SUBROUTINE_HEADER_REGEX = re.compile(
+        r"(?P<prefix>(\w+(\s*\*\s*\d+)?(\s*\(([^()]|\([^()]*\))*\))?\s+)*)"
+        + r"(?P<category>subroutine|function)\s+(?P<subname>\w+)\s*"
+        + r"(\((?P<argnames>[^)]*)\))?\s*(?P<suffix>.*)$",
+        re.IGNORECASE,
+    )
+    RESULT_REGEX = re.compile(r"result\s*\(\s*(?P<result_name>\w+)\s*\)", re.IGNORECASE)
+    PREFIX_KEYWORDS = frozenset(("recursive", "pure", "elemental", "impure", "non_recursive", "module"))
+    # first words that can start a subroutine or function statement
+    HEADER_START_KEYWORDS = PREFIX_KEYWORDS | {
+        "subroutine",
+        "function",
+        "integer",
+        "real",
+        "double",
+        "doubleprecision",
+        "complex",
+        "logical",
+        "character",
+        "type",
+        "class",
+    }
+    END_REGEX = re.compile(
+        r"end\s*(?P<unit>module|submodule|program|subroutine|function|type|interface|procedure)?\b(?P<rest>.*)$",
+        re.IGNORECASE,
+    )
+    # which scope kind each end statement closes. A bare end closes the innermost program unit or procedure
+    END_SCOPES = {
+        "module": ("module",),
+        "submodule": ("submodule",),
+        "program": ("program",),
+        "subroutine": ("procedure",),
+        "function": ("procedure",),
+        "type": ("type",),
+        "interface": ("interface",),
+        "procedure": (),  # separate module procedures are not tracked
+        "": ("procedure", "module", "submodule", "program"),
+    }
+
+    class Scope:
+        """An open block while walking the statements"""
+
+        __slots__ = ("kind", "header", "comment", "contains", "executable", "statements", "bindings", "items", "parent")
+
+        def __init__(self, kind, header=None, comment=None, parent=None):
+            self.kind = kind
+            self.header = header  # the parsed opening statement
+            self.comment = comment
+            self.contains = False
+            self.executable = False  # a procedure's executable statements were reached
+            self.statements = []  # declarations of types and procedures, or Arguments of dummy procedures
+            self.bindings = []  # type-bound procedure statements
+            self.items = {}  # whatever the block collects, by kind
+            self.parent = parent
+
     @classmethod
-    def parse(cls, moduleString):
-        class_matcher = ClassParser.CLASS_REGEX
-        all_subroutines = set(SubroutineParser.parse(moduleString))
-        class_bodies = [match.group("class_body") for match in class_matcher.finditer(moduleString)]
-        classes_subroutines = set()
-        for class_body in class_bodies:
-            class_subroutines = ClassSubroutineParser.parse(moduleString, class_body)
-            classes_subroutines.update(class_subroutines)
-        module_only_subroutines = all_subroutines.difference(classes_subroutines)
-        return module_only_subroutines
-
-
-class ClassSubroutineParser(SubroutineParser):
-    """
-    Passes the whole string to SubroutineParser then picks up only the subroutines that belong
-    to the class string passed
-    """
+    def parse(cls, fileString, deadline=None):
+        """
+        Returns a FileParser.File for the given (preprocessed) file string
+        deadline:
+            time.perf_counter() value after which ParseTimeout is raised. Checked between statements,
+            for where FileParser can't interrupt the parse with a timer signal
+        """
+        lines = fileString.split("\n")
+        comment, _ = cls.commentFromLines(lines)
+        root = cls.Scope("file")
+        root.items = {"modules": [], "dependencies": [], "dependency_names": set(), "subroutines": []}
+        stack = [root]
+        for statement in StatementScanner.scan(lines):
+            if deadline is not None and time.perf_counter() > deadline:
+                raise ParseTimeout()
+            cls._parseStatement(statement, stack, lines)
+        while len(stack) > 1:  # blocks left open at the end of the file
+            cls._closeScope(stack.pop(), stack)
+        return FileParser.File(comment, root.items["modules"], root.items["dependencies"], root.items["subroutines"])
 
     @classmethod
-    def parse(cls, wholeString, classBody):
-        all_subroutines = SubroutineParser.parse(wholeString)
-        class_inner_subroutines = SubroutineParser.parse(classBody)
-        procrex = cls.SUBROUTINE_ALIAS_REGEX
-        # find procedures inside class body, then pick them from the whole string subroutines
-        class_procedures = procrex.finditer(classBody)
-        all_class_subroutines = class_inner_subroutines
-        for class_procedure in class_procedures:
-            match_dict = class_procedure.groupdict()
-            procedure_name = match_dict["procedure_name"]
-            final_name = match_dict["final_procedure_name"]  # this is exclusive with procedure name
-            procedure_alias = match_dict["procedure_alias"]
-            for file_subroutine in all_subroutines:
-                if procedure_alias:  # if there's an alias, never match on name, to avoid duplicate subroutines
-                    if file_subroutine.alias.lower() == procedure_alias.lower():
-                        all_class_subroutines.append(file_subroutine)
-                        break
-                elif not file_subroutine.alias and (
-                    file_subroutine.name == procedure_name or file_subroutine.name == final_name
-                ):
-                    all_class_subroutines.append(file_subroutine)
-                    break
-        return all_class_subroutines
+    def _parseStatement(cls, statement, stack, lines):
+        keyword = statement.keyword
+        code = statement.code
+        scope = stack[-1]
+        if keyword.startswith("end"):
+            match = cls.END_REGEX.match(code)
+            if match and (match.group("unit") or not match.group("rest").strip()):
+                cls._endScope((match.group("unit") or "").lower(), stack)
+                return
+        if keyword in cls.HEADER_START_KEYWORDS:
+            lowered = code.lower()
+            if "subroutine" in lowered or "function" in lowered:
+                match = cls.SUBROUTINE_HEADER_REGEX.match(code)
+                if match:
+                    comment = cls._commentAfter(statement, lines)
+                    stack.append(cls.Scope("procedure", match, comment, scope))
+                    return
+        if keyword == "use":
+            match = DependencyParser.DEPENDENCY_REGEX.match(code)
+            if match:
+                cls._addDependency(match.group("dependency"), stack)
+            return
+        if keyword == "implicit":
+            return
+        if keyword == "contains":
+            scope.contains = True
+            return
+        if scope.kind == "type":
+            if not scope.contains:
+                if " " in code or "," in code or ":" in code:  # a bare private or sequence declares nothing
+                    scope.statements.append(statement)
+            elif keyword in ("procedure", "final", "generic"):
+                scope.bindings.append(statement)
+            return
+        if scope.kind == "interface":
+            if keyword in ("module", "procedure"):
+                match = cls.INTERFACE_PROCEDURE_REGEX.match(code)
+                if match:
+                    procedure_names = cls.SPLITTER_REGEX.split(match.group("procedure_names"))
+                    scope.items.setdefault("procedure_names", []).extend(procedure_names)
+            return
+        if keyword == "module":
+            match = cls.MODULE_REGEX.match(code)
+            if match:
+                module_scope = cls.Scope("module", match, cls._commentAfter(statement, lines), scope)
+                module_scope.items = {
+                    "classes": [],
+                    "dependencies": [],
+                    "dependency_names": set(),
+                    "subroutines": [],
+                    "interfaces": [],
+                    "aliases": {},
+                }
+                stack.append(module_scope)
+                return
+        elif keyword == "type":
+            match = cls.CLASS_REGEX.match(code)
+            # attributes need the double colon, and without it 'type is (real)' is a type guard
+            if match and (
+                match.group("colons")
+                or (match.group("attributes") is None and match.group("class_name").lower() != "is")
+            ):
+                stack.append(cls.Scope("type", match, cls._commentAfter(statement, lines), scope))
+                return
+        elif keyword == "interface" or keyword == "abstract":
+            match = cls.INTERFACE_REGEX.match(code)
+            if match:
+                stack.append(cls.Scope("interface", match, None, scope))
+                return
+        elif keyword == "program":
+            if cls.PROGRAM_REGEX.match(code):
+                stack.append(cls.Scope("program", None, None, scope))
+                return
+        elif keyword == "submodule":
+            if cls.SUBMODULE_REGEX.match(code):
+                stack.append(cls.Scope("submodule", None, None, scope))
+                return
+        if scope.kind == "procedure" and not scope.contains and not scope.executable:
+            if ArgumentParser.isDeclaration(statement):
+                scope.statements.append(statement)
+            elif keyword not in ArgumentParser.SPECIFICATION_KEYWORDS:
+                scope.executable = True  # nothing after the first executable statement is a declaration
 
+    @classmethod
+    def _endScope(cls, unit, stack):
+        kinds = cls.END_SCOPES[unit]
+        for i in range(len(stack) - 1, 0, -1):
+            if stack[i].kind in kinds:
+                while len(stack) > i:  # also close any block that was left unterminated inside
+                    cls._closeScope(stack.pop(), stack)
+                return
 
-class InterfaceParser(Parser):
-    INTEFACE_REGEX = re.compile(
-        r"\s*(?!!)interface\s*(?P<interface_name>\w+)\s*module\s*procedure\s*"
-        + r"(?P<procedure_names>(\w+(\s*,\s*)?)+)\s*end\s*interface\s*(?P=interface_name)?",
-        re.IGNORECASE,
-    )
+    @classmethod
+    def _closeScope(cls, scope, stack):
+        kind = scope.kind
+        if kind == "procedure":
+            cls._closeProcedure(scope, stack)
+        elif kind == "type":
+            module_scope = cls._enclosing(scope, "module")
+            if module_scope:  # classes declared outside modules are not documented
+                module_scope.items["classes"].append((cls._makeClass(scope), scope))
+        elif kind == "interface":
+            module_scope = cls._enclosing(scope, "module")
+            interface_name = scope.header.group("interface_name")
+            procedure_names = scope.items.get("procedure_names")
+            if module_scope and procedure_names and re.fullmatch(r"\w+", interface_name):
+                module_scope.items["interfaces"].append(InterfaceParser.Interface(interface_name, procedure_names))
+        elif kind == "module":
+            stack[0].items["modules"].append(cls._makeModule(scope))
 
-    class Interface:
-        def __init__(self, name, procedureList):
-            self.name = name
-            self.procedure_list = procedureList
+    @classmethod
+    def _closeProcedure(cls, scope, stack):
+        header = scope.header
+        argnames = header.group("argnames")
+        argnames = cls.SPLITTER_REGEX.split(argnames.strip()) if argnames is not None else []
+        parent = scope.parent
+        if parent.kind == "interface":
+            parent = parent.parent
+            if parent.kind == "procedure":  # the interface of a dummy procedure, which is an argument
+                full_name = "{}({})".format(header.group("subname"), ", ".join(argnames))
+                parent.statements.append(
+                    ArgumentParser.Argument(header.group("subname"), full_name, header.group("category"), "", None)
+                )
+                return
+        if parent.kind == "procedure":  # internal procedures are not documented
+            return
+        module_scope = parent if parent.kind == "module" else None
+        parsed_arguments = []
+        for statement in scope.statements:
+            if isinstance(statement, ArgumentParser.Argument):
+                parsed_arguments.append(statement)
+            else:
+                parsed_arguments.extend(ArgumentParser.parseLine(statement.code, statement.comment))
+        result_match = cls.RESULT_REGEX.search(header.group("suffix"))
+        result_name = result_match.group("result_name") if result_match else None
+        return_type = []
+        for token in cls.PREFIX_TOKEN_REGEX.finditer(header.group("prefix")):
+            if token.group().lower() not in cls.PREFIX_KEYWORDS:
+                return_type.append(token.group())
+        subroutine = SubroutineParser.makeSubroutine(
+            header.group("category"),
+            header.group("subname"),
+            argnames,
+            result_name,
+            " ".join(return_type),
+            scope.comment,
+            parsed_arguments,
+            module_scope.items["aliases"] if module_scope else {},
+        )
+        if module_scope:
+            module_scope.items["subroutines"].append(subroutine)
+        else:
+            stack[0].items["subroutines"].append(subroutine)
+
+    @classmethod
+    def _makeClass(cls, scope):
+        header = scope.header
+        access_modifier = None
+        parent_class = None
+        attributes = header.group("attributes")
+        if attributes:
+            for attribute in ArgumentParser.splitVariables(attributes):
+                attribute = attribute.strip()
+                if attribute.lower() in cls.CLASS_ACCESS_MODIFIERS:
+                    access_modifier = access_modifier or attribute
+                else:
+                    parent_match = cls.CLASS_PARENT_REGEX.match(attribute)
+                    if parent_match:
+                        parent_class = parent_match.group("parent")
+        variables = ArgumentParser.parseStatements(scope.statements)
+        generics = []
+        for statement in scope.bindings:
+            if statement.keyword == "generic":
+                generic = ClassGenericParser.parseLine(statement.code)
+                if generic:
+                    generics.append(generic)
+            else:
+                module_scope = cls._enclosing(scope, "module")
+                if module_scope is None:
+                    continue
+                aliases = module_scope.items["aliases"]
+                for match in SubroutineParser.SUBROUTINE_ALIAS_REGEX.finditer(statement.code):
+                    name, procedure_alias = SubroutineParser.binding(match)
+                    scope.items.setdefault("bound", []).append((name, procedure_alias))
+                    if procedure_alias and procedure_alias not in aliases:
+                        aliases[procedure_alias] = name
+        return ClassParser.Class(
+            header.group("class_name"),
+            access_modifier,
+            parent_class,
+            scope.comment,
+            variables,
+            [],  # the bound subroutines are only known at the end of the module
+            generics,
+        )
+
+    @classmethod
+    def _makeModule(cls, scope):
+        items = scope.items
+        all_subroutines = items["subroutines"]
+        procedures = ProcedureTable(all_subroutines)
+        bound = set()
+        classes = []
+        for parsed_class, class_scope in items["classes"]:
+            # the (name, alias) of each binding, parsed once by _makeClass
+            bound_subroutines = (procedures.bound(*binding) for binding in class_scope.items.get("bound", ()))
+            parsed_class.subroutines = [subroutine for subroutine in bound_subroutines if subroutine is not None]
+            bound.update(id(subroutine) for subroutine in parsed_class.subroutines)
+            classes.append(parsed_class)
+        module_subroutines = [subroutine for subroutine in all_subroutines if id(subroutine) not in bound]
+        return ModuleParser.Module(
+            scope.header.group("module_name"),
+            scope.comment,
+            classes,
+            items["dependencies"],
+            module_subroutines,
+            items["interfaces"],
+        )
+
+    @classmethod
+    def _addDependency(cls, dependency, stack):
+        # file dependencies include those of its modules and procedures. Both are unique case-insensitively
+        for scope in (stack[0], cls._enclosing(stack[-1], "module")):
+            if scope is None:
+                continue
+            lowered = dependency.lower()
+            if lowered not in scope.items["dependency_names"]:
+                scope.items["dependency_names"].add(lowered)
+                scope.items["dependencies"].append(dependency)
+
+    @classmethod
+    def _enclosing(cls, scope, kind):
+        # the innermost scope of the given kind containing scope, if any
+        while scope is not None:
+            if scope.kind == kind:
+                return scope
+            scope = scope.parent
+        return None
+
+    @classmethod
+    def _commentAfter(cls, statement, lines):
+        # the comment block following a block's opening statement, starting with a comment on the same line
+        trailing = statement.trailing_comment
+        following = (lines[i] for i in range(statement.last_line + 1, len(lines)))
+        if trailing:
+            following = itertools.chain([trailing], following)
+        else:  # the block can start after blank lines, which are not a paragraph of it
+            following = itertools.dropwhile(lambda line: not line.strip(), following)
+        comment, _ = cls.commentFromLines(following)
+        return comment
+
+
+class LineParser(Parser):
+    """
+    Degraded extraction used when a file takes too long to parse: each physical line is looked at
+    on its own, with no backtracking regexes, for module, type and procedure names and use statements.
+    Comments, arguments, variables and bindings are not extracted
+    """
+
+    WORD_REGEX = re.compile(r"\w+")
+    TYPE_ATTRIBUTES = ("abstract", "private", "public")
+    END_UNITS = ("module", "type", "interface", "subroutine", "function")  # that can be written as endmodule...
+
+    @classmethod
+    def parse(cls, fileString):
+        # returns a FileParser.File for the given (preprocessed) file string
+        lines = fileString.split("\n")
+        comment, _ = cls.commentFromLines(lines)
+        modules, dependencies, subroutines = [], [], []
+        module = None
+        procedure_depth = 0  # procedures inside another procedure or an interface are skipped
+        interface_depth = 0
+        for line in lines:
+            code = line.split("!", 1)[0].strip()
+            if not code[:1].isalpha():  # blank, or the rest of a continued statement
+                continue
+            words = cls.WORD_REGEX.findall(code.lower())
+            first = words[0]
+            if first == "end" or first.startswith("end") and first[3:] in cls.END_UNITS:
+                unit = first[3:] or (words[1] if len(words) > 1 else "")
+                if unit == "interface":
+                    interface_depth = max(0, interface_depth - 1)
+                elif interface_depth:
+                    continue
+                elif unit in ("subroutine", "function") or (not unit and procedure_depth):
+                    procedure_depth = max(0, procedure_depth - 1)
+                elif unit in ("module", "") and module:
+                    modules.append(module)
+                    module = None
+                continue
+            if first == "interface" or words[:2] == ["abstract", "interface"]:
+                interface_depth += 1
+            elif first == "use" and len(words) > 1:
+                names = cls.WORD_REGEX.findall(code.partition("::")[2] if "::" in code else code[3:])
+                if names and names[0].lower() not in (dependency.lower() for dependency in dependencies):
+                    dependencies.append(names[0])
+                    if module:
+                        module.dependencies.append(names[0])
+            elif first == "module" and len(words) == 2 and not module:
+                module = ModuleParser.Module(cls.WORD_REGEX.findall(code)[1], "", [], [], [], [])
+            elif first == "type" and module and not procedure_depth and code[4:].lstrip()[:1] != "(":
+                cls._addClass(code, words, module)
+            elif not interface_depth and ("subroutine" in words or "function" in words):
+                subroutine = cls._procedure(code, words)
+                if subroutine and not procedure_depth:
+                    (module.subroutines if module else subroutines).append(subroutine)
+                procedure_depth += subroutine is not None
+        if module:
+            modules.append(module)
+        return FileParser.File(comment, modules, dependencies, subroutines)
+
+    @classmethod
+    def _addClass(cls, code, words, module):
+        names = cls.WORD_REGEX.findall(code.partition("::")[2] if "::" in code else code[4:])
+        if not names:
+            return
+        source_words = cls.WORD_REGEX.findall(code)  # words keeps the lowercase ones
+        access_modifier = next((source_words[i] for i, word in enumerate(words) if word in cls.TYPE_ATTRIBUTES), None)
+        parent = source_words[words.index("extends") + 1] if "extends" in words[:-1] else None
+        module.classes.append(ClassParser.Class(names[0], access_modifier, parent, "", [], [], []))
 
     @classmethod
-    def parse(cls, string):
-        # parse the procedure list as strings
-        irex = cls.INTEFACE_REGEX
-        comma_splitter_rex = cls.SPLITTER_REGEX
-        interface_matches = irex.finditer(string)
-        interfaces = []
-        for match in interface_matches:
-            result_dict = match.groupdict()
-            interface_name = result_dict["interface_name"]
-            procedures = result_dict["procedure_names"]
-            procedure_names = []
-            if procedures:
-                procedure_names = comma_splitter_rex.split(procedures)
-            interfaces.append(cls.Interface(interface_name, procedure_names))
-        return interfaces
+    def _procedure(cls, code, words):
+        # a Subroutine without arguments if the line opens a subroutine or function, else None
+        category = "subroutine" if "subroutine" in words else "function"
+        position = words.index(category)
+        if position + 1 >= len(words) or words[0] not in BlockParser.HEADER_START_KEYWORDS:
+            return None
+        name = cls.WORD_REGEX.findall(code)[position + 1]
+        return SubroutineParser.Subroutine(category, name, "", [], "", None, "")
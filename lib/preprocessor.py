@@ -0,0 +1,226 @@
+import operator
+import re
+
+
+class Preprocessor:
+    """
+    Applies the cpp conditionals of a source file in a single pass over its lines:
+    #ifdef, #ifndef, #if, #elif, #else and #endif, with #define and #undef inside the file.
+    Directive lines and the lines of inactive branches are removed, other directives are kept
+    """
+
+    DIRECTIVE_REGEX = re.compile(
+        r"^[ \t]*#[ \t]*(?P<directive>if|ifdef|ifndef|elif|else|endif|define|undef)\b[ \t]*(?P<argument>.*?)[ \t]*$",
+        re.MULTILINE,
+    )
+    DEFINE_REGEX = re.compile(r"(?P<name>\w+)(?P<parameters>\([^)]*\))?\s*(?P<value>.*)$")
+    TOKEN_REGEX = re.compile(
+        r"\s*(?:(?P<number>\d+)[uUlL]*|(?P<name>[A-Za-z_]\w*)|(?P<operator>&&|\|\||[=!<>]=|<<|>>|\S))"
+    )
+
+    def __init__(self, defines=None):
+        """
+        defines:
+            list of NAME or NAME=VALUE strings, as given to --define
+        """
+        self.defines = {}
+        for define in defines or []:
+            name, _, value = define.partition("=")
+            self.defines[name.strip()] = value.strip() if value else "1"
+
+    def process(self, text):
+        # returns text with the conditionals applied
+        if "#" not in text:
+            return text
+        defines = dict(self.defines)  # a #define only holds for the rest of its file
+        parts = []  # the text between directives, of the active branches
+        position = 0
+        stack = []  # for each open #if: [enclosing block active, a branch was taken, this branch active]
+        active = True
+        for match in self.DIRECTIVE_REGEX.finditer(text):
+            if active:
+                parts.append(text[position : match.start()])
+            position = match.end() + 1  # skip the directive line with its line break
+            directive = match.group("directive")
+            argument = match.group("argument")
+            if directive in ("define", "undef"):
+                if active and directive == "define":
+                    self._define(argument, defines)
+                elif active:
+                    defines.pop(self._name(argument), None)
+                continue
+            if directive in ("if", "ifdef", "ifndef"):
+                if not active:
+                    condition = False  # not evaluated inside an inactive branch
+                elif directive == "ifdef":
+                    condition = self._name(argument) in defines
+                elif directive == "ifndef":
+                    condition = self._name(argument) not in defines
+                else:
+                    condition = self.evaluate(argument, defines)
+                stack.append([active, condition, active and condition])
+            elif not stack:  # unmatched #elif, #else or #endif
+                continue
+            elif directive == "elif":
+                block = stack[-1]
+                block[2] = block[0] and not block[1] and self.evaluate(argument, defines)
+                block[1] = block[1] or block[2]
+            elif directive == "else":
+                block = stack[-1]
+                block[2] = block[0] and not block[1]
+                block[1] = True
+            else:  # endif
+                stack.pop()
+            active = stack[-1][2] if stack else True
+        if active:
+            parts.append(text[position:])
+        return "".join(parts)
+
+    def _define(self, argument, defines):
+        match = self.DEFINE_REGEX.match(argument)
+        if match:
+            defines[match.group("name")] = match.group("value").strip() or "1"
+
+    @classmethod
+    def _name(cls, argument):
+        # the macro name of an #ifdef, #ifndef or #undef, ignoring anything after it
+        return argument.split(None, 1)[0] if argument else ""
+
+    @classmethod
+    def evaluate(cls, expression, defines):
+        """
+        Evaluates the expression of an #if or #elif: integers, macros, defined(NAME), and the C
+        logical, comparison and arithmetic operators. Anything else is false
+        """
+        return bool(cls._value(expression, defines))
+
+    @classmethod
+    def _value(cls, expression, defines, depth=0):
+        # the integer value of an expression, or 0 if it can't be evaluated
+        tokens = []
+        position = 0
+        expression = expression.split("//", 1)[0].split("/*", 1)[0]
+        while position < len(expression):
+            match = cls.TOKEN_REGEX.match(expression, position)
+            if not match:
+                break  # only trailing whitespace left
+            position = match.end()
+            if match.group("number"):
+                tokens.append(int(match.group("number")))
+            elif match.group("name"):
+                tokens.append(("name", match.group("name")))
+            else:
+                tokens.append(match.group("operator"))
+        try:
+            value, rest = cls._Evaluator(tokens, defines, depth).result()
+        except (ValueError, IndexError, ZeroDivisionError, RecursionError):
+            return 0
+        return 0 if rest else value
+
+    class _Evaluator:
+        """Recursive descent over the tokens of an #if expression, with the C operator precedences"""
+
+        BINARY_OPERATORS = (
+            ("||",),
+            ("&&",),
+            ("|",),
+            ("^",),
+            ("&",),
+            ("==", "!="),
+            ("<", ">", "<=", ">="),
+            ("<<", ">>"),
+            ("+", "-"),
+            ("*", "/", "%"),
+        )
+        OPERATORS = {
+            "|": operator.or_,
+            "^": operator.xor,
+            "&": operator.and_,
+            "==": operator.eq,
+            "!=": operator.ne,
+            "<": operator.lt,
+            ">": operator.gt,
+            "<=": operator.le,
+            ">=": operator.ge,
+            "<<": operator.lshift,
+            ">>": operator.rshift,
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+        }
+
+        def __init__(self, tokens, defines, depth):
+            self.tokens = tokens
+            self.defines = defines
+            self.depth = depth  # of macro expansion, to stop on recursive macros
+            self.position = 0
+
+        def result(self):
+            value = self._binary(0)
+            return value, self.tokens[self.position :]
+
+        def _peek(self):
+            return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+        def _next(self):
+            token = self.tokens[self.position]
+            self.position += 1
+            return token
+
+        def _binary(self, level):
+            if level == len(self.BINARY_OPERATORS):
+                return self._unary()
+            value = self._binary(level + 1)
+            while self._peek() in self.BINARY_OPERATORS[level]:
+                symbol = self._next()
+                value = self._apply(symbol, value, self._binary(level + 1))
+            return value
+
+        @classmethod
+        def _apply(cls, symbol, left, right):
+            if symbol == "||":
+                return int(bool(left) or bool(right))
+            if symbol == "&&":
+                return int(bool(left) and bool(right))
+            if symbol in ("/", "%"):
+                # C division truncates towards zero
+                quotient = abs(left) // abs(right) * (1 if (left >= 0) == (right >= 0) else -1)
+                return quotient if symbol == "/" else left - quotient * right
+            return cls.OPERATORS[symbol](left, right)
+
+        def _unary(self):
+            token = self._next()
+            if token == "!":
+                return int(not self._unary())
+            if token == "-":
+                return -self._unary()
+            if token == "+":
+                return self._unary()
+            if token == "~":
+                return ~self._unary()
+            if token == "(":
+                value = self._binary(0)
+                if self._next() != ")":
+                    raise ValueError("unbalanced parentheses")
+                return value
+            if isinstance(token, int):
+                return token
+            if isinstance(token, tuple):
+                name = token[1]
+                if name == "defined":
+                    parenthesized = self._peek() == "("
+                    if parenthesized:
+                        self._next()
+                    macro = self._next()
+                    if not isinstance(macro, tuple) or (parenthesized and self._next() != ")"):
+                        raise ValueError("bad defined()")
+                    return int(macro[1] in self.defines)
+                return self._macroValue(name)
+            raise ValueError(f"unexpected {token}")
+
+        def _macroValue(self, name):
+            # an undefined macro is 0, a defined one is the value of its expansion
+            value = self.defines.get(name)
+            if not value or self.depth > 10:
+                return 0
+            return Preprocessor._value(value, self.defines, self.depth + 1)
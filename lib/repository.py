@@ -0,0 +1,59 @@
+from abc import ABC, abstractmethod
+
+
+class ModelRepository(ABC):
+    """
+    What ModelFiller writes the model through and HTMLDocMaker reads it through. Tables are layout.Table, and
+    rows are dicts of their columns, with ids assigned by ModelFiller. The model is read back whole, as a
+    snapshot of records with the columns and relationships of the source_model classes as attributes
+    """
+
+    # writing
+
+    @abstractmethod
+    def createNew(self):
+        # an empty model, replacing any that was there
+        raise NotImplementedError
+
+    @abstractmethod
+    def maxId(self, table):
+        # the largest id in table, 0 if empty
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert(self, table, rows):
+        # rows are added in layout.TABLES order, so the rows referred to are always there first
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, table, rowId, values):
+        raise NotImplementedError
+
+    @abstractmethod
+    def detach(self, table, ownerColumn, ownerId):
+        # clears the owner of the rows of table owned by ownerId
+        raise NotImplementedError
+
+    @abstractmethod
+    def removeAssociations(self, table, column, value):
+        raise NotImplementedError
+
+    @abstractmethod
+    def setModelInfo(self, **values):
+        # what the model was parsed from, as JSON serializable values
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self):
+        raise NotImplementedError
+
+    # reading
+
+    @abstractmethod
+    def modelInfo(self, key, default=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def snapshot(self):
+        # the committed model as a snapshot.ModelSnapshot, which is all HTMLDocMaker reads
+        raise NotImplementedError
@@ -0,0 +1,153 @@
+import re
+
+
+class Statement:
+    """
+    A logical Fortran statement: continuation lines joined and comments split off.
+    first_line and last_line are the indices of the physical lines the statement was read from,
+    comments is a list of (line index, comment text) for the comments found on those lines
+    """
+
+    __slots__ = ("code", "keyword", "comments", "first_line", "last_line")
+
+    def __init__(self, code, keyword, comments, firstLine, lastLine):
+        self.code = code
+        self.keyword = keyword  # the first word of the statement, lowercased
+        self.comments = comments
+        self.first_line = firstLine
+        self.last_line = lastLine
+
+    @property
+    def comment(self):
+        # the text of the comments written on the statement lines, without the leading !
+        if not self.comments:
+            return None
+        return " ".join(text.lstrip("!").rstrip() for _, text in self.comments)
+
+    @property
+    def trailing_comment(self):
+        # the comment written after the code on the last line of the statement, if any
+        if self.comments and self.comments[-1][0] == self.last_line:
+            return self.comments[-1][1]
+        return None
+
+    def __repr__(self):
+        return f"<Statement {self.code!r} lines {self.first_line}-{self.last_line}>"
+
+
+class StatementScanner:
+    """
+    Splits free-form Fortran source into logical statements in a single pass over its lines
+    """
+
+    # a numeric statement label is skipped, so the keyword is the first word of the actual statement
+    KEYWORD_REGEX = re.compile(r"(?:\d+\s+)?(?P<keyword>[A-Za-z]\w*)")
+
+    @classmethod
+    def scan(cls, lines):
+        """
+        lines:
+            The physical lines of a file. Returns the list of Statement objects in source order
+        """
+        split_comment = cls.splitComment
+        statements = []
+        parts = []  # code of the physical lines of the current statement
+        comments = []
+        first_line = 0
+        quote = None
+        for index, line in enumerate(lines):
+            code, comment, quote = split_comment(line, quote)
+            code = code.strip()
+            if not parts:
+                if not code or code[0] == "#":  # blank, comment only or preprocessor line
+                    quote = None
+                    continue
+                first_line = index
+            elif not code:  # comment lines are allowed between continuation lines
+                if comment:
+                    comments.append((index, comment.rstrip()))
+                continue
+            elif code[0] == "&":  # the continued text starts right after the ampersand
+                code = "\0" + code[1:].lstrip()
+            if comment:
+                comments.append((index, comment.rstrip()))
+            if code[-1] == "&":
+                parts.append(code[:-1].rstrip())
+                continue
+            parts.append(code)
+            cls._addStatements(statements, parts, comments, first_line, index)
+            parts = []
+            comments = []
+            quote = None
+        if parts:  # the file ended inside a continuation
+            cls._addStatements(statements, parts, comments, first_line, len(lines) - 1)
+        return statements
+
+    @classmethod
+    def _addStatements(cls, statements, parts, comments, firstLine, lastLine):
+        if len(parts) == 1:
+            text = parts[0]
+        else:
+            text = " ".join(parts).replace(" \0", "")
+        if ";" in text:
+            codes = cls.splitStatements(text)
+        else:
+            codes = [text]
+        keyword_regex = cls.KEYWORD_REGEX
+        for code in codes:
+            match = keyword_regex.match(code)
+            if match:
+                keyword = match.group("keyword").lower()
+                code = code[match.start("keyword") :]
+            else:
+                keyword = ""
+            statements.append(Statement(code, keyword, comments, firstLine, lastLine))
+
+    @classmethod
+    def splitComment(cls, line, quote=None):
+        """
+        Splits a physical line into its code and comment. quote is the string delimiter still open from
+        the previous line, if a character constant was continued. Returns code, comment, open quote
+        """
+        if quote is None:
+            bang = line.find("!")
+            if bang < 0:
+                if "&" not in line or ("'" not in line and '"' not in line):
+                    return line, None, None
+            elif "'" not in line and '"' not in line:
+                return line[:bang], line[bang:], None
+        # the line has character constants, so walk it to find where the comment starts
+        i = 0
+        n = len(line)
+        while i < n:
+            c = line[i]
+            if quote:
+                if c == quote:
+                    if i + 1 < n and line[i + 1] == quote:  # doubled delimiter inside the constant
+                        i += 2
+                        continue
+                    quote = None
+            elif c == "'" or c == '"':
+                quote = c
+            elif c == "!":
+                return line[:i], line[i:], None
+            i += 1
+        return line, None, quote
+
+    @classmethod
+    def splitStatements(cls, code):
+        # splits a line on the semicolons that are not inside character constants
+        codes = []
+        quote = None
+        start = 0
+        for i, c in enumerate(code):
+            if quote:
+                if c == quote:
+                    quote = None
+            elif c == "'" or c == '"':
+                quote = c
+            elif c == ";":
+                codes.append(code[start:i].strip())
+                start = i + 1
+        codes.append(code[start:].strip())
+        return [code for code in codes if code]
@@ -0,0 +1,435 @@
+"""
+ModelSnapshot, the whole model as plain read-only records mirroring the source_model classes. HTMLDocMaker
+renders from it rather than from the ORM, so no page runs a query, and it can be pickled for other processes
+"""
+
+from operator import itemgetter
+
+from . import layout
+
+
+class Record:
+    """Read-only once built. Attributes are only set by ModelSnapshot and when unpickling"""
+
+    __slots__ = ()
+
+    def __init_subclass__(cls):
+        # the slots of the class and its bases
+        cls._fields = tuple(name for base in reversed(cls.__mro__) for name in getattr(base, "__slots__", ()))
+
+    def __init__(self, row):
+        for name in self._fields:
+            object.__setattr__(self, name, row.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} records of a ModelSnapshot are read-only")
+
+    def __setstate__(self, state):
+        for name, value in state[1].items():
+            object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} name={self.name} id={self.id} at {id(self):0x}>"
+
+
+class File(Record):
+    __slots__ = ("id", "name", "comment", "digest", "type", "modules", "dependencies", "subroutines")
+
+
+class ProgramFile(File):
+    __slots__ = ()
+
+
+class Dependency(Record):
+    __slots__ = ("id", "name", "name_lower", "type", "files", "modules")
+
+
+class Interface(Record):
+    __slots__ = ("id", "name", "procedure_names", "module_id", "module")
+
+
+class Generic(Record):
+    __slots__ = ("id", "name", "associated_procedures", "class_id", "clazz")
+
+
+class Module(Record):
+    __slots__ = (
+        "id",
+        "name",
+        "name_lower",
+        "comment",
+        "file_id",
+        "file",
+        "dependencies",
+        "classes",
+        "subroutines",
+        "interfaces",
+    )
+
+
+class Class(Record):
+    __slots__ = (
+        "id",
+        "name",
+        "name_lower",
+        "comment",
+        "parent_id",
+        "access_modifier",
+        "module_id",
+        "module",
+        "subroutines",
+        "variables",
+        "generics",
+    )
+
+    # the same identity as source_model.Class, HTMLDocMaker keeps sets of them
+    def __eq__(self, other):
+        return self.name == other.name
+
+    def __hash__(self):
+        return self.name.__hash__()
+
+
+class Subroutine(Record):
+    __slots__ = ("id", "name", "alias", "comment", "category", "result_name", "typeString", "type", "arguments")
+
+
+class FileSubroutine(Subroutine):
+    __slots__ = ("file_id", "file")
+
+
+class ClassSubroutine(Subroutine):
+    __slots__ = ("class_id", "clazz")
+
+
+class ModuleSubroutine(Subroutine):
+    __slots__ = ("module_id", "module")
+
+
+class Variable(Record):
+    __slots__ = ("id", "name", "full_name", "type", "extras", "comment", "type_")
+
+
+class ClassVariable(Variable):
+    __slots__ = ("class_id", "clazz")
+
+
+class SubroutineArgument(Variable):
+    __slots__ = ("subroutine_id", "subroutine")
+
+
+# by polymorphic identity: the record class, the table of its owner column, that column, the reference to the
+# owner and the owner's list of them
+SUBROUTINE_RECORDS = {
+    layout.FileSubroutine.identity: (FileSubroutine, layout.FileSubroutine.name, "file_id", "file", "subroutines"),
+    layout.ClassSubroutine.identity: (ClassSubroutine, layout.ClassSubroutine.name, "class_id", "clazz", "subroutines"),
+    layout.ModuleSubroutine.identity: (
+        ModuleSubroutine,
+        layout.ModuleSubroutine.name,
+        "module_id",
+        "module",
+        "subroutines",
+    ),
+}
+VARIABLE_RECORDS = {
+    layout.ClassVariable.identity: (ClassVariable, layout.ClassVariable.name, "class_id", "clazz", "variables"),
+    layout.SubroutineArgument.identity: (
+        SubroutineArgument,
+        layout.SubroutineArgument.name,
+        "subroutine_id",
+        "subroutine",
+        "arguments",
+    ),
+}
+
+
+class ModelSnapshot:
+    """
+    The records of all the rows and the indexes on them, built once. Relationships are tuples in id order,
+    as loaded from the database, but the dependencies of a file or module are in name order. Lookups return new
+    lists, which callers may sort
+    """
+
+    def __init__(self, tables, associations):
+        """
+        tables:
+            table name -> id -> row dict, for the layout.TABLES
+        associations:
+            association table name -> row dicts
+        """
+
+        def rows(tableName):
+            table_rows = tables.get(tableName, {})
+            return [table_rows[row_id] for row_id in sorted(table_rows)]
+
+        self._files = {}
+        for row in rows(layout.File.name):
+            RecordClass = ProgramFile if row["type"] == layout.ProgramFile.identity else File
+            self._files[row["id"]] = self._record(RecordClass, row, modules=[], dependencies=[], subroutines=[])
+        self._dependencies = {}
+        for row in rows(layout.Dependency.name):
+            self._dependencies[row["id"]] = self._record(
+                Dependency, row, name_lower=row["name"].lower(), files=[], modules=[]
+            )
+        self._modules = {}
+        for row in rows(layout.Module.name):
+            dbmodule = self._record(
+                Module,
+                row,
+                name_lower=row["name"].lower(),
+                file=self._files.get(row["file_id"]),
+                dependencies=[],
+                classes=[],
+                subroutines=[],
+                interfaces=[],
+            )
+            self._modules[row["id"]] = dbmodule
+            if dbmodule.file:
+                dbmodule.file.modules.append(dbmodule)
+        self._classes = {}
+        for row in rows(layout.Class.name):
+            dbclass = self._record(
+                Class,
+                row,
+                name_lower=row["name"].lower(),
+                module=self._modules.get(row["module_id"]),
+                subroutines=[],
+                variables=[],
+                generics=[],
+            )
+            self._classes[row["id"]] = dbclass
+            if dbclass.module:
+                dbclass.module.classes.append(dbclass)
+        for row in rows(layout.Interface.name):
+            interface = self._record(Interface, row, module=self._modules.get(row["module_id"]))
+            if interface.module:
+                interface.module.interfaces.append(interface)
+        for row in rows(layout.Generic.name):
+            generic = self._record(Generic, row, clazz=self._classes.get(row["class_id"]))
+            if generic.clazz:
+                generic.clazz.generics.append(generic)
+        owners = {"file": self._files, "clazz": self._classes, "module": self._modules}
+        self._subroutines = {}
+        for row in rows(layout.Subroutine.name):
+            subroutine = self._owned(SUBROUTINE_RECORDS[row["type"]], row, tables, owners, arguments=[])
+            self._subroutines[row["id"]] = subroutine
+        owners = {"clazz": self._classes, "subroutine": self._subroutines}
+        for row in rows(layout.Variable.name):
+            self._owned(VARIABLE_RECORDS[row["type_"]], row, tables, owners)
+        for table, owner_column, owners, backref in (
+            (layout.file_dep_assoc, "file_id", self._files, "files"),
+            (layout.module_dep_assoc, "module_id", self._modules, "modules"),
+        ):
+            for row in sorted(associations.get(table.name, ()), key=itemgetter(owner_column, "dependency_id")):
+                owner = owners[row[owner_column]]
+                dependency = self._dependencies[row["dependency_id"]]
+                owner.dependencies.append(dependency)
+                getattr(dependency, backref).append(owner)
+        # dependency ids change with the files parsed before, which must not change the page of a file or module
+        for owner in (*self._files.values(), *self._modules.values()):
+            owner.dependencies.sort(key=lambda dependency: (dependency.name_lower, dependency.name))
+        # nothing changes from here on
+        for records in (self._files, self._dependencies, self._modules, self._classes, self._subroutines):
+            for record in records.values():
+                for name in record._fields:
+                    value = getattr(record, name)
+                    if isinstance(value, list):
+                        object.__setattr__(record, name, tuple(value))
+        self._hierarchy = ClassHierarchy(self._classes)
+        self._module_users = ModuleUsers(self._modules, self._files, self._dependencies)
+
+    def files(self):
+        # all the files, programs included
+        return list(self._files.values())
+
+    def programs(self):
+        return [dbfile for dbfile in self._files.values() if isinstance(dbfile, ProgramFile)]
+
+    def modules(self):
+        return list(self._modules.values())
+
+    def classes(self):
+        return list(self._classes.values())
+
+    def fileById(self, fileId):
+        return self._files.get(fileId)
+
+    def moduleById(self, moduleId):
+        return self._modules.get(moduleId)
+
+    def classById(self, classId):
+        return self._classes.get(classId)
+
+    def hierarchy(self):
+        return self._hierarchy
+
+    def moduleUsers(self):
+        return self._module_users
+
+    def classesInFile(self, dbFile):
+        return sorted((dbclass for dbmodule in dbFile.modules for dbclass in dbmodule.classes), key=lambda c: c.id)
+
+    @staticmethod
+    def _record(RecordClass, row, **relations):
+        record = RecordClass(row)
+        for name, value in relations.items():
+            object.__setattr__(record, name, value)
+        return record
+
+    @classmethod
+    def _owned(cls, recordInfo, row, tables, owners, **relations):
+        # the record of a subroutine or variable row joined with its subclass row, added to its owner's list
+        RecordClass, table_name, owner_column, reference, list_name = recordInfo
+        row = dict(row, **tables[table_name][row["id"]])
+        owner = owners[reference].get(row[owner_column])
+        record = cls._record(RecordClass, row, **{reference: owner}, **relations)
+        if owner is not None:
+            getattr(owner, list_name).append(record)
+        return record
+
+
+class ClassHierarchy:
+    """
+    The inheritance graph of the classes, indexed once: parents, children in id order, and the chain of ancestors
+    of each class from its root down. The subtree of a class is walked the first time it is asked for
+    """
+
+    def __init__(self, classes):
+        """
+        classes:
+            class id -> the Class record, in id order
+        """
+        self._parents = {}
+        self._children = {}
+        for dbclass in classes.values():
+            parent = classes.get(dbclass.parent_id)
+            self._parents[dbclass.id] = parent
+            if parent is not None:
+                self._children.setdefault(parent.id, []).append(dbclass)
+        self._children = {parent_id: tuple(children) for parent_id, children in self._children.items()}
+        self._ancestors = {}
+        for dbclass in classes.values():
+            chain = [dbclass]
+            chain_ids = {dbclass.id}
+            parent = self._parents[dbclass.id]
+            while parent is not None and parent.id not in chain_ids:  # a cycle would be a model error, stop at it
+                chain.append(parent)
+                chain_ids.add(parent.id)
+                parent = self._parents[parent.id]
+            self._ancestors[dbclass.id] = tuple(reversed(chain))
+        self._subtrees = {}  # class id -> its subtree, memoized
+
+    def __getstate__(self):
+        # the subtrees are memoized per process
+        return dict(self.__dict__, _subtrees={})
+
+    def parent(self, dbClass):
+        return self._parents.get(dbClass.id)
+
+    def children(self, dbClass):
+        return self._children.get(dbClass.id, ())
+
+    def ancestors(self, dbClass):
+        # the branch from the root class down to dbClass, both included
+        return self._ancestors[dbClass.id]
+
+    def root(self, dbClass):
+        return self._ancestors[dbClass.id][0]
+
+    def depth(self, dbClass):
+        # 0 for a root class
+        return len(self._ancestors[dbClass.id]) - 1
+
+    def subtree(self, dbClass):
+        # dbClass and all the classes extending it, directly or not, parents before their children
+        subtree = self._subtrees.get(dbClass.id)
+        if subtree is None:
+            subtree = []
+            subtree_ids = set()
+            pending = [dbClass]
+            while pending:
+                dbclass = pending.pop()
+                if dbclass.id not in subtree_ids:
+                    subtree.append(dbclass)
+                    subtree_ids.add(dbclass.id)
+                    pending.extend(reversed(self.children(dbclass)))
+            subtree = self._subtrees[dbClass.id] = tuple(subtree)
+        return subtree
+
+
+class ModuleUsers:
+    """
+    The inverse of the module dependencies: the modules and files that use each module, and how many depend on it
+    directly or through other modules. The file defining a module is not counted among its users. The transitive
+    sets are bitsets, worked out in one pass from the modules nobody uses down, so thousands of modules take
+    milliseconds
+    """
+
+    def __init__(self, modules, files, dependencies):
+        """
+        modules, files, dependencies:
+            id -> the records, in id order
+        """
+        module_bits = {module_id: 1 << index for index, module_id in enumerate(modules)}
+        self._file_bits = file_bits = {file_id: 1 << index for index, file_id in enumerate(files)}
+        module_ids = {dbmodule.name_lower: dbmodule.id for dbmodule in modules.values()}
+        self._users = {}  # module id -> (using modules, using files), each once in id order
+        for dependency in dependencies.values():
+            module_id = module_ids.get(dependency.name_lower)
+            if module_id is not None:
+                self._users[module_id] = (
+                    tuple(dict.fromkeys(dependency.modules)),
+                    tuple(dict.fromkeys(dependency.files)),
+                )
+        uses = {module_id: [] for module_id in modules}  # module id -> the ids of the modules it uses
+        unresolved = dict.fromkeys(modules, 0)  # module id -> its users not yet done
+        for module_id, (users, _) in self._users.items():
+            for user in users:
+                uses[user.id].append(module_id)
+                unresolved[module_id] += 1
+
+        def reach(moduleId):
+            # the bits of the modules and files depending on the module, from those of its users
+            users, using_files = self._users.get(moduleId, ((), ()))
+            dependent_modules = dependent_files = 0
+            for user in users:
+                user_modules, user_files = self._reach[user.id]
+                dependent_modules |= user_modules | module_bits[user.id]
+                dependent_files |= user_files
+            for dbfile in using_files:
+                dependent_files |= file_bits[dbfile.id]
+            return dependent_modules & ~module_bits[moduleId], dependent_files
+
+        self._reach = {}  # module id -> (module bits, file bits)
+        ready = [module_id for module_id, count in unresolved.items() if count == 0]
+        while ready:
+            module_id = ready.pop()
+            self._reach[module_id] = reach(module_id)
+            for used_id in uses[module_id]:
+                unresolved[used_id] -= 1
+                if unresolved[used_id] == 0:
+                    ready.append(used_id)
+        # modules in a cycle of uses, and those they use, which can only come from bad parses or name clashes
+        cyclic = [module_id for module_id in modules if module_id not in self._reach]
+        for module_id in cyclic:
+            self._reach[module_id] = (0, 0)
+        changed = bool(cyclic)
+        while changed:
+            changed = False
+            for module_id in cyclic:
+                module_reach = reach(module_id)
+                if module_reach != self._reach[module_id]:
+                    self._reach[module_id] = module_reach
+                    changed = True
+
+    def users(self, dbModule):
+        # the modules and the other files with a use of dbModule
+        using_modules, using_files = self._users.get(dbModule.id, ((), ()))
+        return using_modules, tuple(dbfile for dbfile in using_files if dbfile is not dbModule.file)
+
+    def fanIn(self, dbModule):
+        # the number of modules and of other files depending on dbModule, directly or not
+        dependent_modules, dependent_files = self._reach[dbModule.id]
+        if dbModule.file:
+            dependent_files &= ~self._file_bits[dbModule.file.id]
+        return dependent_modules.bit_count(), dependent_files.bit_count()
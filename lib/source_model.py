@@ -1,42 +1,53 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+import os
+
+from sqlalchemy import Column, Computed, ForeignKey, Integer, String, create_engine, event, exc, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.sql.schema import Table
 
-engine = create_engine("sqlite://", echo=False)  # temporary memory database
-Session = sessionmaker(bind=engine)
-session = Session()
+from . import layout
+
+# stored in the database file. Increase it when the tables change, so older databases are parsed again
+SCHEMA_VERSION = 1
+
 DecBase = declarative_base()
 
+
+class DatabaseError(Exception):
+    """The database holds no model, or one written with another SCHEMA_VERSION"""
+
+
 # a file can have many dependencies. A dependency can appear in many files. Many to Many
 file_dep_assoc = Table(
-    "file_dep_assoc",
+    layout.file_dep_assoc.name,
     DecBase.metadata,
     Column("file_id", Integer, ForeignKey("file.id"), primary_key=True),
-    Column("dependency_id", Integer, ForeignKey("dependency.id"), primary_key=True),
+    Column("dependency_id", Integer, ForeignKey("dependency.id"), primary_key=True, index=True),
 )
 # a module can have many dependencies. And a dependency can appear in many modules. Many to Many
 module_dep_assoc = Table(
-    "module_dep_assoc",
+    layout.module_dep_assoc.name,
     DecBase.metadata,
     Column("module_id", Integer, ForeignKey("module.id"), primary_key=True),
-    Column("dependency_id", Integer, ForeignKey("dependency.id"), primary_key=True),
+    Column("dependency_id", Integer, ForeignKey("dependency.id"), primary_key=True, index=True),
 )
 
 
 class File(DecBase):
-    __tablename__ = "file"
+    __tablename__ = layout.File.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)  # the file name on disk
+    name = Column(String, index=True)  # the file name on disk
     comment = Column(String)
+    digest = Column(String)  # hash of the content, defines and parser version. Used by incremental builds
     modules = relationship("Module")
     dependencies = relationship("Dependency", secondary=file_dep_assoc, backref="files")
     subroutines = relationship("FileSubroutine", backref="file")
     # configure table inheritance
     type = Column(String)
 
-    __mapper_args__ = {"polymorphic_identity": "file", "polymorphic_on": type}
+    __mapper_args__ = {"polymorphic_identity": layout.File.identity, "polymorphic_on": type}
 
     def __repr__(self):
         return f"<File name={self.name} id={self.id} at {id(self):0x}>"
@@ -45,11 +56,11 @@ class File(DecBase):
 class ProgramFile(File):
     """A program file is the same as File but with optional subroutines"""
 
-    __tablename__ = "program"
+    __tablename__ = layout.ProgramFile.name
 
     id = Column(Integer, ForeignKey("file.id"), primary_key=True)
 
-    __mapper_args__ = {"polymorphic_identity": "program"}
+    __mapper_args__ = {"polymorphic_identity": layout.ProgramFile.identity}
 
     def __repr__(self):
         return "<ProgramFile name={} id={} at {:0x}>".format(
@@ -58,14 +69,16 @@ class ProgramFile(File):
 
 
 class Dependency(DecBase):
-    __tablename__ = "dependency"
+    __tablename__ = layout.Dependency.name
 
     id = Column(Integer, primary_key=True)
     # non unique because it seems similarly named modules are defined. It may or may not match a module name
-    name = Column(String)
+    name = Column(String, index=True)
+    # Fortran names are case-insensitive, match on this one so the lookups use an index
+    name_lower = Column(String, Computed("lower(name)", persisted=True), index=True)
 
     type = Column(String)
-    __mapper_args__ = {"polymorphic_identity": "dependency", "polymorphic_on": type}
+    __mapper_args__ = {"polymorphic_identity": layout.Dependency.identity, "polymorphic_on": type}
 
     def __repr__(self):
         return "<Dependency name={} id={} at {:0x}>".format(
@@ -76,26 +89,26 @@ class Dependency(DecBase):
 class Interface(DecBase):
     """Belong to modules"""
 
-    __tablename__ = "inteface"
+    __tablename__ = layout.Interface.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
     procedure_names = Column(
         String
     )  # comma-separated list of procedure names. Could be complicated by linking to subroutine names. Ain't worth it
-    module_id = Column(Integer, ForeignKey("module.id"))
+    module_id = Column(Integer, ForeignKey("module.id"), index=True)
 
     def __repr__(self):
         return f"<Interface name={self.name} at {id(self):0x}>"
 
 
 class Generic(DecBase):
-    __tablename__ = "generic"
+    __tablename__ = layout.Generic.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)  # the mapper subroutine name
+    name = Column(String, index=True)  # the mapper subroutine name
     associated_procedures = Column(String)  # comma-separated strings
-    class_id = Column(Integer, ForeignKey("class.id"))
+    class_id = Column(Integer, ForeignKey("class.id"), index=True)
 
     def __repr__(self):
         return f"<Generic {self.name} at {id(self):0x}>"
@@ -104,12 +117,13 @@ class Generic(DecBase):
 class Module(DecBase):
     """Represents a Fortran module"""
 
-    __tablename__ = "module"
+    __tablename__ = layout.Module.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
+    name_lower = Column(String, Computed("lower(name)", persisted=True), index=True)
     comment = Column(String)
-    file_id = Column(Integer, ForeignKey("file.id"))
+    file_id = Column(Integer, ForeignKey("file.id"), index=True)
     # a dependency won't always have a module. It may've been parsed from a file
     dependencies = relationship(
         "Dependency", secondary=module_dep_assoc, backref="modules"
@@ -118,7 +132,7 @@ class Module(DecBase):
     subroutines = relationship("ModuleSubroutine", backref="module")
     interfaces = relationship("Interface", backref="module")
 
-    __mapper_args__ = {"polymorphic_identity": "module"}
+    __mapper_args__ = {"polymorphic_identity": layout.Module.identity}
 
     def __repr__(self):
         return f"<Module name={self.name} id={self.id} at {id(self):0x}>"
@@ -127,16 +141,17 @@ class Module(DecBase):
 class Class(DecBase):
     """Represents a Fortran type"""
 
-    __tablename__ = "class"
+    __tablename__ = layout.Class.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
+    name_lower = Column(String, Computed("lower(name)", persisted=True), index=True)
     comment = Column(String)
     # Fortran 2003 doesn't support multiple-inheritance, so single parent
-    parent_id = Column(Integer, ForeignKey("class.id"))
+    parent_id = Column(Integer, ForeignKey("class.id"), index=True)
     access_modifier = Column(String)  # private/public...
     # I'll assume each class belongs to a module
-    module_id = Column(Integer, ForeignKey("module.id"))
+    module_id = Column(Integer, ForeignKey("module.id"), index=True)
     subroutines = relationship(
         "ClassSubroutine", backref="clazz"
     )  # can't use class as column name
@@ -157,10 +172,10 @@ class Class(DecBase):
 class Subroutine(DecBase):
     """A general subroutine or function. Doesn't belong to a class nor a program"""
 
-    __tablename__ = "subroutine"
+    __tablename__ = layout.Subroutine.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
     alias = Column(String)
     comment = Column(String)
     category = Column(String)  # subroutine or function, always lowercase
@@ -169,7 +184,7 @@ class Subroutine(DecBase):
     arguments = relationship("SubroutineArgument", backref="subroutine")
 
     type = Column(String)
-    __mapper_args__ = {"polymorphic_identity": "subroutine", "polymorphic_on": type}
+    __mapper_args__ = {"polymorphic_identity": layout.Subroutine.identity, "polymorphic_on": type}
 
     def __repr__(self):
         return "<Subroutine name={} id={} at {:0x}>".format(
@@ -180,12 +195,12 @@ class Subroutine(DecBase):
 class FileSubroutine(Subroutine):
     """Represents a file/program subroutine"""
 
-    __tablename__ = "filesub"
+    __tablename__ = layout.FileSubroutine.name
 
     id = Column(Integer, ForeignKey("subroutine.id"), primary_key=True)
-    file_id = Column(Integer, ForeignKey("file.id"))
+    file_id = Column(Integer, ForeignKey("file.id"), index=True)
 
-    __mapper_args__ = {"polymorphic_identity": "filesub"}
+    __mapper_args__ = {"polymorphic_identity": layout.FileSubroutine.identity}
 
     def __repr__(self):
         return "<FileSubroutine name={} id={} at {:0x}>".format(
@@ -196,12 +211,12 @@ class FileSubroutine(Subroutine):
 class ClassSubroutine(Subroutine):
     """Represents a class subroutine"""
 
-    __tablename__ = "classroutine"
+    __tablename__ = layout.ClassSubroutine.name
 
     id = Column(Integer, ForeignKey("subroutine.id"), primary_key=True)
-    class_id = Column(Integer, ForeignKey("class.id"))
+    class_id = Column(Integer, ForeignKey("class.id"), index=True)
 
-    __mapper_args__ = {"polymorphic_identity": "classroutine"}
+    __mapper_args__ = {"polymorphic_identity": layout.ClassSubroutine.identity}
 
     def __repr__(self):
         return "<ClassSubroutine name={} id={} at {:0x}>".format(
@@ -210,12 +225,12 @@ class ClassSubroutine(Subroutine):
 
 
 class ModuleSubroutine(Subroutine):
-    __tablename__ = "moduleroutine"
+    __tablename__ = layout.ModuleSubroutine.name
 
     id = Column(Integer, ForeignKey("subroutine.id"), primary_key=True)
-    module_id = Column(Integer, ForeignKey("module.id"))
+    module_id = Column(Integer, ForeignKey("module.id"), index=True)
 
-    __mapper_args__ = {"polymorphic_identity": "moduleroutine"}
+    __mapper_args__ = {"polymorphic_identity": layout.ModuleSubroutine.identity}
 
     def __repr__(self):
         return "<ModuleSubroutine name={} id={} at {:0x}>".format(
@@ -226,29 +241,29 @@ class ModuleSubroutine(Subroutine):
 class Variable(DecBase):
     """A superclass for class variables and subroutine arguments"""
 
-    __tablename__ = "variable"
+    __tablename__ = layout.Variable.name
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)  # like M
+    name = Column(String, index=True)  # like M
     full_name = Column(String)  # like M(this%love) or M(:)
     # an argument can be a parsed type or else (built-in, type from somewhere else...)
     type = Column(String)  # i'll set the column type as a string.
     extras = Column(String)  # a comma separated stuff after the argument type
     comment = Column(String)
     type_ = Column(String)
-    __mapper_args__ = {"polymorphic_identity": "variable", "polymorphic_on": type_}
+    __mapper_args__ = {"polymorphic_identity": layout.Variable.identity, "polymorphic_on": type_}
 
     def __repr__(self):
         return f"<Variable name={self.name} id={self.id} at {id(self):0x}>"
 
 
 class ClassVariable(Variable):
-    __tablename__ = "classvariable"
+    __tablename__ = layout.ClassVariable.name
 
     id = Column(Integer, ForeignKey("variable.id"), primary_key=True)
-    class_id = Column(Integer, ForeignKey("class.id"))
+    class_id = Column(Integer, ForeignKey("class.id"), index=True)
 
-    __mapper_args__ = {"polymorphic_identity": "classvariable"}
+    __mapper_args__ = {"polymorphic_identity": layout.ClassVariable.identity}
 
     def __repr__(self):
         return "<ClassVariable name={} id={} at {:0x}>".format(
@@ -257,12 +272,12 @@ class ClassVariable(Variable):
 
 
 class SubroutineArgument(Variable):
-    __tablename__ = "argument"
+    __tablename__ = layout.SubroutineArgument.name
 
     id = Column(Integer, ForeignKey("variable.id"), primary_key=True)
-    subroutine_id = Column(Integer, ForeignKey("subroutine.id"))
+    subroutine_id = Column(Integer, ForeignKey("subroutine.id"), index=True)
 
-    __mapper_args__ = {"polymorphic_identity": "subroutineargument"}
+    __mapper_args__ = {"polymorphic_identity": layout.SubroutineArgument.identity}
 
     def __repr__(self):
         return "<SubroutineArgument name={} id={} at {:0x}>".format(
@@ -270,5 +285,92 @@ class SubroutineArgument(Variable):
         )
 
 
-def createNewDatabase():
-    DecBase.metadata.create_all(engine)
+class ModelInfo(DecBase):
+    """What the model was parsed from, so it can be rendered without the parse options. Values are JSON"""
+
+    __tablename__ = "model_info"
+
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+    def __repr__(self):
+        return f"<ModelInfo {self.key}={self.value}>"
+
+
+class Database:
+    """
+    An SQLite database holding one model, in memory or in a file, with its own engine and session.
+    Nothing is shared between Databases, so each generation of documentation can have its own
+    """
+
+    def __init__(self, path=None, mustExist=False):
+        """
+        path:
+            The database file, a temporary memory database if None
+        mustExist:
+            Raise DatabaseError rather than create the file if there is none at path
+        """
+        if path is None:
+            # a single connection, as each connection to sqlite:// is a different memory database
+            self.engine = create_engine(
+                "sqlite://", echo=False, poolclass=StaticPool, connect_args={"check_same_thread": False}
+            )
+        else:
+            path = os.path.abspath(path)
+            if mustExist and not os.path.isfile(path):
+                raise DatabaseError(f"No database at {path}, parse the sources into it first")
+            self.engine = create_engine(f"sqlite:///{path}", echo=False)
+            event.listen(self.engine, "connect", _useWriteAheadLog)
+        event.listen(self.engine, "connect", _beginTransactionsExplicitly)
+        event.listen(self.engine, "begin", _begin)
+        self.path = path
+        self.session = sessionmaker(bind=self.engine)()
+
+    def createNew(self):
+        # an empty model, replacing any that was there. Done in the transaction of the session, so the previous
+        # model is only replaced when the new one is committed, and kept if filling it fails
+        self.session.close()
+        connection = self.session.connection()
+        DecBase.metadata.drop_all(connection)
+        DecBase.metadata.create_all(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION:d}")
+
+    def check(self):
+        # raises DatabaseError unless the database holds a model this version can read
+        name = self.path or "The memory database"
+        try:
+            with self.engine.connect() as connection:
+                version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+                has_tables = inspect(connection).has_table(ModelInfo.__tablename__)
+        except exc.DatabaseError as error:  # like a file that isn't SQLite
+            raise DatabaseError(f"{name} can't be read as a model database: {error.orig}") from error
+        if has_tables and version != SCHEMA_VERSION:
+            raise DatabaseError(
+                f"{name} has schema version {version:d} but version {SCHEMA_VERSION:d} is needed, "
+                "parse the sources again"
+            )
+        # the model info is committed with the rest of the model, so a parse that failed leaves none
+        if not has_tables or self.session.get(ModelInfo, "source_directories") is None:
+            raise DatabaseError(f"{name} holds no model, parse the sources into it first")
+
+    def close(self):
+        self.session.close()
+        self.engine.dispose()
+
+
+def _useWriteAheadLog(dbapiConnection, connectionRecord):
+    # readers, like a render or other tooling, are not blocked while a parse writes and see the previous model
+    # until it commits
+    cursor = dbapiConnection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def _beginTransactionsExplicitly(dbapiConnection, connectionRecord):
+    # the sqlite3 module only begins a transaction before inserts and updates, so the tables would be dropped and
+    # created outside of it. Leave that to _begin instead
+    dbapiConnection.isolation_level = None
+
+
+def _begin(connection):
+    connection.exec_driver_sql("BEGIN")
@@ -0,0 +1,69 @@
+"""
+The model kept in a source_model Database, written with bulk statements and read back with one query per table
+"""
+
+import json
+
+from sqlalchemy import delete, func, insert, select, update
+
+from . import layout
+from .repository import ModelRepository
+from .snapshot import ModelSnapshot
+from .source_model import DecBase, ModelInfo
+
+
+class SQLRepository(ModelRepository):
+    """The model in a source_model Database, read with the ORM"""
+
+    def __init__(self, database):
+        self._database = database
+        self._session = database.session
+
+    @staticmethod
+    def _table(table):
+        # the SQLAlchemy table of a layout.Table
+        return DecBase.metadata.tables[table.name]
+
+    def createNew(self):
+        self._database.createNew()
+
+    def maxId(self, table):
+        table = self._table(table)
+        return self._session.execute(select(func.max(table.c.id))).scalar() or 0
+
+    def insert(self, table, rows):
+        self._session.execute(insert(self._table(table)), rows)
+
+    def update(self, table, rowId, values):
+        table = self._table(table)
+        self._session.execute(update(table).where(table.c.id == rowId).values(values))
+
+    def detach(self, table, ownerColumn, ownerId):
+        table = self._table(table)
+        self._session.execute(update(table).where(table.c[ownerColumn] == ownerId).values({ownerColumn: None}))
+
+    def removeAssociations(self, table, column, value):
+        table = self._table(table)
+        self._session.execute(delete(table).where(table.c[column] == value))
+
+    def setModelInfo(self, **values):
+        for key, value in values.items():
+            self._session.merge(ModelInfo(key=key, value=json.dumps(value)))
+
+    def commit(self):
+        self._session.commit()
+
+    def modelInfo(self, key, default=None):
+        info = self._session.get(ModelInfo, key)
+        return json.loads(info.value) if info is not None else default
+
+    def snapshot(self):
+        tables = {}
+        associations = {}
+        for table in layout.TABLES:
+            rows = [dict(row) for row in self._session.execute(self._table(table).select()).mappings()]
+            if table in layout.ASSOCIATIONS:
+                associations[table.name] = rows
+            else:
+                tables[table.name] = {row["id"]: row for row in rows}
+        return ModelSnapshot(tables, associations)
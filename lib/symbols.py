@@ -0,0 +1,95 @@
+import os
+
+from .fshandler import FileSystemHandler
+
+# every perspective a page can link from
+PERSPECTIVES = (
+    FileSystemHandler.FROM_FILE_FOLDER,
+    FileSystemHandler.FROM_PROGRAM_FOLDER,
+    FileSystemHandler.FROM_CLASS_FOLDER,
+    FileSystemHandler.FROM_MODULE_FOLDER,
+    FileSystemHandler.FROM_INDEX_FOLDER,
+)
+
+
+class SymbolTable:
+    """
+    The documentation pages of the files, modules and classes of a model, with the links to them from every
+    perspective worked out once per run. Module and class names are looked up in any case, like Fortran does,
+    so TYPE(foo) finds the class Foo
+    """
+
+    def __init__(self, model, fshandler, sourceDirectories=None, githubRoot=None, githubSubdir=None):
+        """
+        model:
+            The snapshot.ModelSnapshot to index
+        sourceDirectories, githubRoot, githubSubdir:
+            For the GitHub URL of each file, none if githubRoot is None
+        """
+        self._source_directories = [os.path.normpath(directory) for directory in sourceDirectories or []]
+        self._github_root = githubRoot
+        self._github_subdir = githubSubdir
+        self._files = {}  # file id -> Symbol
+        for dbfile in model.files():
+            links = {perspective: fshandler.fileDocForPath(dbfile.name, perspective) for perspective in PERSPECTIVES}
+            self._files[dbfile.id] = SymbolTable.Symbol(
+                dbfile, fshandler.pureFileName(dbfile.name), links, url=self._gitHubURL(dbfile.name)
+            )
+        self._modules = {}  # lowercase name -> Symbol, the first module of that name
+        for dbmodule in model.modules():
+            links = {
+                perspective: fshandler.moduleDocForName(dbmodule.name, perspective) for perspective in PERSPECTIVES
+            }
+            symbol = SymbolTable.Symbol(dbmodule, dbmodule.name, links, file=self._files.get(dbmodule.file_id))
+            self._modules.setdefault(dbmodule.name.lower(), symbol)
+        self._classes = {}  # lowercase name -> Symbol, the first class of that name
+        self._exact_classes = {}  # name -> Symbol, so a class of exactly the name wins over other cases
+        for dbclass in model.classes():
+            links = {perspective: fshandler.classDocForName(dbclass.name, perspective) for perspective in PERSPECTIVES}
+            symbol = SymbolTable.Symbol(dbclass, dbclass.name, links)
+            self._classes.setdefault(dbclass.name.lower(), symbol)
+            self._exact_classes.setdefault(dbclass.name, symbol)
+
+    def file(self, fileId):
+        return self._files.get(fileId)
+
+    def module(self, name):
+        return self._modules.get(name.lower())
+
+    def dbclass(self, name):
+        return self._exact_classes.get(name) or self._classes.get(name.lower())
+
+    def _gitHubURL(self, filePath):
+        # the URL of the file under github root, by its path relative to the source directory it is in
+        if not self._github_root:
+            return None
+        normalized_file_path = os.path.normpath(filePath)
+        relative_path = None
+        for source_dir in self._source_directories:
+            try:
+                relative_path = os.path.relpath(normalized_file_path, source_dir)
+                # if the relative path doesn't start with "..", it's under this source directory
+                if not relative_path.startswith(".."):
+                    break
+            except ValueError:
+                # this can happen on Windows when paths are on different drives
+                continue
+        if relative_path is None or relative_path.startswith(".."):
+            # fallback: use just the filename if we can't determine relative path
+            relative_path = os.path.basename(filePath)
+        url_path = relative_path.replace("\\", "/")
+        if self._github_subdir:
+            url_path = f"{self._github_subdir.strip('/')}/{url_path}"
+        return f"{self._github_root.rstrip('/')}/blob/master/{url_path}"
+
+    class Symbol:
+        """A page: the record it documents, its caption, and its link from each perspective"""
+
+        __slots__ = ("record", "caption", "links", "file", "url")
+
+        def __init__(self, record, caption, links, file=None, url=None):
+            self.record = record
+            self.caption = caption
+            self.links = links
+            self.file = file  # the Symbol of the file of a module
+            self.url = url  # the GitHub URL of a file
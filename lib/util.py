@@ -1,35 +1,51 @@
-class ContinuationIterator:
+import codecs
+import contextlib
+import mmap
+import os
+import signal
+import threading
+
+# files at least this large are memory-mapped rather than read into a bytes object first
+MMAP_MIN_SIZE = 1 << 20
+
+
+def readSource(fileName, encoding="utf-8"):
     """
-    Takes a list of strings as input. Concatenates lines with ampersands to one line
-    before returning it. Acts as iterator
+    Reads a whole source file as text, in a single read. Bytes that aren't valid in the encoding are
+    replaced rather than raising, a byte order mark is dropped and line ends are normalized to \\n
     """
+    if encoding.lower().replace("_", "-") in ("utf-8", "utf8"):
+        encoding = "utf-8-sig"
+    with open(fileName, "rb") as fhandle:
+        size = os.fstat(fhandle.fileno()).st_size
+        if size >= MMAP_MIN_SIZE:
+            with mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                source = codecs.decode(mapped, encoding, "replace")
+        else:
+            source = codecs.decode(fhandle.read(), encoding, "replace")
+    if "\r" in source:
+        source = source.replace("\r\n", "\n").replace("\r", "\n")
+    return source
 
-    def __init__(self, lines):
-        self._lines = lines
-        self._current_index = 0
 
-    def __iter__(self):
-        return self
+@contextlib.contextmanager
+def timeLimit(seconds, exceptionClass):
+    """
+    Raises exceptionClass inside the with block once it has run for seconds, even in the middle of
+    a long regex match. Needs SIGALRM, so does nothing on Windows or outside the main thread,
+    where callers must check the time themselves
+    """
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
 
-    def __next__(self):
-        if len(self._lines) == self._current_index:
-            raise StopIteration
-        next_line = self._lines[self._current_index]
-        self._current_index += 1
-        continuation_lines = [next_line]
-        continuation_line = "&" in next_line
-        while continuation_line:
-            if len(self._lines) == self._current_index:
-                break
-            next_line = self._lines[self._current_index]
-            self._current_index += 1
-            continuation_line = "&" in next_line
-            if continuation_line:
-                continuation_lines.append(next_line)
-        if len(continuation_lines) > 1:  # must have found a multi-line thing
-            self._current_index -= 1  # since i'm now a line after continuation
-        continuation_lines = [line.replace("&", "").strip() for line in continuation_lines]
-        line = " ".join(continuation_lines)
-        return line
+    def expired(signum, frame):
+        raise exceptionClass()
 
-    next = __next__
+    previous_handler = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)